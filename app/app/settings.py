@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -45,17 +46,23 @@ INSTALLED_APPS = [
     # local
     'core',
     'user',
-    'recipe',
+    'recipe.apps.RecipeConfig',
 ]
 
 MIDDLEWARE = [
+    'core.instrumentation.InstrumentationMiddleware',
+    'core.load_shedding.LoadSheddingMiddleware',
+    'core.slow_queries.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.compression.CompressionMiddleware',
+    'core.throttling.RateLimitHeadersMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'app.urls'
@@ -137,3 +144,182 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 AUTH_USER_MODEL = 'core.USER'
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.ORJSONRenderer',
+        'core.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'core.throttling.SharedRateThrottle',
+    ],
+    # Proxies in front of the app, anonymous clients are throttled by the
+    # address this many hops back in X-Forwarded-For, by the peer address
+    # when 0 so clients can't pick their own
+    'NUM_PROXIES': 0,
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'core.parsers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# Response compression
+# Responses smaller than this many bytes are sent as they are
+COMPRESSION_MIN_SIZE = 200
+# Content types which are already compressed
+COMPRESSION_EXCLUDED_CONTENT_TYPES = [
+    'image/',
+    'video/',
+    'audio/',
+    'application/zip',
+    'application/gzip',
+    'application/zstd',
+    'font/woff2',
+]
+
+# Request metrics
+# Addresses allowed to scrape the metrics endpoint, staff can always read it
+METRICS_ALLOWED_IPS = ['127.0.0.1']
+
+# Load shedding
+LOAD_SHEDDING_ENABLED = True
+# Route class of url names, None never sheds, the other routes are write,
+# list or read by method and name
+LOAD_SHEDDING_ROUTE_CLASSES = {
+    'user:token': 'auth',
+    'user:create': 'auth',
+    'recipe:recipe-upload-image': 'upload',
+    'metrics': None,
+}
+# (initial, minimum, maximum) concurrency per process by route class,
+# password hashing only needs a few CPU bound requests at once
+LOAD_SHEDDING_LIMITS = {
+    'auth': (4, 1, 16),
+    'upload': (4, 1, 32),
+    'write': (20, 1, 100),
+    'list': (20, 1, 100),
+    'read': (40, 1, 200),
+}
+# Seconds a request stamped with X-Request-Start by the proxy may have
+# queued before it's shed
+LOAD_SHEDDING_MAX_QUEUE_TIME = 10
+# Retry-After of the shed requests
+LOAD_SHEDDING_RETRY_AFTER = 1
+
+# Slow query log
+SLOW_QUERY_THRESHOLD_MS = 100
+# Number of distinct query shapes kept in memory
+SLOW_QUERY_BUFFER_SIZE = 200
+# Fraction of slow SELECTs whose plan is captured with EXPLAIN
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = 0.1
+# Run EXPLAIN ANALYZE, this executes the query a second time
+SLOW_QUERY_EXPLAIN_ANALYZE = False
+
+# Request profiling
+# Fraction of requests profiled, requests with a valid X-Profile-Token
+# header (see `manage.py profile_token`) are always profiled. Requests are
+# profiled by the stack sampler, or cProfile with ?profile=cprofile or an
+# X-Profiler: cprofile header
+PROFILING_SAMPLE_RATE = 0
+PROFILING_TOKEN_MAX_AGE = 3600
+# Seconds between two samples of the stack sampler
+PROFILING_SAMPLE_INTERVAL = 0.001
+PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')
+# Number of profiles kept on disk, the oldest are removed first
+PROFILING_MAX_PROFILES = 50
+
+# Upper bound of the memory used by the pantry matching indexes of a process
+PANTRY_INDEX_MAX_BYTES = 64 * 1024 * 1024
+
+# Admin changelists estimate their row count from planner statistics on
+# Postgres, estimates below this number are replaced by an exact count
+ADMIN_ESTIMATED_COUNT_MIN = 10000
+
+# Background jobs, see core.jobs
+# Seconds an idle worker waits before polling the queue again
+JOBS_POLL_INTERVAL = 1.0
+# Seconds before the first retry of a failed job, doubled on every retry
+JOBS_RETRY_BACKOFF = 5
+JOBS_RETRY_BACKOFF_MAX = 3600
+
+# Deletion of users and recipes in the background, see recipe.deletion
+# Objects deleted per transaction
+DELETION_BATCH_SIZE = 500
+# Upper bound of the rows a purge deletes per second, cascades included
+DELETION_MAX_ROWS_PER_SECOND = 5000
+
+# Idempotency-Key header of the POST and PATCH endpoints, see
+# core.idempotency
+# Seconds a stored response is replayed to repeated requests
+IDEMPOTENCY_KEY_TTL = 24 * 3600
+# Seconds a repeated request waits for the first one to finish
+IDEMPOTENCY_WAIT_TIMEOUT = 30
+# Seconds an in-flight key is held, renewed while its request runs
+IDEMPOTENCY_IN_FLIGHT_LEASE = 60
+
+# Batch endpoint, see core.batch
+# Requests accepted in one batch
+BATCH_MAX_REQUESTS = 50
+# Threads running the consecutive GETs of a parallel batch
+BATCH_MAX_WORKERS = 4
+
+# Server-Sent Events stream of the recipe changes, see core.events
+# Events a stream can fall behind by before it is reset
+SSE_QUEUE_SIZE = 100
+# Recent events kept to resume streams from their Last-Event-ID
+SSE_BUFFER_SIZE = 1000
+# Seconds between the keepalive comments of an idle stream
+SSE_KEEPALIVE = 15
+
+# Recipe JSON rendered ahead of time, see recipe.documents
+# Recipes rendered right after a commit, more are left to a background job
+RECIPE_DOCUMENTS_SYNC_LIMIT = 200
+
+# Rate limits shared by the workers of a host, see core.throttling
+# Memory mapped file of the token buckets, keep it on a tmpfs
+RATE_LIMIT_FILE = os.path.join(tempfile.gettempdir(),
+                               'recipe-app-rate-limits')
+# Buckets in the file, beyond that the least recently used are forgotten
+RATE_LIMIT_SLOTS = 65536
+# '<requests>/<s|m|h|d>' allowed per client by url name, 'default' for the
+# other routes, None for no limit
+RATE_LIMITS = {
+    'default': '600/m',
+    'recipe:recipe-list': '120/m',
+    'user:token': '10/m',
+}
+# Rates overriding RATE_LIMITS by user id
+RATE_LIMIT_USERS = {}
+
+# Gives the tests their own rate limit file
+TEST_RUNNER = 'core.tests.runner.TestRunner'
+
+# Tag and ingredient autocomplete, served from memory except on Postgres
+# Total number of names the autocomplete indexes of a process hold
+AUTOCOMPLETE_CACHE_MAX_ENTRIES = 1000000
+# Seconds before an index is rebuilt to pick up other processes' changes
+AUTOCOMPLETE_CACHE_TTL = 60
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'slow_queries': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': os.path.join(BASE_DIR, 'slow_queries.log'),
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'core.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
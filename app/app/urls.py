@@ -18,8 +18,16 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from core import views as core_views
+
 urlpatterns = [
+    path('admin/slow-queries/',
+         admin.site.admin_view(core_views.slow_queries),
+         name='slow-queries'),
     path('admin/', admin.site.urls),
     path('api/user/', include('user.urls')),
     path('api/recipe/', include('recipe.urls')),
+    path('api/core/', include('core.urls')),
+    path('api/batch/', core_views.BatchView.as_view(), name='batch'),
+    path('metrics/', core_views.metrics, name='metrics'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
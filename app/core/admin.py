@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.db.models.functions import Lower
 from django.utils.translation import gettext as _
 from . import models
+from .pagination import EstimatedCountPaginator
 
 
 class UserAdmin(BaseUserAdmin):
@@ -25,7 +27,94 @@ class UserAdmin(BaseUserAdmin):
     )
 
 
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Admin for tables too large to count, list or search naively. Owners
+    are picked by id, changelists are estimated and newest first, and
+    the search is a prefix match on lower(<prefix_search_field>), which
+    the trigram index serves, or an exact owner email.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    ordering = ('-id',)
+    prefix_search_field = 'name'
+    search_fields = ('name',)
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if '@' in term:
+            return queryset.filter(user__email=term), False
+
+        return queryset.annotate(
+            search_name=Lower(self.prefix_search_field)
+        ).filter(search_name__startswith=term.lower()), False
+
+
+class UsedListFilter(admin.SimpleListFilter):
+    """Filter tags and ingredients on their denormalized recipe count"""
+    title = _('used')
+    parameter_name = 'used'
+
+    def lookups(self, request, model_admin):
+        return (('yes', _('Yes')), ('no', _('No')))
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return queryset.filter(recipe_count__gt=0)
+        if self.value() == 'no':
+            return queryset.filter(recipe_count=0)
+
+
+class TimeListFilter(admin.SimpleListFilter):
+    """Filter recipes on ranges of their preparation time"""
+    title = _('time')
+    parameter_name = 'time'
+    ranges = {
+        '15': (None, 15),
+        '30': (16, 30),
+        '60': (31, 60),
+        'long': (61, None),
+    }
+
+    def lookups(self, request, model_admin):
+        return (('15', _('Up to 15 minutes')), ('30', _('16 to 30 minutes')),
+                ('60', _('31 to 60 minutes')), ('long', _('Over an hour')))
+
+    def queryset(self, request, queryset):
+        if self.value() not in self.ranges:
+            return queryset
+        low, high = self.ranges[self.value()]
+        if low is not None:
+            queryset = queryset.filter(time_minutes__gte=low)
+        if high is not None:
+            queryset = queryset.filter(time_minutes__lte=high)
+
+        return queryset
+
+
+class TagAdmin(LargeTableAdmin):
+    list_display = ['name', 'user', 'recipe_count']
+    list_filter = [UsedListFilter]
+    readonly_fields = ['recipe_count']
+
+
+class IngredientAdmin(TagAdmin):
+    pass
+
+
+class RecipeAdmin(LargeTableAdmin):
+    list_display = ['title', 'user', 'time_minutes', 'price']
+    list_filter = [TimeListFilter]
+    autocomplete_fields = ['tags', 'ingredients']
+    prefix_search_field = 'title'
+    search_fields = ('title',)
+
+
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
-admin.site.register(models.Recipe)
+admin.site.register(models.Tag, TagAdmin)
+admin.site.register(models.Ingredient, IngredientAdmin)
+admin.site.register(models.Recipe, RecipeAdmin)
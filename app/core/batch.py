@@ -0,0 +1,141 @@
+"""
+Many API requests in one HTTP call.
+
+Every sub-request is resolved and dispatched in process for the user who
+sent the batch, so the connection, authentication and middleware are paid
+once for the whole batch. Sub-requests run in order, with `parallel` the
+runs of consecutive GETs are spread over a thread pool of up to
+BATCH_MAX_WORKERS threads, each with its own database connection. A GET
+after a write still sees the write.
+
+The views which can be batched list BatchAuthentication last, it
+authenticates a sub-request as the user of its batch. What the views do
+themselves applies to every sub-request: permissions, the rate limits of
+its route and Idempotency-Key replays. The middleware only sees the
+batch: it's counted once in the request metrics and slow query
+attribution, takes one load shedding slot of the write class and gets the
+RateLimit headers and compression, sub-requests don't.
+"""
+import io
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connection
+from django.urls import Resolver404, resolve, reverse
+from rest_framework.authentication import BaseAuthentication
+
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = '/api/'
+# headers of the batch request passed on to every sub-request, the others
+# (authorization, idempotency key...) belong to the batch itself
+INHERITED_HEADERS = ('HTTP_HOST', 'HTTP_USER_AGENT', 'HTTP_X_FORWARDED_FOR',
+                     'HTTP_X_FORWARDED_PROTO', 'HTTP_ACCEPT_LANGUAGE')
+# response headers returned with every result
+RETURNED_HEADERS = ('Location',)
+
+
+class BatchAuthentication(BaseAuthentication):
+    """Authenticate a sub-request as the user who sent its batch"""
+
+    def authenticate(self, request):
+        # set by build_request, clients can't send it
+        return getattr(request._request, 'batch_auth', None)
+
+
+def error(status_code, detail):
+    return {'status': status_code, 'headers': {}, 'body': {'detail': detail}}
+
+
+def build_request(request, item):
+    """Return the WSGI request of a sub-request, authenticated as the batch"""
+    path, _, query = item['path'].partition('?')
+    body = b''
+    if item['method'] != 'GET' and 'body' in item:
+        body = json.dumps(item['body']).encode()
+
+    environ = {key: value for key, value in request.META.items()
+               if not key.startswith('HTTP_') or key in INHERITED_HEADERS}
+    environ.update({
+        'PATH_INFO': path,
+        'SCRIPT_NAME': '',
+        'REQUEST_METHOD': item['method'],
+        'QUERY_STRING': query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+    })
+    for name, value in item.get('headers', {}).items():
+        environ[f'HTTP_{name.upper().replace("-", "_")}'] = value
+
+    sub_request = WSGIRequest(environ)
+    sub_request.batch_auth = (request.user, request.auth)
+
+    return sub_request
+
+
+def execute(request, item):
+    """Run one sub-request, return its status, headers and body"""
+    path = item['path'].partition('?')[0]
+    if not path.startswith(API_PREFIX) or path == reverse('batch'):
+        return error(400, f'Only {API_PREFIX} endpoints can be batched.')
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return error(404, 'Not found.')
+
+    sub_request = build_request(request, item)
+    sub_request.resolver_match = match
+    try:
+        response = match.func(sub_request, *match.args, **match.kwargs)
+    except Exception:
+        logger.exception('Batched %s %s failed', item['method'],
+                         match.view_name)
+        return error(500, 'Server error.')
+
+    return {
+        'status': response.status_code,
+        'headers': {name: response[name] for name in RETURNED_HEADERS
+                    if response.has_header(name)},
+        # DRF responses aren't rendered yet, their data is the body
+        'body': getattr(response, 'data', None),
+    }
+
+
+def execute_in_thread(request, item):
+    try:
+        return execute(request, item)
+    finally:
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+def run(request, items, parallel=False):
+    """Run the sub-requests of a batch, return their results in order"""
+    if not parallel:
+        return [execute(request, item) for item in items]
+
+    max_workers = getattr(settings, 'BATCH_MAX_WORKERS', 4)
+    results = []
+    start = 0
+    while start < len(items):
+        end = start
+        while end < len(items) and items[end]['method'] == 'GET':
+            end += 1
+        if end - start < 2:
+            results.append(execute(request, items[start]))
+            start += 1
+            continue
+
+        with ThreadPoolExecutor(min(max_workers, end - start)) as pool:
+            results.extend(pool.map(
+                lambda item: execute_in_thread(request, item),
+                items[start:end]
+            ))
+        start = end
+
+    return results
@@ -0,0 +1,242 @@
+import io
+import math
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from urllib.parse import urlencode
+
+from django.db import connection
+from django.urls import URLPattern, URLResolver, reverse
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import Tag, Ingredient, Recipe
+from core.perfdata import PERF_PASSWORD
+
+
+BENCHMARK_URLCONFS = ('recipe.urls', 'user.urls')
+
+
+def walk_patterns(patterns, namespace):
+    """Yield the name and callback of every named url pattern"""
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from walk_patterns(pattern.url_patterns, namespace)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            # the router adds a `.json` style twin of every route
+            if 'format' in pattern.pattern.regex.groupindex:
+                continue
+            yield f'{namespace}:{pattern.name}', pattern
+
+
+def discover_routes(urlconfs=BENCHMARK_URLCONFS):
+    """Return the url patterns of the benchmarked url modules by name"""
+    routes = {}
+    for urlconf in urlconfs:
+        module = import_module(urlconf)
+        for name, pattern in walk_patterns(module.urlpatterns,
+                                           module.app_name):
+            routes.setdefault(name, pattern)
+
+    return routes
+
+
+def allowed_methods(pattern):
+    """Return the lowercase http methods a url pattern responds to"""
+    callback = pattern.callback
+    actions = getattr(callback, 'actions', None)
+    if actions:
+        return set(actions)
+    view_class = getattr(callback, 'view_class', None)
+    if view_class is not None:
+        return {method for method in view_class.http_method_names
+                if hasattr(view_class, method) and method != 'options'}
+    return {'get'}
+
+
+def sample_image():
+    """Return a tiny JPEG upload"""
+    image = io.BytesIO()
+    Image.new('RGB', (10, 10)).save(image, format='JPEG')
+    image.name = 'bench.jpg'
+    image.seek(0)
+    return image
+
+
+def first_name(model, user):
+    """Return the name of the object the detail routes are sent for"""
+    return model.objects.filter(user=user).order_by('id').values_list(
+        'name', flat=True).first()
+
+
+def post_payloads(user):
+    """Return functions building the payload of routes without GET"""
+    return {
+        'user:create': lambda: {
+            'email': f'bench-{uuid.uuid4().hex}@perf.example.com',
+            'password': PERF_PASSWORD,
+            'name': 'Bench user',
+        },
+        'user:token': lambda: {
+            'email': user.email,
+            'password': PERF_PASSWORD,
+        },
+        'recipe:recipe-upload-image': lambda: {'image': sample_image()},
+        # no recipe has this id, the benchmark data stays in place
+        'recipe:recipe-bulk-delete': lambda: {'ids': [0]},
+        # renamed to their own name and merged with new unused objects,
+        # the benchmark data stays in place
+        'recipe:tag-rename': lambda: {'name': first_name(Tag, user)},
+        'recipe:ingredient-rename': lambda: {
+            'name': first_name(Ingredient, user)},
+        'recipe:tag-merge': lambda: {'ids': [
+            Tag.objects.create(user=user, name='bench merged').id]},
+        'recipe:ingredient-merge': lambda: {'ids': [
+            Ingredient.objects.create(user=user, name='bench merged').id]},
+    }
+
+
+def query_params(user):
+    """Return the query parameters of the GET routes which need some"""
+    recipe_ids = Recipe.objects.filter(user=user).order_by(
+        'id').values_list('id', flat=True)[:50]
+    return {
+        'recipe:recipe-shopping-list': {
+            'recipes': ','.join(str(pk) for pk in recipe_ids)},
+    }
+
+
+def route_kwargs(pattern, user):
+    """Return the url kwargs of a route, using the user's first object"""
+    if 'pk' not in pattern.pattern.regex.groupindex:
+        return {}
+    model = pattern.callback.cls.queryset.model
+    obj = model.objects.filter(user=user).order_by('id').first()
+    return None if obj is None else {'pk': obj.pk}
+
+
+def build_requests(user, routes):
+    """
+    Return a (name, method, url, payload factory) tuple for every route,
+    GET is preferred, POST only routes need a known payload
+    """
+    payloads = post_payloads(user)
+    params = query_params(user)
+    requests, skipped = [], []
+    for name, pattern in sorted(routes.items()):
+        kwargs = route_kwargs(pattern, user)
+        methods = allowed_methods(pattern)
+        if kwargs is None:
+            skipped.append(name)
+        elif 'get' in methods:
+            url = reverse(name, kwargs=kwargs)
+            if name in params:
+                url = f'{url}?{urlencode(params[name])}'
+            requests.append((name, 'get', url, None))
+        elif 'post' in methods and name in payloads:
+            requests.append(
+                (name, 'post', reverse(name, kwargs=kwargs), payloads[name]))
+        else:
+            skipped.append(name)
+
+    return requests, skipped
+
+
+class QueryCounter:
+    """Execute wrapper counting the queries of the current thread"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(sorted_values, fraction):
+    """Return the nearest-rank percentile of sorted values"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(fraction * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def run_worker(token, method, url, payload, count):
+    """Send `count` requests, return their latencies and query count"""
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+    counter = QueryCounter()
+    latencies = []
+    errors = 0
+    try:
+        with connection.execute_wrapper(counter):
+            for _ in range(count):
+                data = payload() if payload else None
+                start = time.perf_counter()
+                if data is None:
+                    response = getattr(client, method)(url)
+                else:
+                    response = getattr(client, method)(
+                        url, data, format='multipart')
+                latencies.append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    errors += 1
+    finally:
+        if not connection.in_atomic_block:
+            connection.close()
+
+    return latencies, counter.count, errors
+
+
+def run_route(token, method, url, payload, concurrency, requests):
+    """Benchmark one route at a concurrency level"""
+    per_worker = max(requests // concurrency, 1)
+    start = time.perf_counter()
+    if concurrency == 1:
+        results = [run_worker(token, method, url, payload, per_worker)]
+    else:
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(
+                lambda _: run_worker(token, method, url, payload,
+                                     per_worker),
+                range(concurrency)
+            ))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(
+        latency for result in results for latency in result[0])
+    queries = sum(result[1] for result in results)
+    errors = sum(result[2] for result in results)
+    total = len(latencies)
+    return {
+        'requests': total,
+        'errors': errors,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'throughput_rps': total / elapsed if elapsed else 0.0,
+        'queries_per_request': queries / total if total else 0.0,
+    }
+
+
+def run_benchmark(user, concurrency_levels=(1,), requests=50,
+                  routes=None):
+    """
+    Benchmark every route for the user at each concurrency level,
+    return the results keyed by concurrency level then route name
+    """
+    token, _ = Token.objects.get_or_create(user=user)
+    requests_to_run, skipped = build_requests(
+        user, routes if routes is not None else discover_routes())
+
+    results = {}
+    for concurrency in concurrency_levels:
+        results[str(concurrency)] = {
+            name: run_route(token.key, method, url, payload, concurrency,
+                            requests)
+            for name, method, url, payload in requests_to_run
+        }
+
+    return results, skipped
@@ -0,0 +1,258 @@
+import logging
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class GzipCodec:
+    """Incremental gzip compressor"""
+    encoding = 'gzip'
+
+    def __init__(self):
+        # wbits=31 makes zlib write the gzip header and trailer
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCodec:
+    """Incremental brotli compressor"""
+    encoding = 'br'
+
+    def __init__(self):
+        # the default quality of 11 is far too slow for dynamic content
+        self._compressor = brotli.Compressor(quality=5)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class ZstdCodec:
+    """Incremental zstandard compressor"""
+    encoding = 'zstd'
+
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=3).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+def available_codecs():
+    """Return the usable codecs keyed by encoding, in server preference"""
+    codecs = {}
+    if zstandard is not None:
+        codecs[ZstdCodec.encoding] = ZstdCodec
+    if brotli is not None:
+        codecs[BrotliCodec.encoding] = BrotliCodec
+    codecs[GzipCodec.encoding] = GzipCodec
+
+    return codecs
+
+
+CODECS = available_codecs()
+
+
+def parse_accept_encoding(header):
+    """Return a dict of content-coding to q-value from Accept-Encoding"""
+    accepted = {}
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding] = quality
+
+    return accepted
+
+
+def negotiate_encoding(header, codecs=CODECS):
+    """Return the best codec the client accepts, or None"""
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get('*', 0.0)
+    best, best_quality = None, 0.0
+    # dict order is the server preference, so ties keep the earlier codec
+    for encoding, codec in codecs.items():
+        quality = accepted.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = codec, quality
+
+    return best
+
+
+class CompressionStats:
+    """Thread safe totals of compression ratio and CPU time per encoding"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def record(self, encoding, size_in, size_out, cpu_time):
+        with self._lock:
+            totals = self._totals.setdefault(
+                encoding,
+                {'responses': 0, 'bytes_in': 0, 'bytes_out': 0,
+                 'cpu_seconds': 0.0}
+            )
+            totals['responses'] += 1
+            totals['bytes_in'] += size_in
+            totals['bytes_out'] += size_out
+            totals['cpu_seconds'] += cpu_time
+
+    def snapshot(self):
+        """Return a copy of the totals with the overall ratio"""
+        with self._lock:
+            snapshot = {}
+            for encoding, totals in self._totals.items():
+                snapshot[encoding] = dict(totals)
+                if totals['bytes_out']:
+                    snapshot[encoding]['ratio'] = (
+                        totals['bytes_in'] / totals['bytes_out'])
+
+            return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+
+
+stats = CompressionStats()
+
+
+def record_compression(encoding, size_in, size_out, cpu_time):
+    """Record one compressed response"""
+    stats.record(encoding, size_in, size_out, cpu_time)
+    logger.debug('%s compressed %d -> %d bytes in %.3fms', encoding,
+                 size_in, size_out, cpu_time * 1000)
+
+
+def compress_sequence(codec_class, sequence):
+    """Compress an iterable of bytes chunk by chunk"""
+    codec = codec_class()
+    size_in = size_out = 0
+    cpu_time = 0.0
+    for item in sequence:
+        start = time.thread_time()
+        data = codec.compress(item) + codec.flush()
+        cpu_time += time.thread_time() - start
+        size_in += len(item)
+        size_out += len(data)
+        if data:
+            yield data
+
+    start = time.thread_time()
+    data = codec.finish()
+    cpu_time += time.thread_time() - start
+    size_out += len(data)
+    record_compression(codec.encoding, size_in, size_out, cpu_time)
+    if data:
+        yield data
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with the best encoding the client accepts,
+    choosing between zstd, brotli and gzip
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 200)
+        self.excluded_types = tuple(getattr(
+            settings, 'COMPRESSION_EXCLUDED_CONTENT_TYPES', ('image/',)))
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        return self.process_response(request, response)
+
+    def should_compress(self, response):
+        """Return True if the response is worth compressing"""
+        if response.has_header('Content-Encoding'):
+            return False
+        content_type = response.get('Content-Type', '').lower()
+        if content_type.startswith(self.excluded_types):
+            return False
+        if not response.streaming and len(response.content) < self.min_size:
+            return False
+
+        return True
+
+    def process_response(self, request, response):
+        if not self.should_compress(response):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        codec_class = negotiate_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if codec_class is None:
+            return response
+
+        if response.streaming:
+            # the compressed size is unknown until the stream is consumed
+            response.streaming_content = compress_sequence(
+                codec_class, response.streaming_content)
+            if response.has_header('Content-Length'):
+                del response['Content-Length']
+        else:
+            codec = codec_class()
+            start = time.thread_time()
+            compressed = codec.compress(response.content) + codec.finish()
+            cpu_time = time.thread_time() - start
+            # only send the compressed content if it's actually shorter
+            if len(compressed) >= len(response.content):
+                return response
+            record_compression(codec.encoding, len(response.content),
+                               len(compressed), cpu_time)
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # strong ETags no longer match the encoded bytes, so weaken them
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = codec_class.encoding
+
+        return response
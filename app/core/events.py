@@ -0,0 +1,258 @@
+"""
+Server-Sent Events stream of the changes to a user's recipes, tags and
+ingredients.
+
+Model signals publish an event to the in-process `broker` once their
+transaction commits. Every open stream subscribes with a bounded queue on
+the event loop, a stream whose client can't keep up is sent a `reset`
+event and closed, the client then refetches what it shows. The broker
+keeps the last SSE_BUFFER_SIZE events so a reconnecting client sending
+Last-Event-ID gets what it missed, or a `reset` when that's too old.
+
+The stream is a plain ASGI application placed in front of Django in
+app.asgi, idle connections are coroutines waiting on their queue instead
+of a thread each. Only changes made in the process serving a stream reach
+it, so run the API writes and the streams in the same ASGI process.
+"""
+import asyncio
+import json
+import threading
+import uuid
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from rest_framework.authtoken.models import Token
+
+
+EVENTS_PATH = '/api/recipe/events/'
+
+
+class Subscriber:
+    """Queue of the events of one stream, lives on the stream's loop"""
+
+    def __init__(self, user_id, loop, max_size, start):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(max_size)
+        self.overflowed = False
+        # sequence of the last event published before subscribing
+        self.start = start
+
+    def offer(self, event):
+        """Queue an event, must run on the loop"""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class Broker:
+    """Fan out the published events to the subscribers of their user"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._recent = deque(maxlen=self.buffer_size)
+        self._sequence = 0
+        # event ids of another process or run are unknown and too old
+        self.epoch = uuid.uuid4().hex[:8]
+
+    @property
+    def buffer_size(self):
+        return getattr(settings, 'SSE_BUFFER_SIZE', 1000)
+
+    @property
+    def queue_size(self):
+        return getattr(settings, 'SSE_QUEUE_SIZE', 100)
+
+    def event_id(self, sequence):
+        return f'{self.epoch}-{sequence}'
+
+    def parse_event_id(self, event_id):
+        """Return the sequence of one of our event ids, None otherwise"""
+        epoch, _, sequence = (event_id or '').partition('-')
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        return int(sequence)
+
+    def last_event_id(self):
+        with self._lock:
+            return self.event_id(self._sequence)
+
+    def publish(self, user_id, model, action, pk):
+        """Send an event to the user's streams, from any thread"""
+        with self._lock:
+            self._sequence += 1
+            event = (self._sequence, {
+                'model': model, 'action': action, 'id': pk})
+            self._recent.append((user_id, event))
+            subscribers = list(self._subscribers.get(user_id, ()))
+
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.offer, event)
+            except RuntimeError:
+                # the loop of a stream being torn down is closed
+                pass
+
+    def publish_on_commit(self, user_id, model, action, pk):
+        transaction.on_commit(
+            lambda: self.publish(user_id, model, action, pk))
+
+    def subscribe(self, user_id, loop):
+        """Return a subscriber queued every event published from now on"""
+        with self._lock:
+            subscriber = Subscriber(user_id, loop, self.queue_size,
+                                    self._sequence)
+            self._subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.user_id, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self._subscribers.pop(subscriber.user_id, None)
+
+    def missed(self, user_id, last_event_id):
+        """
+        Return the buffered events of a user after an event id, None if
+        some of them aren't buffered anymore
+        """
+        sequence = self.parse_event_id(last_event_id)
+        with self._lock:
+            if sequence is None or sequence > self._sequence:
+                return None
+            oldest = self._recent[0][1][0] if self._recent else (
+                self._sequence + 1)
+            if sequence + 1 < oldest:
+                return None
+            return [event for event_user_id, event in self._recent
+                    if event_user_id == user_id and event[0] > sequence]
+
+    def clear(self):
+        with self._lock:
+            self._recent.clear()
+
+
+broker = Broker()
+
+
+def format_event(event_id, name, data):
+    """Return an event in the text/event-stream format"""
+    return (f'id: {event_id}\nevent: {name}\n'
+            f'data: {json.dumps(data)}\n\n').encode()
+
+
+def user_for_token(key):
+    """Return the id of the active user of a token, None if there's none"""
+    token = Token.objects.select_related('user').filter(key=key).first()
+    if token is None or not token.user.is_active:
+        return None
+    return token.user_id
+
+
+async def send_unauthorized(send):
+    body = json.dumps(
+        {'detail': 'Authentication credentials were not provided.'}
+    ).encode()
+    await send({'type': 'http.response.start', 'status': 401,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'www-authenticate', b'Token')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def stream_events(scope, receive, send):
+    """ASGI application streaming the events of the authenticated user"""
+    headers = {name.decode('latin1').lower(): value.decode('latin1')
+               for name, value in scope['headers']}
+    keyword, _, key = headers.get('authorization', '').partition(' ')
+    user_id = None
+    if keyword == 'Token' and key:
+        user_id = await sync_to_async(user_for_token)(key.strip())
+    if user_id is None:
+        await send_unauthorized(send)
+        return
+
+    loop = asyncio.get_running_loop()
+    subscriber = broker.subscribe(user_id, loop)
+    disconnected = loop.create_task(wait_for_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream'),
+                                (b'cache-control', b'no-cache'),
+                                (b'x-accel-buffering', b'no')]})
+        last_event_id = headers.get('last-event-id')
+        sent = subscriber.start
+        if last_event_id:
+            missed = broker.missed(user_id, last_event_id)
+            if missed is None:
+                await send_reset(send, sent)
+                return
+            for sequence, data in missed:
+                await send_event(send, sequence, data)
+            sent = max([sequence for sequence, _ in missed],
+                       default=broker.parse_event_id(last_event_id))
+        await stream(subscriber, send, disconnected, sent)
+    finally:
+        broker.unsubscribe(subscriber)
+        disconnected.cancel()
+
+
+async def stream(subscriber, send, disconnected, sent):
+    """Send the queued events until the client leaves or falls behind"""
+    keepalive = getattr(settings, 'SSE_KEEPALIVE', 15)
+    while True:
+        if subscriber.overflowed:
+            await send_reset(send, sent)
+            return
+        get = asyncio.ensure_future(subscriber.queue.get())
+        done, _ = await asyncio.wait({get, disconnected}, timeout=keepalive,
+                                     return_when=asyncio.FIRST_COMPLETED)
+        if disconnected in done:
+            get.cancel()
+            return
+        if get not in done:
+            get.cancel()
+            # comments keep proxies from closing an idle stream
+            await send({'type': 'http.response.body', 'more_body': True,
+                        'body': b': keepalive\n\n'})
+            continue
+
+        sequence, data = get.result()
+        # events published while the missed ones were replayed
+        if sequence > sent:
+            await send_event(send, sequence, data)
+            sent = sequence
+
+
+async def send_event(send, sequence, data):
+    await send({'type': 'http.response.body', 'more_body': True,
+                'body': format_event(
+                    broker.event_id(sequence),
+                    f'{data["model"]}.{data["action"]}', data)})
+
+
+async def send_reset(send, sequence):
+    """Tell the client to refetch everything, then end the stream"""
+    await send({'type': 'http.response.body',
+                'body': format_event(broker.event_id(sequence), 'reset', {})})
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def route(application):
+    """Serve the event stream in front of an ASGI application"""
+    async def router(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+            await stream_events(scope, receive, send)
+        else:
+            await application(scope, receive, send)
+
+    return router
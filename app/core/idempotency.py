@@ -0,0 +1,262 @@
+"""
+Idempotency-Key support for the POST and PATCH endpoints.
+
+The first request with a key claims it by inserting an in-flight row, its
+response is stored on the row once it's finalized. A repeat of the request
+with the same key gets the stored response back without running again, a
+repeat arriving while the first request is still in flight polls the row
+until the response is stored. Keys are scoped to the authenticated user,
+anonymous keys only match requests with the same fingerprint. Server
+errors release the key so the request can be retried.
+
+An in-flight key is leased for IDEMPOTENCY_IN_FLIGHT_LEASE seconds and
+renewed by a thread while its request runs, however long it takes. A
+lease running out means the request died mid-way without telling whether
+it ran, so repeats get a 409 rather than running it again, until
+`manage.py prune_idempotency_keys` removes the key.
+
+Stored responses expire after IDEMPOTENCY_KEY_TTL seconds, expired rows
+are removed by `manage.py prune_idempotency_keys`.
+"""
+import hashlib
+import json
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from core.models import IdempotencyKey
+
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+# response headers stored and replayed with the data
+REPLAYED_HEADERS = ('Location',)
+
+
+class KeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = f'The {HEADER} was already used for another request.'
+    default_code = 'idempotency_key_reused'
+
+
+class RequestInProgress(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = (f'A request with this {HEADER} is still in progress, '
+                      f'retry later.')
+    default_code = 'idempotency_key_in_progress'
+
+
+class Replay(Exception):
+    """Raised with the stored response of a repeated request"""
+
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+def _canonical(value):
+    """Return a JSON encodable stand-in for the uploaded files"""
+    if isinstance(value, File):
+        digest = hashlib.sha256()
+        for chunk in value.chunks():
+            digest.update(chunk)
+        value.seek(0)
+        return digest.hexdigest()
+
+    return str(value)
+
+
+def fingerprint(request):
+    """
+    Return a hash of the method, path and parsed body of a request, so
+    retries with another multipart boundary still match
+    """
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    body = json.dumps(data, sort_keys=True, default=_canonical)
+
+    return hashlib.sha256(
+        f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def replay(stored):
+    """Return the response stored on a key"""
+    body = json.loads(stored.response)
+    response = Response(body['data'], status=stored.status_code,
+                        headers=body['headers'])
+    response['Idempotent-Replayed'] = 'true'
+
+    return response
+
+
+def in_flight_lease():
+    """Return the seconds an in-flight key is held between renewals"""
+    return getattr(settings, 'IDEMPOTENCY_IN_FLIGHT_LEASE', 60)
+
+
+def renew(claimed):
+    """Extend the lease of a key whose request is still in flight"""
+    IdempotencyKey.objects.filter(id=claimed.id, status_code=None).update(
+        expires=timezone.now() + timedelta(seconds=in_flight_lease()))
+
+
+class LeaseRenewer(threading.Thread):
+    """Renew the lease of a claimed key until its request is finalized"""
+
+    def __init__(self, claimed):
+        super().__init__(daemon=True)
+        self.claimed = claimed
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            # a third of the lease leaves room for a late renewal
+            while not self._stop_event.wait(in_flight_lease() / 3):
+                renew(self.claimed)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def claim(request, key):
+    """
+    Reserve a key for a request and return its row, raise Replay with the
+    response of an earlier identical request
+    """
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValidationError(
+            {HEADER: f'At most {MAX_KEY_LENGTH} characters are allowed.'})
+    digest = fingerprint(request)
+    if request.user.is_authenticated:
+        lookup = {'user': request.user, 'key': key}
+    else:
+        lookup = {'user': None, 'key': key, 'fingerprint': digest}
+    wait = getattr(settings, 'IDEMPOTENCY_WAIT_TIMEOUT', 30)
+    deadline = time.monotonic() + wait
+    delay = 0.01
+
+    while True:
+        try:
+            with transaction.atomic():
+                claimed = IdempotencyKey.objects.create(**{
+                    **lookup,
+                    'fingerprint': digest,
+                    'expires': timezone.now() + timedelta(
+                        seconds=in_flight_lease()),
+                })
+            claimed.renewer = LeaseRenewer(claimed)
+            claimed.renewer.start()
+            return claimed
+        except IntegrityError:
+            pass
+
+        stored = IdempotencyKey.objects.filter(**lookup).first()
+        if stored is None:
+            # released since the insert failed
+            continue
+        if stored.expires <= timezone.now():
+            if stored.status_code is None:
+                # the request died, it may have run
+                raise RequestInProgress()
+            IdempotencyKey.objects.filter(
+                id=stored.id, expires=stored.expires).delete()
+            continue
+        if stored.fingerprint != digest:
+            raise KeyReused()
+        if stored.status_code is not None:
+            raise Replay(replay(stored))
+        if time.monotonic() >= deadline:
+            raise RequestInProgress()
+
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+
+
+def stop_renewing(claimed):
+    renewer = getattr(claimed, 'renewer', None)
+    if renewer is not None:
+        renewer.stop()
+        claimed.renewer = None
+
+
+def release(claimed):
+    """Drop a claimed key so the request can run again"""
+    stop_renewing(claimed)
+    IdempotencyKey.objects.filter(id=claimed.id, status_code=None).delete()
+
+
+def complete(claimed, response):
+    """Store the response of a claimed key, release it on server errors"""
+    stop_renewing(claimed)
+    if response.status_code >= 500:
+        release(claimed)
+        return
+
+    ttl = getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 3600)
+    body = {
+        'data': getattr(response, 'data', None),
+        'headers': {name: response[name] for name in REPLAYED_HEADERS
+                    if response.has_header(name)},
+    }
+    IdempotencyKey.objects.filter(id=claimed.id).update(
+        status_code=response.status_code,
+        response=json.dumps(body, cls=JSONEncoder),
+        expires=timezone.now() + timedelta(seconds=ttl),
+    )
+
+
+def prune(batch_size=1000):
+    """Delete the expired keys in batches, return how many"""
+    pruned = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(
+            expires__lte=timezone.now()
+        ).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return pruned
+        pruned += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
+
+
+class IdempotentMixin:
+    """Honor the Idempotency-Key header of the POST and PATCH requests"""
+    idempotent_methods = ('POST', 'PATCH')
+    idempotency_key = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        key = request.headers.get(HEADER)
+        if key and request.method in self.idempotent_methods:
+            self.idempotency_key = claim(request, key)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, Replay):
+            return exc.response
+        try:
+            return super().handle_exception(exc)
+        except Exception:
+            if self.idempotency_key is not None:
+                release(self.idempotency_key)
+                self.idempotency_key = None
+            raise
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args,
+                                             **kwargs)
+        if self.idempotency_key is not None:
+            complete(self.idempotency_key, response)
+            self.idempotency_key = None
+
+        return response
@@ -0,0 +1,259 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connection
+
+from core import compression, load_shedding
+
+
+# upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0, float('inf'))
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Timings collected while handling a single request"""
+    __slots__ = ('start', 'query_count', 'db_time', 'serializer_time',
+                 'render_time', 'total_time', 'serializer_depth')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.query_count = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.render_time = 0.0
+        self.total_time = 0.0
+        self.serializer_depth = 0
+
+    def server_timing(self):
+        """Return the value of the Server-Timing header"""
+        return (
+            f'db;dur={self.db_time * 1000:.2f};'
+            f'desc="{self.query_count} queries", '
+            f'serializer;dur={self.serializer_time * 1000:.2f}, '
+            f'render;dur={self.render_time * 1000:.2f}, '
+            f'total;dur={self.total_time * 1000:.2f}'
+        )
+
+
+def current_metrics():
+    """Return the metrics of the request being handled, if any"""
+    return _current.get()
+
+
+@contextmanager
+def timed_serializer():
+    """Add the time spent in the block to the serializer timing"""
+    metrics = _current.get()
+    # nested serializers are already covered by the outermost one
+    if metrics is None or metrics.serializer_depth:
+        yield
+        return
+
+    metrics.serializer_depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serializer_time += time.perf_counter() - start
+        metrics.serializer_depth -= 1
+
+
+class TimedSerializerMixin:
+    """Serializer mixin recording the time spent (de)serializing"""
+
+    def to_representation(self, instance):
+        with timed_serializer():
+            return super().to_representation(instance)
+
+    def to_internal_value(self, data):
+        with timed_serializer():
+            return super().to_internal_value(data)
+
+
+def db_execute_wrapper(execute, sql, params, many, context):
+    """Database execute wrapper counting queries and their duration"""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_time += time.perf_counter() - start
+        metrics.query_count += 1
+
+
+class RouteHistogram:
+    """Latency histogram and timing totals for a single route"""
+    __slots__ = ('buckets', 'count', 'total', 'queries', 'db', 'serializer',
+                 'render')
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.queries = 0
+        self.db = 0.0
+        self.serializer = 0.0
+        self.render = 0.0
+
+    def observe(self, metrics):
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if metrics.total_time <= bound:
+                self.buckets[index] += 1
+                break
+        self.count += 1
+        self.total += metrics.total_time
+        self.queries += metrics.query_count
+        self.db += metrics.db_time
+        self.serializer += metrics.serializer_time
+        self.render += metrics.render_time
+
+
+class MetricsRegistry:
+    """Per process registry of the request histograms by route"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def observe(self, route, method, metrics):
+        with self._lock:
+            histogram = self._routes.get((route, method))
+            if histogram is None:
+                histogram = self._routes[(route, method)] = RouteHistogram()
+            histogram.observe(metrics)
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+    def render_prometheus(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        lines = [
+            '# HELP http_request_duration_seconds Request latency.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        with self._lock:
+            routes = sorted(self._routes.items())
+            for (route, method), histogram in routes:
+                labels = f'route="{route}",method="{method}"'
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram.buckets):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(
+                        f'http_request_duration_seconds_bucket'
+                        f'{{{labels},le="{le}"}} {cumulative}'
+                    )
+                lines.append(f'http_request_duration_seconds_sum{{{labels}}} '
+                             f'{histogram.total}')
+                lines.append(f'http_request_duration_seconds_count'
+                             f'{{{labels}}} {histogram.count}')
+
+            counters = (
+                ('http_request_db_queries_total', 'queries',
+                 'Database queries executed.'),
+                ('http_request_db_seconds_total', 'db',
+                 'Time spent in the database.'),
+                ('http_request_serializer_seconds_total', 'serializer',
+                 'Time spent in serializers.'),
+                ('http_request_render_seconds_total', 'render',
+                 'Time spent rendering responses.'),
+            )
+            for name, attr, help_text in counters:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} counter')
+                for (route, method), histogram in routes:
+                    lines.append(
+                        f'{name}{{route="{route}",method="{method}"}} '
+                        f'{getattr(histogram, attr)}'
+                    )
+
+        compression_totals = compression.stats.snapshot()
+        for name, key in (('http_response_compressed_bytes_in', 'bytes_in'),
+                          ('http_response_compressed_bytes_out', 'bytes_out'),
+                          ('http_response_compression_cpu_seconds',
+                           'cpu_seconds')):
+            lines.append(f'# TYPE {name} counter')
+            for encoding, totals in sorted(compression_totals.items()):
+                lines.append(
+                    f'{name}{{encoding="{encoding}"}} {totals[key]}')
+
+        limits = sorted(load_shedding.limiter.snapshot().items())
+        for name, key, help_text in (
+                ('http_requests_in_flight', 'in_flight',
+                 'Requests being handled.'),
+                ('http_concurrency_limit', 'limit',
+                 'Adaptive concurrency cap.')):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            for route_class, totals in limits:
+                lines.append(
+                    f'{name}{{route_class="{route_class}"}} {totals[key]}')
+        lines.append('# HELP http_requests_shed_total Requests answered 503 '
+                     'under overload.')
+        lines.append('# TYPE http_requests_shed_total counter')
+        for route_class, totals in limits:
+            for reason, count in sorted(totals['shed'].items()):
+                lines.append(
+                    f'http_requests_shed_total{{route_class="{route_class}",'
+                    f'reason="{reason}"}} {count}')
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def route_name(request):
+    """Return a low cardinality name for the route that served a request"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+
+    return match.view_name
+
+
+class InstrumentationMiddleware:
+    """
+    Record query count, db, serializer, render and total time of every
+    request, send them as a Server-Timing header and aggregate them per route
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            with connection.execute_wrapper(db_execute_wrapper):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        metrics.total_time = time.perf_counter() - metrics.start
+        response['Server-Timing'] = metrics.server_timing()
+        registry.observe(route_name(request), request.method, metrics)
+
+        return response
+
+    def process_template_response(self, request, response):
+        """Time the deferred rendering of DRF responses"""
+        metrics = _current.get()
+        if metrics is not None:
+            start = time.perf_counter()
+
+            def record_render_time(rendered):
+                metrics.render_time += time.perf_counter() - start
+
+            response.add_post_render_callback(record_render_time)
+
+        return response
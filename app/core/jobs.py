@@ -0,0 +1,255 @@
+"""
+Background jobs stored in the database and run by local worker processes.
+
+Tasks are functions registered with the `task` decorator in a `tasks`
+module of any installed app, `enqueue` stores a Job row for them. Workers
+started with `manage.py run_workers` claim the most urgent due job with
+SELECT ... FOR UPDATE SKIP LOCKED, so any number of them can poll the
+table without a broker and without blocking each other. Long tasks can
+store their progress on the job with `report_progress`.
+
+Failed attempts are retried with exponential backoff until the job runs
+out of attempts. An attempt longer than the job's timeout is interrupted,
+a worker dying mid job leaves a running job whose lease expires, which
+the next worker treats as a failed attempt.
+"""
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from core.models import Job
+
+
+logger = logging.getLogger(__name__)
+
+# seconds a lease outlives the job timeout before the job is taken back
+LEASE_GRACE = 30
+# longest stored error traceback
+MAX_ERROR_LENGTH = 10000
+
+tasks = {}
+# the job the current thread is running
+_current = threading.local()
+
+
+class JobTimeout(Exception):
+    """Raised in a job running past its timeout"""
+
+
+class Task:
+    """A function which can run as a background job"""
+
+    def __init__(self, func, name, priority, max_attempts, timeout):
+        self.func = func
+        self.name = name
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+
+    def __call__(self, **kwargs):
+        return self.func(**kwargs)
+
+    def enqueue(self, **kwargs):
+        return enqueue(self, **kwargs)
+
+
+def task(name=None, priority=0, max_attempts=3, timeout=300):
+    """Register a function as a task, its arguments must be JSON"""
+    def register(func):
+        task_name = name or f'{func.__module__}.{func.__qualname__}'
+        tasks[task_name] = Task(func, task_name, priority, max_attempts,
+                                timeout)
+        return tasks[task_name]
+
+    return register
+
+
+def enqueue(task, payload=None, user=None, priority=None, delay=0,
+            max_attempts=None, timeout=None):
+    """
+    Queue a task with the given keyword arguments, the job runs `delay`
+    seconds from now at the earliest
+    """
+    return Job.objects.create(
+        task=task.name,
+        payload=json.dumps(payload or {}, cls=DjangoJSONEncoder),
+        user=user,
+        priority=task.priority if priority is None else priority,
+        max_attempts=max_attempts or task.max_attempts,
+        timeout=timeout or task.timeout,
+        run_after=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def backoff(attempts):
+    """Return the seconds to wait before retrying after `attempts`"""
+    base = getattr(settings, 'JOBS_RETRY_BACKOFF', 5)
+    maximum = getattr(settings, 'JOBS_RETRY_BACKOFF_MAX', 3600)
+
+    return min(base * 2 ** (attempts - 1), maximum)
+
+
+def claim(worker):
+    """Lock the most urgent due job to the worker, None if there is none"""
+    now = timezone.now()
+    with transaction.atomic():
+        job = Job.objects.select_for_update(skip_locked=True).filter(
+            status=Job.QUEUED, run_after__lte=now
+        ).order_by('-priority', 'run_after', 'id').first()
+        if job is None:
+            return None
+
+        job.status = Job.RUNNING
+        job.attempts += 1
+        job.worker = worker
+        job.lease_expires = now + timedelta(seconds=job.timeout +
+                                            LEASE_GRACE)
+        job.save(update_fields=['status', 'attempts', 'worker',
+                                'lease_expires'])
+
+    return job
+
+
+def _finish(job, **fields):
+    """
+    Store the outcome of an attempt unless the job was taken back from
+    the worker meanwhile, return whether it was stored
+    """
+    return bool(Job.objects.filter(
+        id=job.id, status=Job.RUNNING, worker=job.worker,
+        attempts=job.attempts
+    ).update(lease_expires=None, **fields))
+
+
+def fail(job, error):
+    """Queue a retry of a failed attempt, or fail the job for good"""
+    error = error[-MAX_ERROR_LENGTH:]
+    if job.attempts >= job.max_attempts:
+        return _finish(job, status=Job.FAILED, error=error,
+                       finished=timezone.now())
+
+    return _finish(job, status=Job.QUEUED, error=error,
+                   run_after=timezone.now() +
+                   timedelta(seconds=backoff(job.attempts)))
+
+
+def requeue_expired():
+    """Fail the attempts of jobs whose worker died, return how many"""
+    with transaction.atomic():
+        expired = list(Job.objects.select_for_update(skip_locked=True).filter(
+            status=Job.RUNNING, lease_expires__lte=timezone.now()))
+        for job in expired:
+            logger.warning('Job %s of %s timed out', job.id, job.worker)
+            fail(job, f'Worker {job.worker} stopped responding')
+
+    return len(expired)
+
+
+@contextmanager
+def time_limit(seconds):
+    """Raise JobTimeout in the block after `seconds`, main thread only"""
+    if (not hasattr(signal, 'setitimer') or
+            threading.current_thread() is not threading.main_thread()):
+        yield
+        return
+
+    def timed_out(signum, frame):
+        raise JobTimeout(f'Job ran longer than {seconds} seconds')
+
+    previous = signal.signal(signal.SIGALRM, timed_out)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def execute(job):
+    """Run a claimed job and store its outcome"""
+    registered = tasks.get(job.task)
+    if registered is None:
+        return _finish(job, status=Job.FAILED,
+                       error=f'Unknown task {job.task}',
+                       finished=timezone.now())
+
+    _current.job = job
+    try:
+        with time_limit(job.timeout):
+            result = registered.func(**json.loads(job.payload))
+    except Exception:
+        logger.exception('Job %s (%s) failed', job.id, job.task)
+        return fail(job, traceback.format_exc())
+    finally:
+        _current.job = None
+
+    return _finish(job, status=Job.SUCCEEDED, error='',
+                   result=json.dumps(result, cls=DjangoJSONEncoder),
+                   finished=timezone.now())
+
+
+def report_progress(**progress):
+    """
+    Store the JSON progress of the job the calling task runs in, does
+    nothing when the task is called directly
+    """
+    job = getattr(_current, 'job', None)
+    if job is None:
+        return
+    Job.objects.filter(
+        id=job.id, status=Job.RUNNING, worker=job.worker,
+        attempts=job.attempts
+    ).update(progress=json.dumps(progress, cls=DjangoJSONEncoder))
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def work(burst=False, poll_interval=None, should_stop=lambda: False):
+    """
+    Run jobs until stopped, or until the queue is empty with `burst`,
+    return the number of jobs run
+    """
+    autodiscover_modules('tasks')
+    if poll_interval is None:
+        poll_interval = getattr(settings, 'JOBS_POLL_INTERVAL', 1.0)
+    worker = worker_name()
+
+    done = 0
+    next_expiry_check = 0
+    while not should_stop():
+        try:
+            if time.monotonic() >= next_expiry_check:
+                requeue_expired()
+                next_expiry_check = time.monotonic() + LEASE_GRACE
+            job = claim(worker)
+        except DatabaseError:
+            # a lost connection or lock conflict mustn't stop the worker
+            logger.exception('Worker %s could not claim a job', worker)
+            time.sleep(poll_interval)
+            continue
+
+        if job is None:
+            if burst:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        execute(job)
+        done += 1
+
+    return done
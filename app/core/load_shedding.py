@@ -0,0 +1,213 @@
+"""
+Adaptive concurrency limits, shedding the requests over them.
+
+Under overload, queued requests wait until they time out, the cheap ones
+along with the expensive ones, and the server does work nobody waits
+for anymore. Instead every process caps the requests it runs at once per
+route class: auth for the password hashing routes, upload, write, list
+and read. Requests over the cap get an immediate 503 with Retry-After,
+so the admitted requests still finish in time and a burst of token
+requests doesn't starve the profile reads.
+
+Each cap follows the latency of its class with a gradient limit: when
+requests slow down, because they queue for the CPU or the database, the
+ratio of the long term average latency to the latest one shrinks the
+cap, while latency holds the cap grows by a queue allowance of
+sqrt(cap). A class using less than half its cap doesn't grow it.
+
+The caps only see the requests of their process, with single threaded
+workers the queue is the listen backlog. Requests a proxy stamped with
+X-Request-Start are shed too when they already queued longer than
+LOAD_SHEDDING_MAX_QUEUE_TIME, their client has most likely given up.
+
+The requests in flight, caps and shed counts are exported with the
+request metrics.
+"""
+import math
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.http import JsonResponse
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# (initial, minimum, maximum) concurrency of the classes without limits
+DEFAULT_LIMITS = (20, 1, 200)
+# the latest latency may exceed the long term average by this factor
+# before the cap shrinks
+TOLERANCE = 1.5
+SMOOTHING = 0.2
+# requests averaged by the long term latency
+LONG_WINDOW = 600
+
+
+class GradientLimit:
+    """Concurrency cap of a route class following its latency"""
+
+    def __init__(self, initial, minimum, maximum):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.samples = 0
+        self.long_latency = None
+        self.shed = Counter()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a slot, return False when the class is at its cap"""
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                self.shed['limit'] += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency):
+        """Free a slot and adapt the cap to the latency of its request"""
+        latency = max(latency, 1e-6)
+        with self._lock:
+            in_flight = self.in_flight
+            self.in_flight -= 1
+            self.samples += 1
+            if self.long_latency is None:
+                self.long_latency = latency
+            else:
+                self.long_latency += ((latency - self.long_latency) /
+                                      min(self.samples, LONG_WINDOW))
+            # latency dropped for good, catch up faster than the window
+            if self.long_latency > 2 * latency:
+                self.long_latency *= 0.95
+            # the cap isn't what limits the requests
+            if in_flight < self.limit / 2:
+                return
+
+            gradient = max(0.5, min(1.0, TOLERANCE * self.long_latency /
+                                    latency))
+            limit = self.limit * gradient + math.sqrt(self.limit)
+            limit = self.limit * (1 - SMOOTHING) + limit * SMOOTHING
+            self.limit = min(max(limit, self.minimum), self.maximum)
+
+    def count_shed(self, reason):
+        with self._lock:
+            self.shed[reason] += 1
+
+
+class ConcurrencyLimiter:
+    """Per process registry of the limits by route class"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._limits = {}
+
+    def limit(self, route_class):
+        """Return the limit of a route class, created on first use"""
+        with self._lock:
+            limit = self._limits.get(route_class)
+            if limit is None:
+                limits = getattr(settings, 'LOAD_SHEDDING_LIMITS', {})
+                limit = self._limits[route_class] = GradientLimit(
+                    *limits.get(route_class, DEFAULT_LIMITS))
+            return limit
+
+    def reset(self):
+        with self._lock:
+            self._limits.clear()
+
+    def snapshot(self):
+        """Return the requests in flight, cap and shed counts by class"""
+        with self._lock:
+            limits = list(self._limits.items())
+
+        snapshot = {}
+        for route_class, limit in limits:
+            with limit._lock:
+                snapshot[route_class] = {'in_flight': limit.in_flight,
+                                         'limit': int(limit.limit),
+                                         'shed': dict(limit.shed)}
+
+        return snapshot
+
+
+limiter = ConcurrencyLimiter()
+
+
+def route_class(request):
+    """Return the class of the route of a request, None for unlimited ones"""
+    view_name = request.resolver_match.view_name
+    classes = getattr(settings, 'LOAD_SHEDDING_ROUTE_CLASSES', {})
+    if view_name in classes:
+        return classes[view_name]
+    if request.method not in SAFE_METHODS:
+        return 'write'
+    if view_name.endswith('-list'):
+        return 'list'
+
+    return 'read'
+
+
+def queue_time(request):
+    """Return the seconds since the proxy stamped X-Request-Start, if any"""
+    header = request.META.get('HTTP_X_REQUEST_START', '')
+    try:
+        start = float(header.replace('t=', '', 1))
+    except ValueError:
+        return None
+
+    # proxies stamp seconds, milliseconds or microseconds
+    while start > 1e11:
+        start /= 1000
+
+    return time.time() - start
+
+
+def overloaded():
+    response = JsonResponse(
+        {'detail': 'The server is overloaded, retry later.'}, status=503)
+    response['Retry-After'] = str(
+        getattr(settings, 'LOAD_SHEDDING_RETRY_AFTER', 1))
+
+    return response
+
+
+class LoadSheddingMiddleware:
+    """
+    Answer 503 to the requests over the concurrency cap of their route
+    class or queued too long
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            slot = getattr(request, 'concurrency_slot', None)
+            if slot is not None:
+                limit, start = slot
+                limit.release(time.perf_counter() - start)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Take a slot once the route is known"""
+        if not getattr(settings, 'LOAD_SHEDDING_ENABLED', True):
+            return None
+        name = route_class(request)
+        if name is None:
+            return None
+
+        limit = limiter.limit(name)
+        max_queue_time = getattr(settings, 'LOAD_SHEDDING_MAX_QUEUE_TIME',
+                                 None)
+        waited = queue_time(request)
+        if (max_queue_time is not None and waited is not None and
+                waited > max_queue_time):
+            limit.count_shed('queue_time')
+            return overloaded()
+        if not limit.acquire():
+            return overloaded()
+
+        request.concurrency_slot = (limit, time.perf_counter())
+        return None
@@ -0,0 +1,62 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from core.renderers import ORJSONRenderer, MessagePackRenderer
+
+
+RENDERERS = (
+    ('json', JSONRenderer),
+    ('orjson', ORJSONRenderer),
+    ('msgpack', MessagePackRenderer),
+)
+
+
+def sample_recipe_list(size, seed=0):
+    """Build a recipe list payload shaped like the RecipeSerializer output"""
+    rand = random.Random(seed)
+    return [
+        {
+            'id': recipe_id,
+            'title': f'sample recipe {recipe_id}',
+            'ingredients': rand.sample(range(1, 500), rand.randint(2, 12)),
+            'tags': rand.sample(range(1, 100), rand.randint(1, 5)),
+            'time_minutes': rand.randint(5, 180),
+            'price': Decimal(rand.randint(100, 99999)) / 100,
+            'link': f'https://example.com/recipes/{recipe_id}',
+        }
+        for recipe_id in range(1, size + 1)
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark encode time and payload size of the API renderers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,1000',
+                            help='comma separated recipe list sizes')
+        parser.add_argument('--repeat', type=int, default=50,
+                            help='number of renders per measurement')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        repeat = options['repeat']
+
+        self.stdout.write(
+            f'{"renderer":<10}{"recipes":>10}{"bytes":>12}{"usec":>12}')
+        for size in sizes:
+            data = sample_recipe_list(size)
+            for name, renderer_class in RENDERERS:
+                renderer = renderer_class()
+                payload = renderer.render(data, renderer.media_type, {})
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    renderer.render(data, renderer.media_type, {})
+                elapsed = (time.perf_counter() - start) / repeat
+                self.stdout.write(
+                    f'{name:<10}{size:>10}{len(payload):>12}'
+                    f'{elapsed * 1e6:>12.1f}'
+                )
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core import idempotency
+
+
+class Command(BaseCommand):
+    help = 'Delete the expired idempotency keys'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        pruned = idempotency.prune(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {pruned} expired idempotency keys'))
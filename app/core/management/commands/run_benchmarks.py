@@ -0,0 +1,126 @@
+import json
+import os
+import platform
+import subprocess
+import tempfile
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+from django.utils import timezone
+
+from core.benchmark import run_benchmark
+from core.perfdata import clear_perf_data
+from recipe.perfdata import seed_perf_data
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',')]
+
+
+def current_commit():
+    """Return the checked out git commit, if any"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Benchmark every recipe and user API route in-process on a '
+            'throwaway test database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int_list, default=[10, 100],
+                            help='comma separated recipes per user')
+        parser.add_argument('--concurrency', type=int_list,
+                            default=[1, 4], help='comma separated levels')
+        parser.add_argument('--requests', type=int, default=50,
+                            help='requests per route and level')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='write the JSON report here')
+        parser.add_argument('--compare',
+                            help='JSON report of an earlier run to diff')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True)
+        try:
+            # the benchmarked requests are neither throttled nor shed
+            with tempfile.TemporaryDirectory() as media_root, \
+                    tempfile.TemporaryDirectory() as rate_limit_dir, \
+                    override_settings(
+                        MEDIA_ROOT=media_root,
+                        RATE_LIMITS={},
+                        RATE_LIMIT_FILE=os.path.join(rate_limit_dir,
+                                                     'rate-limits'),
+                        LOAD_SHEDDING_ENABLED=False):
+                report = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                self.compare(json.load(baseline_file), report)
+
+    def run(self, options):
+        report = {
+            'commit': current_commit(),
+            'created': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'requests': options['requests'],
+            'sizes': {},
+        }
+        for size in options['sizes']:
+            clear_perf_data()
+            users = seed_perf_data(
+                users=2,
+                tags=max(size // 5, 1),
+                ingredients=max(size // 2, 1),
+                recipes=size,
+                seed=options['seed'],
+            )
+            results, skipped = run_benchmark(
+                users[0],
+                concurrency_levels=options['concurrency'],
+                requests=options['requests'],
+            )
+            report['sizes'][str(size)] = results
+            report['skipped'] = skipped
+
+        return report
+
+    def compare(self, baseline, report):
+        """Print the p95 latency and query count change of every route"""
+        self.stderr.write(
+            f'{"size":>6} {"conc":>5} {"route":<32}'
+            f'{"p95 ms":>18}{"queries":>16}')
+        for size, levels in report['sizes'].items():
+            for level, routes in levels.items():
+                for name, result in routes.items():
+                    before = baseline.get('sizes', {}).get(size, {}).get(
+                        level, {}).get(name)
+                    if before is None:
+                        continue
+                    self.stderr.write(
+                        f'{size:>6} {level:>5} {name:<32}'
+                        f'{before["p95_ms"]:>8.2f} -> {result["p95_ms"]:<6.2f}'
+                        f'{before["queries_per_request"]:>6.1f} -> '
+                        f'{result["queries_per_request"]:<6.1f}'
+                    )
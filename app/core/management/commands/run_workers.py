@@ -0,0 +1,67 @@
+import multiprocessing
+import os
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core import jobs
+
+
+def run_worker(burst, poll_interval):
+    """Entry point of a worker process, stops after its job on SIGTERM"""
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(1))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        jobs.work(burst=burst, poll_interval=poll_interval,
+                  should_stop=lambda: bool(stopping))
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs in a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int,
+                            default=os.cpu_count() or 1,
+                            help='number of worker processes, 0 runs jobs '
+                                 'in this process')
+        parser.add_argument('--burst', action='store_true',
+                            help='exit once no job is due')
+        parser.add_argument('--poll-interval', type=float,
+                            default=getattr(settings, 'JOBS_POLL_INTERVAL',
+                                            1.0),
+                            help='seconds between polls of an empty queue')
+
+    def handle(self, *args, **options):
+        burst = options['burst']
+        poll_interval = options['poll_interval']
+        if options['processes'] <= 0:
+            done = jobs.work(burst=burst, poll_interval=poll_interval)
+            self.stdout.write(self.style.SUCCESS(f'Ran {done} jobs'))
+            return
+
+        # forked workers must open their own database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(target=run_worker, args=(burst, poll_interval),
+                            daemon=False)
+            for _ in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f'Started {len(workers)} workers')
+
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping workers after their current job')
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
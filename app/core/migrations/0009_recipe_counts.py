@@ -0,0 +1,48 @@
+# Generated by Django 3.2.25 on 2026-10-19 10:46
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_recipes(apps, schema_editor):
+    """Fill in the recipe count of the existing tags and ingredients"""
+    Recipe = apps.get_model('core', 'Recipe')
+    for model_name, relation, column in (('Tag', 'tags', 'tag_id'),
+                                         ('Ingredient', 'ingredients',
+                                          'ingredient_id')):
+        model = apps.get_model('core', model_name)
+        links = getattr(Recipe, relation).through.objects.filter(
+            **{column: OuterRef('pk')}
+        ).order_by().values(column).annotate(count=Count('id'))
+        model.objects.update(recipe_count=Coalesce(
+            Subquery(links.values('count')), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_autocomplete_name_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['user', 'recipe_count', 'id'], name='core_ingred_user_id_44f404_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['user', 'recipe_count', 'id'], name='core_tag_user_id_cd342a_idx'),
+        ),
+        migrations.RunPython(count_recipes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:05
+
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    """Index lower(title) for the admin prefix search on Postgres"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX core_recipe_title_trgm_idx ON core_recipe '
+        'USING gin (lower(title) gin_trgm_ops)'
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS core_recipe_title_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_library_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_recipe_documents'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='librarystats',
+            name='pantry_version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -4,6 +4,8 @@ from django.db import models
 from django.contrib.auth.models import (AbstractBaseUser,
                                         BaseUserManager, PermissionsMixin)
 from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
 
 
 def recipe_image_file_path(instance, filename):
@@ -47,6 +49,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # deactivated and waiting for recipe.tasks.purge_user
+    pending_deletion = models.BooleanField(default=False)
 
     objects = UserManger()
 
@@ -60,6 +64,11 @@ class Tag(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
+    # number of recipes using it, kept up to date by recipe.counters
+    recipe_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'recipe_count', 'id'])]
 
     def __str__(self):
         return self.name
@@ -72,6 +81,11 @@ class Ingredient(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
+    # number of recipes using it, kept up to date by recipe.counters
+    recipe_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'recipe_count', 'id'])]
 
     def __str__(self):
         return self.name
@@ -88,6 +102,154 @@ class Recipe(models.Model):
     ingredients = models.ManyToManyField('Ingredient')
     tags = models.ManyToManyField('Tag')
     image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    # hidden from the API and waiting for recipe.tasks.purge_recipes
+    pending_deletion = models.BooleanField(default=False)
+
+    class Meta:
+        # back the range filters and orderings of the recipe list, the id
+        # breaks ties so ordered scans need no sort
+        indexes = [
+            models.Index(fields=['user', 'time_minutes', 'id']),
+            models.Index(fields=['user', 'price', 'id']),
+            models.Index(fields=['user', 'title', 'id']),
+            models.Index(fields=['user', 'id'],
+                         condition=Q(pending_deletion=True),
+                         name='core_recipe_pending_idx'),
+        ]
 
     def __str__(self):
         return self.title
+
+
+class RecipeSignature(models.Model):
+    """MinHash signature of the tags and ingredients of a recipe"""
+    recipe = models.OneToOneField('Recipe', on_delete=models.CASCADE,
+                                  primary_key=True,
+                                  related_name='signature')
+    signature = models.BinaryField()
+
+
+class RecipeBand(models.Model):
+    """LSH bucket of one band of a recipe signature"""
+    recipe = models.ForeignKey('Recipe', on_delete=models.CASCADE,
+                               related_name='bands')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE)
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'band', 'bucket'])]
+
+
+class RecipeDocument(models.Model):
+    """JSON of a recipe rendered ahead of time, see recipe.documents"""
+    recipe = models.OneToOneField('Recipe', on_delete=models.CASCADE,
+                                  primary_key=True,
+                                  related_name='document')
+    # RecipeDetailSerializer output
+    detail = models.TextField()
+    # RecipeSerializer output, an item of the recipe list
+    list_item = models.TextField()
+
+
+class LibraryStats(models.Model):
+    """Summary of a user's recipes, kept up to date by recipe.stats"""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL,
+                                on_delete=models.CASCADE, primary_key=True,
+                                related_name='library_stats')
+    recipe_count = models.PositiveIntegerField(default=0)
+    tag_count = models.PositiveIntegerField(default=0)
+    ingredient_count = models.PositiveIntegerField(default=0)
+    time_minutes_sum = models.BigIntegerField(default=0)
+    price_sum = models.DecimalField(max_digits=14, decimal_places=2,
+                                    default=0)
+    # fixed bucket int64 arrays, see recipe.stats
+    time_histogram = models.BinaryField(default=bytes)
+    price_histogram = models.BinaryField(default=bytes)
+    # bumped by every change of the user's recipe ingredients, see
+    # recipe.pantry
+    pantry_version = models.BigIntegerField(default=0)
+
+
+class Job(models.Model):
+    """Background job run by `manage.py run_workers`, see core.jobs"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+
+    task = models.CharField(max_length=255)
+    # JSON encoded keyword arguments of the task
+    payload = models.TextField(default='{}')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=QUEUED)
+    # higher runs first
+    priority = models.SmallIntegerField(default=0)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    # seconds an attempt may run
+    timeout = models.PositiveIntegerField(default=300)
+    run_after = models.DateTimeField(default=timezone.now)
+    # a running job whose lease expired belongs to a dead worker
+    lease_expires = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=255, blank=True)
+    result = models.TextField(blank=True)
+    # JSON encoded progress reported by the running task
+    progress = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE, null=True,
+                             blank=True, related_name='jobs')
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # the claim query walks this in order and skips locked rows
+            models.Index(fields=['-priority', 'run_after', 'id'],
+                         condition=Q(status='queued'),
+                         name='core_job_queued_idx'),
+            models.Index(fields=['lease_expires'],
+                         condition=Q(status='running'),
+                         name='core_job_running_idx'),
+            models.Index(fields=['user', '-id']),
+        ]
+
+    def __str__(self):
+        return f'{self.task} #{self.id} ({self.status})'
+
+
+class IdempotencyKey(models.Model):
+    """Response of a request sent with an Idempotency-Key header"""
+    # anonymous keys only match requests with the same fingerprint
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE, null=True,
+                             blank=True)
+    key = models.CharField(max_length=255)
+    # hash of the method, path and body of the request
+    fingerprint = models.CharField(max_length=64)
+    # null while the first request is in flight
+    status_code = models.PositiveSmallIntegerField(null=True)
+    # JSON encoded data and headers of the response
+    response = models.TextField(blank=True)
+    expires = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'],
+                                    condition=Q(user__isnull=False),
+                                    name='core_idempotency_user_key'),
+            models.UniqueConstraint(fields=['key', 'fingerprint'],
+                                    condition=Q(user__isnull=True),
+                                    name='core_idempotency_anonymous_key'),
+        ]
+
+    def __str__(self):
+        return self.key
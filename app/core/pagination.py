@@ -0,0 +1,54 @@
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def estimated_count(queryset):
+    """
+    Return the planner's estimate of the rows of a queryset on Postgres,
+    None elsewhere or when the table has never been analyzed
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+            estimate = row[0] if row else -1
+        else:
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = plan[0]['Plan']['Plan Rows']
+
+    return int(estimate) if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator counting large querysets from planner statistics instead of
+    a COUNT(*) over every matching row. Estimates below
+    ADMIN_ESTIMATED_COUNT_MIN are replaced by the exact count.
+    """
+
+    def estimate(self):
+        return estimated_count(self.object_list)
+
+    @cached_property
+    def count(self):
+        estimate = self.estimate()
+        minimum = getattr(settings, 'ADMIN_ESTIMATED_COUNT_MIN', 10000)
+        if estimate is not None and estimate >= minimum:
+            return estimate
+
+        return self.object_list.count()
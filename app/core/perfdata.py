@@ -0,0 +1,46 @@
+"""
+Synthetic perf users, the apps seed their data for them (see
+recipe.perfdata).
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+
+
+PERF_PASSWORD = 'perfpassword'
+
+
+def perf_email(prefix, index):
+    return f'{prefix}{index}@perf.example.com'
+
+
+def create_perf_users(users, prefix='perf', batch_size=1000):
+    """Bulk create the given number of perf users, return them by id"""
+    User = get_user_model()
+    # hashing is slow on purpose, every perf user shares one hash
+    password = make_password(PERF_PASSWORD)
+
+    emails = [perf_email(prefix, index) for index in range(users)]
+    User.objects.bulk_create(
+        [User(email=email, name=f'Perf user {index}', password=password)
+         for index, email in enumerate(emails)],
+        batch_size=batch_size
+    )
+    # not every backend returns primary keys from bulk_create
+    return list(User.objects.filter(email__in=emails).order_by('id'))
+
+
+def ids_by_user(model, user_ids):
+    """Return the ids of the rows of a model owned by each user"""
+    ids = {user_id: [] for user_id in user_ids}
+    rows = model.objects.filter(user_id__in=user_ids).order_by('id')
+    for user_id, pk in rows.values_list('user_id', 'id').iterator():
+        ids[user_id].append(pk)
+
+    return ids
+
+
+def clear_perf_data(prefix='perf'):
+    """Delete the perf users and everything they own"""
+    get_user_model().objects.filter(
+        email__startswith=prefix, email__endswith='@perf.example.com'
+    ).delete()
@@ -0,0 +1,198 @@
+import cProfile
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+
+
+PROFILE_HEADER = 'HTTP_X_PROFILE_TOKEN'
+PROFILER_HEADER = 'HTTP_X_PROFILER'
+# cProfile's per call hooks would skew the sampled wall clock times, a
+# request is profiled by one of them, the sampler unless asked otherwise
+PROFILERS = ('sample', 'cprofile')
+PROFILE_ID_RE = re.compile(r'^[0-9]+-[0-9a-f]{8}$')
+PROFILE_FORMATS = {
+    'pstats': '.prof',
+    'collapsed': '.collapsed',
+}
+
+_signer = signing.TimestampSigner(salt='core.profiling')
+
+
+def make_profile_token():
+    """Return a signed token which enables profiling of a request"""
+    return _signer.sign(uuid.uuid4().hex)
+
+
+def valid_profile_token(token):
+    """Return True if the token was signed by us and hasn't expired"""
+    max_age = getattr(settings, 'PROFILING_TOKEN_MAX_AGE', 3600)
+    try:
+        _signer.unsign(token, max_age=max_age)
+    except signing.BadSignature:
+        return False
+
+    return True
+
+
+def profile_dir():
+    return getattr(settings, 'PROFILING_DIR',
+                   os.path.join(settings.BASE_DIR, 'profiles'))
+
+
+class StackSampler(threading.Thread):
+    """Sample the stack of another thread into collapsed stack counts"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(
+                    f'{frame.f_globals.get("__name__", "?")}:{code.co_name}')
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def collapsed(self):
+        """Return the samples in the collapsed stack format of flamegraphs"""
+        return ''.join(
+            f'{stack} {count}\n' for stack, count in self.stacks.items())
+
+
+def save_profile(profiler, meta):
+    """Write a profile to the store, removing the oldest beyond the limit"""
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    profile_id = f'{time.time_ns()}-{uuid.uuid4().hex[:8]}'
+    base = os.path.join(directory, profile_id)
+
+    if isinstance(profiler, StackSampler):
+        with open(base + PROFILE_FORMATS['collapsed'], 'w') as collapsed:
+            collapsed.write(profiler.collapsed())
+    else:
+        profiler.dump_stats(base + PROFILE_FORMATS['pstats'])
+    with open(base + '.json', 'w') as meta_file:
+        json.dump(dict(meta, id=profile_id), meta_file)
+
+    limit = getattr(settings, 'PROFILING_MAX_PROFILES', 50)
+    for old in list_profiles()[limit:]:
+        delete_profile(old['id'])
+
+    return profile_id
+
+
+def list_profiles():
+    """Return the metadata of the stored profiles, newest first"""
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+
+    profiles = []
+    for name in os.listdir(directory):
+        profile_id, ext = os.path.splitext(name)
+        if ext != '.json' or not PROFILE_ID_RE.match(profile_id):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as meta_file:
+                profiles.append(json.load(meta_file))
+        except (OSError, ValueError):
+            continue
+
+    return sorted(profiles, key=lambda meta: meta['id'], reverse=True)
+
+
+def profile_path(profile_id, profile_format):
+    """Return the path of a stored profile file or None"""
+    if (not PROFILE_ID_RE.match(profile_id) or
+            profile_format not in PROFILE_FORMATS):
+        return None
+    path = os.path.join(profile_dir(),
+                        profile_id + PROFILE_FORMATS[profile_format])
+
+    return path if os.path.exists(path) else None
+
+
+def delete_profile(profile_id):
+    for ext in (*PROFILE_FORMATS.values(), '.json'):
+        try:
+            os.remove(os.path.join(profile_dir(), profile_id + ext))
+        except FileNotFoundError:
+            pass
+
+
+def requested_profiler(request):
+    """Return the profiler asked for by ?profile= or X-Profiler"""
+    profiler = request.GET.get('profile') or request.META.get(
+        PROFILER_HEADER)
+
+    return profiler if profiler in PROFILERS else PROFILERS[0]
+
+
+class ProfilingMiddleware:
+    """
+    Profile a sampled fraction of requests, and the requests carrying a
+    signed X-Profile-Token header, with the stack sampler or cProfile
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def should_profile(self, request):
+        token = request.META.get(PROFILE_HEADER)
+        if token:
+            return valid_profile_token(token)
+        rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+
+        return rate > 0 and random.random() < rate
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        kind = requested_profiler(request)
+        if kind == 'cprofile':
+            profiler = cProfile.Profile()
+            start_profiler, stop_profiler = profiler.enable, profiler.disable
+        else:
+            interval = getattr(settings, 'PROFILING_SAMPLE_INTERVAL', 0.001)
+            profiler = StackSampler(threading.get_ident(), interval)
+            start_profiler, stop_profiler = profiler.start, profiler.stop
+        start = time.perf_counter()
+        start_profiler()
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_profiler()
+
+        profile_id = save_profile(profiler, {
+            'profiler': kind,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'duration': time.perf_counter() - start,
+            'created': time.time(),
+        })
+        response['X-Profile-Id'] = profile_id
+
+        return response
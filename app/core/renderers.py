@@ -0,0 +1,106 @@
+import orjson
+import msgpack
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+# DRF's encoder already knows how to turn Decimal, datetime, uuid, lazy
+# strings and querysets into primitives, reuse it as the fallback hook
+# so every renderer produces the same values as the stock JSONRenderer
+_encoder = JSONEncoder()
+
+_ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME |
+                   orjson.OPT_NON_STR_KEYS)
+
+
+def encode_default(obj):
+    """Convert the types the fast encoders don't support natively"""
+    return _encoder.default(obj)
+
+
+class ORJSONRenderer(BaseRenderer):
+    """Renderer which serializes to JSON using orjson"""
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def get_indent(self, accepted_media_type, renderer_context):
+        """Return True when an indented output has been requested"""
+        if accepted_media_type:
+            params = dict(
+                param.strip().split('=', 1)
+                for param in accepted_media_type.split(';')[1:]
+                if '=' in param
+            )
+            if params.get('indent'):
+                return True
+
+        return bool(renderer_context.get('indent'))
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render `data` into JSON, returning a bytestring"""
+        if data is None:
+            return b''
+
+        options = _ORJSON_OPTIONS
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            options |= orjson.OPT_INDENT_2
+
+        ret = orjson.dumps(data, default=encode_default, option=options)
+        # keep the output safe for embedding in javascript, like
+        # the stock JSONRenderer does
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028')
+            ret = ret.replace(b'\xe2\x80\xa9', b'\\u2029')
+
+        return ret
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Renderer which serializes to MessagePack"""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render `data` into MessagePack, returning a bytestring"""
+        if data is None:
+            return b''
+
+        return msgpack.packb(data, default=encode_default,
+                             use_bin_type=True)
+
+
+class DocumentResponse(Response):
+    """
+    Response whose JSON body was rendered ahead of time. The orjson
+    renderer sends the document as is, the data is only parsed for the
+    other renderers and for code reading `.data`
+    """
+
+    def __init__(self, document, **kwargs):
+        super().__init__(**kwargs)
+        self.document = document
+
+    @property
+    def data(self):
+        if self._data is None and self.document is not None:
+            self._data = orjson.loads(self.document)
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    @property
+    def rendered_content(self):
+        renderer = getattr(self, 'accepted_renderer', None)
+        if (isinstance(renderer, ORJSONRenderer) and self._data is None
+                and not renderer.get_indent(self.accepted_media_type,
+                                            self.renderer_context)):
+            self['Content-Type'] = self.content_type or renderer.media_type
+            return self.document
+
+        return super().rendered_content
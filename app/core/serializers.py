@@ -0,0 +1,52 @@
+import json
+
+from django.conf import settings
+from rest_framework import serializers
+
+from core.instrumentation import TimedSerializerMixin
+from core.models import Job
+
+
+class JobSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Serializer for the status of background jobs"""
+    result = serializers.SerializerMethodField()
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = ('id', 'task', 'status', 'priority', 'attempts',
+                  'max_attempts', 'run_after', 'created', 'finished',
+                  'progress', 'result', 'error')
+        read_only_fields = fields
+
+    def get_result(self, job):
+        return json.loads(job.result) if job.result else None
+
+    def get_progress(self, job):
+        return json.loads(job.progress) if job.progress else None
+
+
+class BatchItemSerializer(serializers.Serializer):
+    """Serializer for one request of a batch"""
+    method = serializers.ChoiceField(
+        choices=('GET', 'POST', 'PUT', 'PATCH', 'DELETE'))
+    # path with the query string, like /api/recipe/recipes/?tags=1
+    path = serializers.CharField(max_length=2000)
+    body = serializers.JSONField(required=False)
+    headers = serializers.DictField(child=serializers.CharField(),
+                                    required=False)
+
+
+class BatchSerializer(serializers.Serializer):
+    """Serializer for a batch of API requests"""
+    requests = BatchItemSerializer(many=True, allow_empty=False)
+    # run consecutive GETs concurrently
+    parallel = serializers.BooleanField(default=False)
+
+    def validate_requests(self, requests):
+        maximum = getattr(settings, 'BATCH_MAX_REQUESTS', 50)
+        if len(requests) > maximum:
+            raise serializers.ValidationError(
+                f'At most {maximum} requests can be batched.')
+
+        return requests
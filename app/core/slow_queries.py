@@ -0,0 +1,193 @@
+import hashlib
+import logging
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+_view = ContextVar('slow_query_view', default=None)
+_explaining = ContextVar('slow_query_explaining', default=False)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_RE = re.compile(r'%s|\?')
+_IN_LIST_RE = re.compile(r'\bIN \(\?(?:, \?)*\)', re.IGNORECASE)
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    """Replace the literals and parameters of a query with placeholders"""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _PLACEHOLDER_RE.sub('?', sql)
+    # `id IN (?, ?, ?)` has the same shape whatever the list length
+    sql = _IN_LIST_RE.sub('IN (...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+def fingerprint(normalized_sql):
+    """Return a short stable identifier of a query shape"""
+    return hashlib.sha1(normalized_sql.encode()).hexdigest()[:16]
+
+
+class SlowQueryLog:
+    """
+    Bounded buffer of slow queries deduplicated by fingerprint, the least
+    recently seen shape is evicted first
+    """
+
+    def __init__(self, capacity=200):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def record(self, sql, duration, view):
+        """Record a slow query, return the entry and if its shape is new"""
+        normalized = normalize_sql(sql)
+        key = fingerprint(normalized)
+        now = timezone.now()
+        with self._lock:
+            entry = self._entries.get(key)
+            created = entry is None
+            if created:
+                entry = self._entries[key] = {
+                    'fingerprint': key,
+                    'sql': normalized,
+                    'views': set(),
+                    'count': 0,
+                    'total_time': 0.0,
+                    'max_time': 0.0,
+                    'first_seen': now,
+                    'plan': None,
+                }
+                while len(self._entries) > self.capacity:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+            entry['count'] += 1
+            entry['total_time'] += duration
+            entry['max_time'] = max(entry['max_time'], duration)
+            entry['last_time'] = duration
+            entry['last_seen'] = now
+            if view:
+                entry['views'].add(view)
+
+        return entry, created
+
+    def set_plan(self, key, plan):
+        with self._lock:
+            if key in self._entries:
+                self._entries[key]['plan'] = plan
+
+    def entries(self):
+        """Return a copy of the entries, most recently seen first"""
+        with self._lock:
+            return [
+                dict(entry, views=sorted(entry['views']))
+                for entry in reversed(self._entries.values())
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+slow_query_log = SlowQueryLog(
+    getattr(settings, 'SLOW_QUERY_BUFFER_SIZE', 200))
+
+
+def explain(conn, sql, params):
+    """Return the query plan of a SELECT statement"""
+    options = {}
+    if getattr(settings, 'SLOW_QUERY_EXPLAIN_ANALYZE', False):
+        options['analyze'] = True
+    prefix = conn.ops.explain_query_prefix(**options)
+
+    token = _explaining.set(True)
+    try:
+        # a failing EXPLAIN must not abort the transaction of the request
+        with transaction.atomic(using=conn.alias), conn.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql}', params)
+            return '\n'.join(
+                ' '.join(str(column) for column in row)
+                for row in cursor.fetchall()
+            )
+    finally:
+        _explaining.reset(token)
+
+
+def should_explain(sql):
+    """Return True if the plan of a query should be captured"""
+    if not sql.lstrip()[:6].upper() == 'SELECT':
+        return False
+    rate = getattr(settings, 'SLOW_QUERY_EXPLAIN_SAMPLE_RATE', 0.1)
+
+    return random.random() < rate
+
+
+def slow_query_wrapper(execute, sql, params, many, context):
+    """Database execute wrapper logging queries slower than the threshold"""
+    if _explaining.get():
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - start
+        threshold = getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', 100) / 1000
+        if duration >= threshold:
+            record_slow_query(context['connection'], sql, params, many,
+                              duration)
+
+
+def record_slow_query(conn, sql, params, many, duration):
+    """Add a slow query to the buffer and the log, sampling its plan"""
+    view = _view.get()
+    entry, created = slow_query_log.record(sql, duration, view)
+
+    plan = None
+    if not many and should_explain(sql):
+        try:
+            plan = explain(conn, sql, params)
+        except Exception as exc:
+            plan = f'EXPLAIN failed: {exc}'
+        slow_query_log.set_plan(entry['fingerprint'], plan)
+
+    if created or plan:
+        logger.warning(
+            'slow query %s %.1fms view=%s\n%s%s',
+            entry['fingerprint'], duration * 1000, view, entry['sql'],
+            f'\n{plan}' if plan else ''
+        )
+    else:
+        logger.warning('slow query %s %.1fms view=%s', entry['fingerprint'],
+                       duration * 1000, view)
+
+
+class SlowQueryMiddleware:
+    """Log the slow queries run while handling a request"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _view.set(None)
+        try:
+            with connection.execute_wrapper(slow_query_wrapper):
+                return self.get_response(request)
+        finally:
+            _view.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Remember which view is running the queries"""
+        _view.set(request.resolver_match.view_name)
@@ -0,0 +1,24 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Run the tests with a rate limit file of their own and no limits, so
+    runs and the tests of a run don't throttle each other. The rate limit
+    tests set the limits they need
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.rate_limit_dir = tempfile.TemporaryDirectory()
+        settings.RATE_LIMIT_FILE = os.path.join(self.rate_limit_dir.name,
+                                                'rate-limits')
+        settings.RATE_LIMITS = {}
+
+    def teardown_test_environment(self, **kwargs):
+        super().teardown_test_environment(**kwargs)
+        self.rate_limit_dir.cleanup()
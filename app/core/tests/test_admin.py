@@ -1,7 +1,12 @@
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.urls import reverse
 
+from core.models import Tag, Ingredient, Recipe
+from core.pagination import EstimatedCountPaginator, estimated_count
+
 
 class AdminSiteTests(TestCase):
 
@@ -40,3 +45,116 @@ class AdminSiteTests(TestCase):
         response = self.client.get(url)
 
         self.assertEqual(response.status_code, 200)
+
+
+class FixedEstimatePaginator(EstimatedCountPaginator):
+    """Paginator with a fixed planner estimate"""
+    fixed_estimate = None
+
+    def estimate(self):
+        return self.fixed_estimate
+
+
+class LargeTableAdminTests(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.admin_user = get_user_model().objects.create_superuser(
+            email="superuseremail@email.com",
+            password="password"
+        )
+        self.client.force_login(self.admin_user)
+        self.user = get_user_model().objects.create_user(
+            email="useremail@email.com",
+            password="password",
+            name="Test user name"
+        )
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.ingredient = Ingredient.objects.create(user=self.user,
+                                                    name='Olive oil')
+        self.recipe = Recipe.objects.create(user=self.user, title='Salad',
+                                            time_minutes=10, price=5.00)
+        self.recipe.tags.add(self.tag)
+
+    def test_changelist_queries_dont_grow(self):
+        """Test changelists don't run a query per owner"""
+        url = reverse('admin:core_recipe_changelist')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+
+        for index in range(10):
+            other_user = get_user_model().objects.create_user(
+                email=f'other{index}@email.com', password='password')
+            Recipe.objects.create(user=other_user, title=f'Soup {index}',
+                                  time_minutes=30, price=5.00)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+
+        self.assertContains(response, 'Soup 9')
+        self.assertEqual(len(many), len(few))
+
+    def test_recipe_change_page(self):
+        """Test the recipe change page doesn't list every tag"""
+        other_tag = Tag.objects.create(user=self.user, name='Dessert')
+        url = reverse('admin:core_recipe_change', args=[self.recipe.id])
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Vegan')
+        self.assertNotContains(response, other_tag.name)
+
+    def test_prefix_search(self):
+        """Test the search matches name prefixes and owner emails"""
+        Tag.objects.create(user=self.admin_user, name='Vegetarian')
+        Tag.objects.create(user=self.admin_user, name='Pescatarian')
+        url = reverse('admin:core_tag_changelist')
+
+        response = self.client.get(url, {'q': 'VEG'})
+
+        self.assertContains(response, 'Vegetarian')
+        self.assertContains(response, 'Vegan')
+        self.assertNotContains(response, 'Pescatarian')
+
+        response = self.client.get(url, {'q': self.user.email})
+
+        self.assertContains(response, 'Vegan')
+        self.assertNotContains(response, 'Vegetarian')
+
+    def test_list_filters(self):
+        """Test the used and time filters"""
+        Tag.objects.create(user=self.user, name='Unused')
+        Recipe.objects.create(user=self.user, title='Roast', time_minutes=90,
+                              price=5.00)
+
+        response = self.client.get(reverse('admin:core_tag_changelist'),
+                                   {'used': 'yes'})
+
+        self.assertContains(response, 'Vegan')
+        self.assertNotContains(response, 'Unused')
+
+        response = self.client.get(reverse('admin:core_recipe_changelist'),
+                                   {'time': 'long'})
+
+        self.assertContains(response, 'Roast')
+        self.assertNotContains(response, 'Salad')
+
+    def test_estimated_count(self):
+        """Test large estimates replace the exact count"""
+        queryset = Recipe.objects.order_by('id')
+        FixedEstimatePaginator.fixed_estimate = 123456
+        self.assertEqual(FixedEstimatePaginator(queryset, 10).count, 123456)
+
+        # small estimates are counted exactly
+        FixedEstimatePaginator.fixed_estimate = 50
+        self.assertEqual(FixedEstimatePaginator(queryset, 10).count, 1)
+
+    def test_estimate_unavailable(self):
+        """Test the exact count is used without planner statistics"""
+        paginator = EstimatedCountPaginator(Recipe.objects.order_by('id'),
+                                            10)
+
+        if connection.vendor != 'postgresql':
+            self.assertIsNone(estimated_count(paginator.object_list))
+        self.assertEqual(paginator.count, 1)
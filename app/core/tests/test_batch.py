@@ -0,0 +1,198 @@
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import Tag, Recipe
+
+
+BATCH_URL = reverse('batch')
+ME_URL = reverse('user:me')
+TAGS_URL = reverse('recipe:tag-list')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def get(path):
+    return {'method': 'GET', 'path': path}
+
+
+class BatchApiTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@email.com', 'testpassword', name='Test user')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def batch(self, *requests, **options):
+        return self.client.post(BATCH_URL, {'requests': list(requests),
+                                            **options}, format='json')
+
+    def test_login_required(self):
+        """Test that login is required to send a batch"""
+        response = APIClient().post(BATCH_URL, {'requests': [get(ME_URL)]},
+                                    format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_results_in_order(self):
+        """Test every sub-request gets its own status and body"""
+        Tag.objects.create(user=self.user, name='vegan')
+        recipe = Recipe.objects.create(user=self.user, title='Omelette',
+                                       time_minutes=5, price='3.00')
+
+        response = self.batch(get(ME_URL), get(f'{TAGS_URL}?ordering=name'),
+                              get(detail_url(recipe.id)),
+                              get(detail_url(recipe.id + 1)),
+                              get('/api/missing/'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['status'] for item in response.data],
+                         [200, 200, 200, 404, 404])
+        self.assertEqual(response.data[0]['body']['email'], self.user.email)
+        self.assertEqual([tag['name'] for tag in response.data[1]['body']],
+                         ['vegan'])
+        self.assertEqual(response.data[2]['body']['title'], 'Omelette')
+
+    def test_writes_run_in_order(self):
+        """Test a sub-request sees the writes of the ones before it"""
+        response = self.batch(
+            {'method': 'POST', 'path': TAGS_URL, 'body': {'name': 'vegan'}},
+            {'method': 'POST', 'path': TAGS_URL, 'body': {}},
+            get(TAGS_URL),
+        )
+
+        self.assertEqual([item['status'] for item in response.data],
+                         [201, 400, 200])
+        self.assertIn('name', response.data[1]['body'])
+        self.assertEqual(response.data[2]['body'],
+                         [{'id': response.data[0]['body']['id'],
+                           'name': 'vegan'}])
+
+    def test_authenticated_once(self):
+        """Test the sub-requests reuse the batch's authentication"""
+        with self.assertNumQueries(1):
+            response = self.batch(get(ME_URL), get(ME_URL), get(ME_URL))
+
+        self.assertEqual([item['status'] for item in response.data],
+                         [200, 200, 200])
+
+    def test_sub_request_headers(self):
+        """Test headers are sent per sub-request, not from the batch"""
+        create = {'method': 'POST', 'path': TAGS_URL,
+                  'body': {'name': 'vegan'},
+                  'headers': {'Idempotency-Key': 'tag-1'}}
+
+        response = self.client.post(
+            BATCH_URL, {'requests': [create, create]}, format='json',
+            HTTP_IDEMPOTENCY_KEY='batch-1')
+
+        self.assertEqual(response.data[1]['body'], response.data[0]['body'])
+        self.assertEqual(Tag.objects.count(), 1)
+
+    def test_sub_requests_rate_limited_by_route(self):
+        """Test every sub-request counts against the limit of its route"""
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(
+                    RATE_LIMIT_FILE=os.path.join(directory, 'buckets'),
+                    RATE_LIMITS={'recipe:tag-list': '1/m'}):
+            response = self.batch(get(TAGS_URL), get(TAGS_URL), get(ME_URL))
+
+        self.assertEqual([item['status'] for item in response.data],
+                         [200, 429, 200])
+        # the middleware only sees the batch
+        self.assertFalse(response.has_header('RateLimit-Limit'))
+
+    def test_sub_request_credentials(self):
+        """Test a sub-request sending credentials is authenticated by them"""
+        other = get_user_model().objects.create_user('other@email.com',
+                                                     'testpassword')
+        other_token = Token.objects.create(user=other)
+
+        response = self.batch(
+            get(ME_URL),
+            {'method': 'GET', 'path': ME_URL,
+             'headers': {'Authorization': f'Token {other_token.key}'}},
+            {'method': 'GET', 'path': ME_URL,
+             'headers': {'Authorization': 'Token invalid'}})
+
+        self.assertEqual([item['status'] for item in response.data],
+                         [200, 200, 401])
+        self.assertEqual([item['body'].get('email')
+                          for item in response.data[:2]],
+                         ['test@email.com', 'other@email.com'])
+
+    def test_only_api_requests(self):
+        """Test the admin and nested batches can't be batched"""
+        response = self.batch(get('/admin/'), get(BATCH_URL))
+
+        self.assertEqual([item['status'] for item in response.data],
+                         [400, 400])
+
+    @override_settings(BATCH_MAX_REQUESTS=2)
+    def test_invalid_batch(self):
+        """Test empty, malformed and oversized batches are rejected"""
+        for requests in ([], [{'path': ME_URL}], [get(ME_URL)] * 3):
+            response = self.client.post(BATCH_URL, {'requests': requests},
+                                        format='json')
+
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+            self.assertIn('requests', response.data)
+
+    def test_server_error_isolated(self):
+        """Test a failing sub-request doesn't fail the others"""
+        with patch('recipe.views.TagViewSet.list',
+                   side_effect=RuntimeError('boom')), \
+                self.assertLogs('core.batch', 'ERROR'):
+            response = self.batch(get(TAGS_URL), get(ME_URL))
+
+        self.assertEqual([item['status'] for item in response.data],
+                         [500, 200])
+
+
+class ParallelBatchApiTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@email.com',
+                                                         'testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_parallel_reads(self):
+        """Test concurrent GETs return what sequential ones return"""
+        recipes = [Recipe.objects.create(user=self.user, title=f'recipe {i}',
+                                         time_minutes=i, price='3.00')
+                   for i in range(6)]
+        requests = [get(detail_url(recipe.id)) for recipe in recipes]
+        requests.insert(3, {'method': 'DELETE',
+                            'path': detail_url(recipes[0].id)})
+        requests.append(get(detail_url(recipes[0].id)))
+
+        sequential = self.client.post(BATCH_URL, {'requests': requests},
+                                      format='json')
+        Recipe.objects.create(id=recipes[0].id, user=self.user,
+                              title='recipe 0', time_minutes=0,
+                              price='3.00')
+        parallel = self.client.post(
+            BATCH_URL, {'requests': requests, 'parallel': True},
+            format='json')
+
+        self.assertEqual(parallel.data, sequential.data)
+        self.assertEqual([item['status'] for item in parallel.data],
+                         [200, 200, 200, 204] + [200] * 3 + [404])
+        self.assertEqual(
+            [item['body']['title'] for item in parallel.data[4:7]],
+            ['recipe 3', 'recipe 4', 'recipe 5'])
@@ -0,0 +1,80 @@
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from core import benchmark
+from core.models import Tag, Ingredient, Recipe
+from recipe.perfdata import seed_perf_data
+
+
+class SeedPerfDataTests(TestCase):
+
+    def test_seed_creates_requested_rows(self):
+        """Test the seed creates every row and m2m link"""
+        users = seed_perf_data(users=2, tags=3, ingredients=4, recipes=5,
+                               tags_per_recipe=2, ingredients_per_recipe=3)
+
+        self.assertEqual(len(users), 2)
+        self.assertEqual(Tag.objects.count(), 6)
+        self.assertEqual(Ingredient.objects.count(), 8)
+        self.assertEqual(Recipe.objects.count(), 10)
+        self.assertEqual(Recipe.tags.through.objects.count(), 20)
+        self.assertEqual(Recipe.ingredients.through.objects.count(), 30)
+        for recipe in Recipe.objects.filter(user=users[0]):
+            for tag in recipe.tags.all():
+                self.assertEqual(tag.user_id, users[0].id)
+
+    def test_seed_is_deterministic(self):
+        """Test the same seed produces the same data"""
+        def snapshot():
+            return list(Recipe.objects.order_by('id').values_list(
+                'time_minutes', 'price'))
+
+        seed_perf_data(users=1, recipes=5, seed=7)
+        first = snapshot()
+        call_command('seed_perf_data', users=1, recipes=5, seed=7,
+                     clear=True, stdout=StringIO())
+
+        self.assertEqual(snapshot(), first)
+
+
+class BenchmarkTests(TestCase):
+
+    def test_discovers_every_route(self):
+        """Test the recipe and user routes are all discovered"""
+        routes = benchmark.discover_routes()
+
+        for name in ('recipe:recipe-list', 'recipe:recipe-detail',
+                     'recipe:recipe-upload-image', 'recipe:tag-list',
+                     'recipe:ingredient-list', 'user:create', 'user:token',
+                     'user:me'):
+            self.assertIn(name, routes)
+
+    def test_percentile(self):
+        """Test the nearest rank percentile"""
+        values = list(range(1, 101))
+
+        self.assertEqual(benchmark.percentile(values, 0.5), 50)
+        self.assertEqual(benchmark.percentile(values, 0.99), 99)
+        self.assertEqual(benchmark.percentile([], 0.5), 0.0)
+
+    def test_run_benchmark_reports_every_route(self):
+        """Test each route reports latency, throughput and query counts"""
+        user = seed_perf_data(users=1, recipes=3)[0]
+
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root):
+            results, skipped = benchmark.run_benchmark(user, requests=2)
+
+        self.assertEqual(skipped, [])
+        routes = results['1']
+        self.assertEqual(set(routes), set(benchmark.discover_routes()))
+        for result in routes.values():
+            self.assertEqual(result['requests'], 2)
+            self.assertEqual(result['errors'], 0)
+            self.assertGreater(result['throughput_rps'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertGreater(
+            routes['recipe:recipe-list']['queries_per_request'], 0)
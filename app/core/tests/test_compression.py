@@ -0,0 +1,120 @@
+import gzip
+
+import brotli
+import zstandard
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+
+from core import compression
+
+BODY = b'{"title": "sample recipe", "time_minutes": 5}' * 50
+
+
+def compress_response(response, accept_encoding):
+    """Run a response through the middleware for the given header"""
+    request = RequestFactory().get(
+        '/', HTTP_ACCEPT_ENCODING=accept_encoding)
+    middleware = compression.CompressionMiddleware(lambda req: response)
+    return middleware(request)
+
+
+class NegotiationTests(TestCase):
+
+    def test_prefers_server_order_on_ties(self):
+        """Test zstd is chosen when all encodings are equally accepted"""
+        codec = compression.negotiate_encoding('gzip, br, zstd')
+
+        self.assertEqual(codec.encoding, 'zstd')
+
+    def test_respects_quality_values(self):
+        """Test the client quality values win over server preference"""
+        codec = compression.negotiate_encoding('zstd;q=0.5, gzip')
+
+        self.assertEqual(codec.encoding, 'gzip')
+
+    def test_refused_encodings(self):
+        """Test q=0 and unknown encodings are not negotiated"""
+        self.assertIsNone(compression.negotiate_encoding('gzip;q=0'))
+        self.assertIsNone(compression.negotiate_encoding('identity'))
+        self.assertIsNone(compression.negotiate_encoding(''))
+
+
+class CompressionMiddlewareTests(TestCase):
+
+    def setUp(self):
+        compression.stats.reset()
+
+    def test_gzip_response(self):
+        """Test a response is gzipped and the stats are recorded"""
+        response = compress_response(
+            HttpResponse(BODY, content_type='application/json'), 'gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(response.content), BODY)
+        totals = compression.stats.snapshot()['gzip']
+        self.assertEqual(totals['bytes_in'], len(BODY))
+        self.assertGreater(totals['ratio'], 1)
+
+    def test_brotli_and_zstd_responses(self):
+        """Test the brotli and zstd encodings round trip"""
+        response = compress_response(
+            HttpResponse(BODY, content_type='application/json'), 'br')
+        self.assertEqual(brotli.decompress(response.content), BODY)
+
+        response = compress_response(
+            HttpResponse(BODY, content_type='application/json'), 'zstd')
+        self.assertEqual(response['Content-Encoding'], 'zstd')
+        self.assertEqual(
+            zstandard.ZstdDecompressor().decompressobj().decompress(
+                response.content),
+            BODY
+        )
+
+    @override_settings(COMPRESSION_MIN_SIZE=10000)
+    def test_small_response_not_compressed(self):
+        """Test responses under the threshold are left alone"""
+        response = compress_response(
+            HttpResponse(BODY, content_type='application/json'), 'gzip')
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, BODY)
+
+    def test_image_not_compressed(self):
+        """Test image responses are skipped"""
+        response = compress_response(
+            HttpResponse(BODY, content_type='image/jpeg'), 'gzip')
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_strong_etag_weakened(self):
+        """Test a strong ETag becomes weak once the body is encoded"""
+        original = HttpResponse(BODY, content_type='application/json')
+        original['ETag'] = '"abc"'
+
+        response = compress_response(original, 'gzip')
+
+        self.assertEqual(response['ETag'], 'W/"abc"')
+
+    def test_streaming_response_compressed_per_chunk(self):
+        """Test streaming bodies are compressed as each chunk arrives"""
+        chunks = [BODY, BODY, BODY]
+        consumed = []
+
+        def stream():
+            for chunk in chunks:
+                consumed.append(chunk)
+                yield chunk
+
+        response = compress_response(
+            StreamingHttpResponse(stream(), content_type='text/csv'), 'gzip')
+        content = iter(response.streaming_content)
+
+        first = next(content)
+        self.assertEqual(len(consumed), 1)
+        self.assertTrue(first)
+        body = first + b''.join(content)
+        self.assertEqual(gzip.decompress(body), BODY * 3)
+        self.assertEqual(
+            compression.stats.snapshot()['gzip']['bytes_in'], len(BODY) * 3)
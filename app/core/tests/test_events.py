@@ -0,0 +1,247 @@
+import asyncio
+import json
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from rest_framework.authtoken.models import Token
+
+from core import events
+from core.events import broker
+from core.models import Tag, Recipe
+from recipe import deletion
+
+
+def scope(token=None, last_event_id=None):
+    headers = []
+    if token:
+        headers.append((b'authorization', f'Token {token}'.encode()))
+    if last_event_id:
+        headers.append((b'last-event-id', last_event_id.encode()))
+    return {'type': 'http', 'path': events.EVENTS_PATH, 'headers': headers}
+
+
+def parse(messages):
+    """Return the (id, event, data) of the streamed events"""
+    parsed = []
+    for message in messages:
+        body = message.get('body', b'').decode()
+        if not body.startswith('id:'):
+            continue
+        fields = dict(line.split(': ', 1) for line in body.strip().split('\n'))
+        parsed.append((fields['id'], fields['event'],
+                       json.loads(fields['data'])))
+    return parsed
+
+
+async def wait_until(condition, timeout=2):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError('timed out')
+
+
+class StreamClient:
+    """Drive the event stream like an ASGI server would"""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.messages = []
+        self.inbox = asyncio.Queue()
+
+    async def send(self, message):
+        self.messages.append(message)
+
+    async def __aenter__(self):
+        self.task = asyncio.ensure_future(events.stream_events(
+            self.scope, self.inbox.get, self.send))
+        await wait_until(lambda: self.messages)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.inbox.put({'type': 'http.disconnect'})
+        await asyncio.wait_for(self.task, 2)
+
+    async def events(self, count):
+        await wait_until(lambda: len(parse(self.messages)) >= count)
+        return parse(self.messages)
+
+
+class EventStreamTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@email.com',
+                                                         'testpassword')
+        self.token = Token.objects.create(user=self.user)
+        broker.clear()
+
+    def test_authentication_required(self):
+        """Test a stream needs the token of an active user"""
+        async def scenario(scope):
+            messages = []
+
+            async def send(message):
+                messages.append(message)
+            await events.stream_events(scope, asyncio.Queue().get, send)
+            return messages
+
+        for stream_scope in (scope(), scope('invalid')):
+            messages = async_to_sync(scenario)(stream_scope)
+
+            self.assertEqual(messages[0]['status'], 401)
+
+    def test_user_events_streamed(self):
+        """Test a stream receives the events of its user only"""
+        other_user = get_user_model().objects.create_user('other@email.com',
+                                                          'testpassword')
+
+        async def scenario():
+            async with StreamClient(scope(self.token.key)) as client:
+                loop = asyncio.get_running_loop()
+                # signals publish from the threads running the requests
+                await loop.run_in_executor(
+                    None, broker.publish, self.user.id, 'recipe', 'created', 1)
+                broker.publish(other_user.id, 'recipe', 'created', 2)
+                broker.publish(self.user.id, 'tag', 'deleted', 3)
+                streamed = await client.events(2)
+            return client.messages, streamed
+
+        messages, streamed = async_to_sync(scenario)()
+
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'),
+                      messages[0]['headers'])
+        self.assertEqual([(event, data) for _, event, data in streamed], [
+            ('recipe.created', {'model': 'recipe', 'action': 'created',
+                                'id': 1}),
+            ('tag.deleted', {'model': 'tag', 'action': 'deleted', 'id': 3}),
+        ])
+
+    def test_resume_from_last_event_id(self):
+        """Test a reconnecting stream gets the events it missed first"""
+        broker.publish(self.user.id, 'recipe', 'created', 1)
+        last_event_id = broker.last_event_id()
+        broker.publish(self.user.id, 'recipe', 'updated', 1)
+
+        async def scenario():
+            async with StreamClient(
+                    scope(self.token.key, last_event_id)) as client:
+                broker.publish(self.user.id, 'recipe', 'deleted', 1)
+                return await client.events(2)
+
+        streamed = async_to_sync(scenario)()
+
+        self.assertEqual([event for _, event, _ in streamed],
+                         ['recipe.updated', 'recipe.deleted'])
+
+    def test_reset_when_events_are_lost(self):
+        """Test an unknown Last-Event-ID resets the client"""
+        async def scenario():
+            client = StreamClient(scope(self.token.key, 'old-12'))
+            await client.__aenter__()
+            await asyncio.wait_for(client.task, 2)
+            return parse(client.messages)
+
+        streamed = async_to_sync(scenario)()
+
+        self.assertEqual([event for _, event, _ in streamed], ['reset'])
+
+    @override_settings(SSE_QUEUE_SIZE=2)
+    def test_slow_client_reset(self):
+        """Test a stream falling behind is reset instead of growing"""
+        async def scenario():
+            client = StreamClient(scope(self.token.key))
+            await client.__aenter__()
+            for recipe_id in range(3):
+                broker.publish(self.user.id, 'recipe', 'created', recipe_id)
+            await asyncio.wait_for(client.task, 2)
+            return parse(client.messages)
+
+        streamed = async_to_sync(scenario)()
+
+        self.assertEqual([event for _, event, _ in streamed],
+                         ['recipe.created', 'reset'])
+
+    @override_settings(SSE_KEEPALIVE=0.01)
+    def test_keepalive(self):
+        """Test idle streams send keepalive comments"""
+        async def scenario():
+            async with StreamClient(scope(self.token.key)) as client:
+                await wait_until(lambda: any(
+                    message.get('body') == b': keepalive\n\n'
+                    for message in client.messages))
+
+        async_to_sync(scenario)()
+
+    def test_route(self):
+        """Test only the stream path bypasses the wrapped application"""
+        calls = []
+
+        async def application(scope, receive, send):
+            calls.append(scope['path'])
+
+        async_to_sync(events.route(application))(
+            {'type': 'http', 'path': '/api/recipe/recipes/'}, None, None)
+
+        self.assertEqual(calls, ['/api/recipe/recipes/'])
+
+
+class EventSignalTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@email.com',
+                                                         'testpassword')
+        self.last_event_id = broker.last_event_id()
+
+    def published(self):
+        return [(data['model'], data['action'], data['id'])
+                for _, data in broker.missed(self.user.id,
+                                             self.last_event_id)]
+
+    def test_changes_published_on_commit(self):
+        """Test writes publish their events once committed"""
+        with self.captureOnCommitCallbacks(execute=True):
+            tag = Tag.objects.create(user=self.user, name='vegan')
+            recipe = Recipe.objects.create(user=self.user, title='Omelette',
+                                           time_minutes=5, price='3.00')
+            self.assertEqual(self.published(), [])
+        tag_id = tag.id
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.tags.add(tag)
+            tag.delete()
+
+        self.assertEqual(self.published(), [
+            ('tag', 'created', tag_id),
+            ('recipe', 'created', recipe.id),
+            ('recipe', 'updated', recipe.id),
+            ('tag', 'deleted', tag_id),
+        ])
+
+    def test_reverse_clear_published(self):
+        """Test clearing the recipes of a tag streams them as updated"""
+        tag = Tag.objects.create(user=self.user, name='vegan')
+        recipes = [Recipe.objects.create(user=self.user, title=title,
+                                         time_minutes=5, price='3.00')
+                   for title in ('Omelette', 'Salad')]
+        tag.recipe_set.add(*recipes)
+        broker.clear()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.recipe_set.clear()
+
+        self.assertCountEqual(self.published(), [
+            ('recipe', 'updated', recipe.id) for recipe in recipes])
+
+    def test_bulk_delete_published(self):
+        """Test recipes marked for deletion are streamed as deleted"""
+        recipe = Recipe.objects.create(user=self.user, title='Omelette',
+                                       time_minutes=5, price='3.00')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            deletion.mark_recipes(self.user, [recipe.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            deletion.purge_recipes(self.user.id)
+
+        self.assertEqual(self.published(), [('recipe', 'deleted', recipe.id)])
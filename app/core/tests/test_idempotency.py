@@ -0,0 +1,232 @@
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import idempotency
+from core.models import IdempotencyKey, Recipe, Tag
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+CREATE_USER_URL = reverse('user:create')
+
+PAYLOAD = {'title': 'Omelette', 'time_minutes': 5, 'price': '3.00'}
+
+
+def image_upload_url(recipe_id):
+    return reverse('recipe:recipe-upload-image', args=[recipe_id])
+
+
+class IdempotencyTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@email.com',
+                                                         'testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, url, data, key='key-1', client=None, **kwargs):
+        client = client or self.client
+        return client.post(url, data, HTTP_IDEMPOTENCY_KEY=key, **kwargs)
+
+    def test_repeated_create_replayed(self):
+        """Test a repeated create returns the first response only"""
+        first = self.post(RECIPES_URL, PAYLOAD)
+        second = self.post(RECIPES_URL, PAYLOAD)
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertFalse(first.has_header('Idempotent-Replayed'))
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_without_key(self):
+        """Test requests without a key all run"""
+        self.client.post(RECIPES_URL, PAYLOAD)
+        self.client.post(RECIPES_URL, PAYLOAD)
+
+        self.assertEqual(Recipe.objects.count(), 2)
+
+    def test_key_reused_for_another_request(self):
+        """Test a key can't be reused with another body or endpoint"""
+        self.post(RECIPES_URL, PAYLOAD)
+
+        response = self.post(RECIPES_URL, {**PAYLOAD, 'title': 'Pancakes'})
+        self.assertEqual(response.status_code,
+                         status.HTTP_422_UNPROCESSABLE_ENTITY)
+        response = self.post(TAGS_URL, {'name': 'vegan'})
+        self.assertEqual(response.status_code,
+                         status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Recipe.objects.count(), 1)
+        self.assertFalse(Tag.objects.exists())
+
+    def test_keys_scoped_to_user(self):
+        """Test users sending the same key don't share responses"""
+        other_user = get_user_model().objects.create_user('other@email.com',
+                                                          'testpassword')
+        other_client = APIClient()
+        other_client.force_authenticate(other_user)
+
+        self.post(TAGS_URL, {'name': 'vegan'})
+        self.post(TAGS_URL, {'name': 'vegan'}, client=other_client)
+
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(Tag.objects.filter(user=other_user).count(), 1)
+
+    def test_anonymous_user_create(self):
+        """Test a repeated sign up creates one user"""
+        client = APIClient()
+        payload = {'email': 'new@email.com', 'password': 'testpassword',
+                   'name': 'New user'}
+
+        first = self.post(CREATE_USER_URL, payload, client=client)
+        second = self.post(CREATE_USER_URL, payload, client=client)
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(
+            get_user_model().objects.filter(email='new@email.com').count(),
+            1)
+
+    def test_client_errors_replayed(self):
+        """Test invalid requests are answered with the same error"""
+        first = self.post(RECIPES_URL, {'title': 'Omelette'})
+        second = self.post(RECIPES_URL, {'title': 'Omelette'})
+
+        self.assertEqual(first.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+
+    def test_server_error_releases_key(self):
+        """Test a failed request can be retried with its key"""
+        with patch('recipe.views.RecipeViewSet.perform_create',
+                   side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                self.post(RECIPES_URL, PAYLOAD)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        response = self.post(RECIPES_URL, PAYLOAD)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_expired_key(self):
+        """Test a request repeated after the TTL runs again"""
+        self.post(RECIPES_URL, PAYLOAD)
+        IdempotencyKey.objects.update(
+            expires=timezone.now() - timedelta(seconds=1))
+
+        response = self.post(RECIPES_URL, PAYLOAD)
+
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+        self.assertEqual(Recipe.objects.count(), 2)
+
+    def test_duplicate_waits_for_request_in_flight(self):
+        """Test a duplicate gets the response of the request in flight"""
+        first = self.post(RECIPES_URL, PAYLOAD)
+        stored = IdempotencyKey.objects.get()
+        response = stored.response
+        IdempotencyKey.objects.update(status_code=None, response='')
+
+        def finish(seconds):
+            IdempotencyKey.objects.update(status_code=201,
+                                          response=response)
+
+        with patch('core.idempotency.time.sleep',
+                   side_effect=finish) as sleep:
+            second = self.post(RECIPES_URL, PAYLOAD)
+
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_expired_lease_not_run_again(self):
+        """Test a duplicate of a request whose lease ran out conflicts"""
+        self.post(RECIPES_URL, PAYLOAD)
+        IdempotencyKey.objects.update(
+            status_code=None, response='',
+            expires=timezone.now() - timedelta(seconds=1))
+
+        response = self.post(RECIPES_URL, PAYLOAD)
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    @override_settings(IDEMPOTENCY_IN_FLIGHT_LEASE=600)
+    def test_lease_renewed_while_in_flight(self):
+        """Test the lease of a request in flight is extended"""
+        self.post(RECIPES_URL, PAYLOAD)
+        claimed = IdempotencyKey.objects.get()
+        IdempotencyKey.objects.update(status_code=None, response='',
+                                      expires=timezone.now())
+
+        idempotency.renew(claimed)
+
+        claimed.refresh_from_db()
+        self.assertGreater(claimed.expires,
+                           timezone.now() + timedelta(seconds=590))
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0)
+    def test_duplicate_gives_up_waiting(self):
+        """Test a duplicate of a request still in flight conflicts"""
+        self.post(RECIPES_URL, PAYLOAD)
+        IdempotencyKey.objects.update(status_code=None, response='')
+
+        response = self.post(RECIPES_URL, PAYLOAD)
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_image_upload_retry(self):
+        """Test a retried multipart upload matches the first one"""
+        recipe = Recipe.objects.create(user=self.user, **PAYLOAD)
+        url = image_upload_url(recipe.id)
+
+        with tempfile.TemporaryDirectory() as media_root, \
+                self.settings(MEDIA_ROOT=media_root), \
+                tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            Image.new('RGB', (10, 10)).save(ntf, format='JPEG')
+            responses = []
+            for _ in range(2):
+                ntf.seek(0)
+                responses.append(self.post(url, {'image': ntf},
+                                           format='multipart'))
+
+        self.assertEqual(responses[0].status_code, status.HTTP_200_OK)
+        self.assertEqual(responses[1].data, responses[0].data)
+        self.assertEqual(responses[1]['Idempotent-Replayed'], 'true')
+
+    def test_prune_command(self):
+        """Test the command deletes the expired keys only"""
+        self.post(RECIPES_URL, PAYLOAD, key='old')
+        self.post(RECIPES_URL, PAYLOAD, key='new')
+        IdempotencyKey.objects.filter(key='old').update(
+            expires=timezone.now() - timedelta(seconds=1))
+        out = StringIO()
+
+        call_command('prune_idempotency_keys', stdout=out)
+
+        self.assertEqual(list(IdempotencyKey.objects.values_list(
+            'key', flat=True)), ['new'])
+        self.assertIn('Deleted 1 expired idempotency keys', out.getvalue())
+
+    def test_key_too_long(self):
+        """Test overly long keys are rejected"""
+        response = self.post(RECIPES_URL, PAYLOAD,
+                             key='k' * (idempotency.MAX_KEY_LENGTH + 1))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Recipe.objects.exists())
@@ -0,0 +1,79 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, Client
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import instrumentation
+from core.models import Recipe
+from recipe.serializers import RecipeDetailSerializer
+
+RECIPES_URL = reverse('recipe:recipe-list')
+METRICS_URL = reverse('metrics')
+
+
+class InstrumentationMiddlewareTests(TestCase):
+
+    def setUp(self):
+        instrumentation.registry.reset()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpassword'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_server_timing_header(self):
+        """Test the timings of the request are sent as Server-Timing"""
+        Recipe.objects.create(user=self.user, title='koshari',
+                              time_minutes=5, price=5.00)
+
+        response = self.client.get(RECIPES_URL)
+
+        timing = response['Server-Timing']
+        for name in ('db;dur=', 'serializer;dur=', 'render;dur=',
+                     'total;dur='):
+            self.assertIn(name, timing)
+        self.assertNotIn('desc="0 queries"', timing)
+
+    def test_serializer_time_recorded(self):
+        """Test the serializer timing is collected by the mixin"""
+        recipe = Recipe.objects.create(user=self.user, title='koshari',
+                                       time_minutes=5, price=5.00)
+        metrics = instrumentation.RequestMetrics()
+        token = instrumentation._current.set(metrics)
+        try:
+            RecipeDetailSerializer(recipe).data
+        finally:
+            instrumentation._current.reset(token)
+
+        self.assertGreater(metrics.serializer_time, 0)
+        self.assertEqual(metrics.serializer_depth, 0)
+
+    def test_metrics_endpoint(self):
+        """Test the per route histograms are exposed to Prometheus"""
+        self.client.get(RECIPES_URL)
+        self.client.get(RECIPES_URL)
+
+        response = Client().get(METRICS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.content.decode()
+        self.assertIn(
+            'http_request_duration_seconds_count'
+            '{route="recipe:recipe-list",method="GET"} 2',
+            body
+        )
+        self.assertIn(
+            'http_request_duration_seconds_bucket'
+            '{route="recipe:recipe-list",method="GET",le="+Inf"} 2',
+            body
+        )
+        self.assertIn('http_request_db_queries_total', body)
+
+    def test_metrics_endpoint_forbidden(self):
+        """Test other addresses can't read the metrics"""
+        response = Client(REMOTE_ADDR='10.0.0.1').get(METRICS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
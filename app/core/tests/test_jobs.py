@@ -0,0 +1,208 @@
+import json
+import time
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import jobs
+from core.models import Job
+
+
+calls = []
+
+
+@jobs.task(name='tests.record')
+def record(value):
+    calls.append(value)
+    return {'value': value}
+
+
+@jobs.task(name='tests.explode', max_attempts=2)
+def explode():
+    raise ValueError('boom')
+
+
+@jobs.task(name='tests.sleep', timeout=1)
+def sleep(seconds):
+    time.sleep(seconds)
+
+
+JOBS_URL = reverse('core:job-list')
+
+
+def job_url(job_id):
+    return reverse('core:job-detail', args=[job_id])
+
+
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_claim_order(self):
+        """Test jobs are claimed by priority, then by due time"""
+        low = record.enqueue(payload={'value': 1})
+        high = record.enqueue(payload={'value': 2}, priority=5)
+        record.enqueue(payload={'value': 3}, priority=9, delay=60)
+
+        self.assertEqual(jobs.claim('worker').id, high.id)
+        self.assertEqual(jobs.claim('worker').id, low.id)
+        # the last job isn't due yet
+        self.assertIsNone(jobs.claim('worker'))
+
+    def test_run_job(self):
+        """Test a job runs with its payload and stores its result"""
+        job = record.enqueue(payload={'value': 'hello'})
+
+        self.assertEqual(jobs.work(burst=True), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(calls, ['hello'])
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(json.loads(job.result), {'value': 'hello'})
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNotNone(job.finished)
+
+    @override_settings(JOBS_RETRY_BACKOFF=10)
+    def test_retry_with_backoff(self):
+        """Test failed attempts are retried later, then fail the job"""
+        job = explode.enqueue()
+
+        with self.assertLogs('core.jobs', 'ERROR'):
+            jobs.execute(jobs.claim('worker'))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('ValueError: boom', job.error)
+        self.assertGreater(job.run_after,
+                           timezone.now() + timedelta(seconds=9))
+        self.assertIsNone(jobs.claim('worker'))
+
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        with self.assertLogs('core.jobs', 'ERROR'):
+            jobs.execute(jobs.claim('worker'))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_backoff_doubles_up_to_maximum(self):
+        """Test the retry delay doubles until its maximum"""
+        with self.settings(JOBS_RETRY_BACKOFF=5, JOBS_RETRY_BACKOFF_MAX=30):
+            self.assertEqual([jobs.backoff(attempts)
+                              for attempts in range(1, 6)],
+                             [5, 10, 20, 30, 30])
+
+    def test_timeout(self):
+        """Test an attempt running past the job timeout is interrupted"""
+        job = sleep.enqueue(payload={'seconds': 5}, max_attempts=1)
+        start = time.monotonic()
+
+        with self.assertLogs('core.jobs', 'ERROR'):
+            jobs.execute(jobs.claim('worker'))
+
+        job.refresh_from_db()
+        self.assertLess(time.monotonic() - start, 3)
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('JobTimeout', job.error)
+
+    def test_expired_lease(self):
+        """Test the job of a dead worker counts as a failed attempt"""
+        job = record.enqueue(payload={'value': 1})
+        jobs.claim('dead worker')
+        Job.objects.filter(id=job.id).update(
+            lease_expires=timezone.now() - timedelta(seconds=1))
+
+        with self.assertLogs('core.jobs', 'WARNING'):
+            self.assertEqual(jobs.requeue_expired(), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('dead worker', job.error)
+
+    def test_late_outcome_ignored(self):
+        """Test a worker can't overwrite a job taken back from it"""
+        job = record.enqueue(payload={'value': 1})
+        claimed = jobs.claim('slow worker')
+        Job.objects.filter(id=job.id).update(status=Job.QUEUED)
+
+        self.assertFalse(jobs.execute(claimed))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+
+    def test_unknown_task(self):
+        """Test jobs of unregistered tasks fail without retries"""
+        job = Job.objects.create(task='tests.missing')
+
+        jobs.work(burst=True)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.error, 'Unknown task tests.missing')
+
+    def test_run_workers_command(self):
+        """Test the command runs every due job in burst mode"""
+        for value in range(3):
+            record.enqueue(payload={'value': value})
+        out = StringIO()
+
+        call_command('run_workers', processes=0, burst=True, stdout=out)
+
+        self.assertEqual(sorted(calls), [0, 1, 2])
+        self.assertIn('Ran 3 jobs', out.getvalue())
+
+
+class JobApiTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@email.com',
+                                                         'testpassword')
+        self.other_user = get_user_model().objects.create_user(
+            'other@email.com', 'testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_login_required(self):
+        """Test that login is required for the job status"""
+        response = APIClient().get(JOBS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_job_status(self):
+        """Test users see the status of their own jobs only"""
+        job = record.enqueue(payload={'value': 1}, user=self.user)
+        other_job = record.enqueue(payload={'value': 2},
+                                   user=self.other_user)
+
+        response = self.client.get(job_url(job.id))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], Job.QUEUED)
+        self.assertEqual(response.data['task'], 'tests.record')
+        self.assertIsNone(response.data['result'])
+
+        response = self.client.get(job_url(other_job.id))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.get(JOBS_URL)
+        self.assertEqual([item['id'] for item in response.data], [job.id])
+
+    def test_staff_see_every_job(self):
+        """Test staff can follow the jobs of every user"""
+        self.user.is_staff = True
+        self.user.save()
+        job = record.enqueue(payload={'value': 1}, user=self.other_user)
+        jobs.work(burst=True)
+
+        response = self.client.get(job_url(job.id))
+
+        self.assertEqual(response.data['status'], Job.SUCCEEDED)
+        self.assertEqual(response.data['result'], {'value': 1})
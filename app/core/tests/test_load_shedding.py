@@ -0,0 +1,124 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import load_shedding
+
+
+ME_URL = reverse('user:me')
+TAGS_URL = reverse('recipe:tag-list')
+METRICS_URL = reverse('metrics')
+
+
+class GradientLimitTests(TestCase):
+
+    def test_sheds_over_cap(self):
+        """Test requests over the cap are refused and counted"""
+        limit = load_shedding.GradientLimit(2, 1, 10)
+
+        self.assertEqual([limit.acquire() for _ in range(3)],
+                         [True, True, False])
+        limit.release(0.01)
+        self.assertTrue(limit.acquire())
+        self.assertEqual(limit.shed, {'limit': 1})
+
+    def test_cap_follows_latency(self):
+        """Test the cap grows while latency holds and shrinks as it rises"""
+        limit = load_shedding.GradientLimit(10, 1, 100)
+
+        for _ in range(20):
+            for _ in range(int(limit.limit)):
+                limit.acquire()
+            for _ in range(limit.in_flight):
+                limit.release(0.01)
+        grown = limit.limit
+        for _ in range(20):
+            for _ in range(int(limit.limit)):
+                limit.acquire()
+            for _ in range(limit.in_flight):
+                limit.release(0.1)
+
+        self.assertGreater(grown, 10)
+        self.assertLess(limit.limit, grown / 2)
+        self.assertGreaterEqual(limit.limit, 1)
+
+    def test_idle_cap_not_grown(self):
+        """Test a class using little of its cap doesn't grow it"""
+        limit = load_shedding.GradientLimit(10, 1, 100)
+
+        for _ in range(100):
+            limit.acquire()
+            limit.release(0.01)
+
+        self.assertEqual(limit.limit, 10)
+
+
+@override_settings(LOAD_SHEDDING_LIMITS={'read': (1, 1, 1)},
+                   METRICS_ALLOWED_IPS=['127.0.0.1'])
+class LoadSheddingMiddlewareTests(TestCase):
+
+    def setUp(self):
+        load_shedding.limiter.reset()
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(
+            'test@email.com', 'testpassword'))
+
+    def tearDown(self):
+        load_shedding.limiter.reset()
+
+    def test_shed_at_cap(self):
+        """Test a class at its cap answers 503, the other classes don't"""
+        read = load_shedding.limiter.limit('read')
+        self.assertEqual(self.client.get(ME_URL).status_code,
+                         status.HTTP_200_OK)
+        read.acquire()
+
+        response = self.client.get(ME_URL)
+
+        self.assertEqual(response.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(self.client.get(TAGS_URL).status_code,
+                         status.HTTP_200_OK)
+        metrics = self.client.get(METRICS_URL).content.decode()
+        self.assertIn('http_requests_in_flight{route_class="read"} 1',
+                      metrics)
+        self.assertIn('http_concurrency_limit{route_class="read"} 1',
+                      metrics)
+        self.assertIn('http_requests_shed_total{route_class="read",'
+                      'reason="limit"} 1', metrics)
+
+    def test_slot_released(self):
+        """Test the slot of a request is freed when it's answered"""
+        for _ in range(3):
+            self.assertEqual(self.client.get(ME_URL).status_code,
+                             status.HTTP_200_OK)
+
+        self.assertEqual(load_shedding.limiter.limit('read').in_flight, 0)
+
+    @override_settings(LOAD_SHEDDING_MAX_QUEUE_TIME=10)
+    def test_shed_queued_too_long(self):
+        """Test requests the proxy stamped too long ago are shed"""
+        queued = self.client.get(
+            ME_URL, HTTP_X_REQUEST_START=f't={(time.time() - 30) * 1e6:.0f}')
+        fresh = self.client.get(
+            ME_URL, HTTP_X_REQUEST_START=f't={time.time() * 1000:.0f}')
+
+        self.assertEqual(queued.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(fresh.status_code, status.HTTP_200_OK)
+        self.assertEqual(load_shedding.limiter.snapshot()['read']['shed'],
+                         {'queue_time': 1})
+
+    @override_settings(LOAD_SHEDDING_ENABLED=False)
+    def test_disabled(self):
+        """Test nothing is shed when load shedding is off"""
+        load_shedding.limiter.limit('read').acquire()
+
+        self.assertEqual(self.client.get(ME_URL).status_code,
+                         status.HTTP_200_OK)
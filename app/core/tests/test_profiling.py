@@ -0,0 +1,118 @@
+import pstats
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import profiling
+
+RECIPES_URL = reverse('recipe:recipe-list')
+PROFILES_URL = reverse('core:profile-list')
+
+
+def download_url(profile_id, profile_format):
+    """Return the download url of a saved profile"""
+    return reverse('core:profile-download',
+                   args=[profile_id, profile_format])
+
+
+class ProfilingTests(TestCase):
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            PROFILING_DIR=self.profile_dir,
+            PROFILING_SAMPLE_RATE=0,
+            PROFILING_MAX_PROFILES=2,
+        )
+        self.settings_override.enable()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpassword'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.profile_dir)
+
+    def profiled_get(self, url, **extra):
+        return self.client.get(
+            url, HTTP_X_PROFILE_TOKEN=profiling.make_profile_token(), **extra)
+
+    def test_requests_not_profiled_by_default(self):
+        """Test requests without a token aren't profiled"""
+        response = self.client.get(RECIPES_URL)
+
+        self.assertFalse(response.has_header('X-Profile-Id'))
+        self.assertEqual(profiling.list_profiles(), [])
+
+    def test_invalid_token_ignored(self):
+        """Test a forged token doesn't enable profiling"""
+        response = self.client.get(RECIPES_URL,
+                                   HTTP_X_PROFILE_TOKEN='forged:token')
+
+        self.assertFalse(response.has_header('X-Profile-Id'))
+
+    def test_signed_token_profiles_request(self):
+        """Test a request with a signed token is sampled and saved"""
+        response = self.profiled_get(RECIPES_URL)
+
+        profile_id = response['X-Profile-Id']
+        self.assertIsNotNone(profiling.profile_path(profile_id, 'collapsed'))
+        self.assertIsNone(profiling.profile_path(profile_id, 'pstats'))
+        meta = profiling.list_profiles()[0]
+        self.assertEqual(meta['path'], RECIPES_URL)
+        self.assertEqual(meta['status'], status.HTTP_200_OK)
+        self.assertEqual(meta['profiler'], 'sample')
+
+    def test_cprofile_requested(self):
+        """Test cProfile runs instead of the sampler when asked for"""
+        for response in (
+                self.profiled_get(RECIPES_URL, HTTP_X_PROFILER='cprofile'),
+                self.profiled_get(f'{RECIPES_URL}?profile=cprofile')):
+            profile_id = response['X-Profile-Id']
+
+            stats = pstats.Stats(
+                profiling.profile_path(profile_id, 'pstats'))
+            self.assertTrue(stats.total_calls)
+            self.assertIsNone(profiling.profile_path(profile_id,
+                                                     'collapsed'))
+
+    def test_store_is_bounded(self):
+        """Test only the newest profiles are kept"""
+        ids = [self.profiled_get(RECIPES_URL)['X-Profile-Id']
+               for _ in range(3)]
+
+        stored = [meta['id'] for meta in profiling.list_profiles()]
+        self.assertEqual(stored, [ids[2], ids[1]])
+        self.assertIsNone(profiling.profile_path(ids[0], 'collapsed'))
+
+    def test_profiles_staff_only(self):
+        """Test regular users can't list the profiles"""
+        response = self.client.get(PROFILES_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_staff_list_and_download(self):
+        """Test staff can list and download the saved profiles"""
+        profile_id = self.profiled_get(RECIPES_URL)['X-Profile-Id']
+        self.user.is_staff = True
+        self.user.save()
+
+        response = self.client.get(PROFILES_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['id'], profile_id)
+
+        response = self.client.get(download_url(profile_id, 'collapsed'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('attachment', response['Content-Disposition'])
+
+        response = self.client.get(download_url('..secret', 'pstats'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
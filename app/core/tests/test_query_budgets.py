@@ -0,0 +1,384 @@
+"""
+Query count and latency guard for every API endpoint.
+
+Every router action and other endpoint is called for a user owning a small
+and a large library. The query count must not depend on the library size
+and must stay within the budget checked in to query_budgets.json. The
+recipe writes must not cost more queries for more tags and ingredients,
+and autocomplete is also budgeted with a prefix and a misspelled query.
+
+Query counts are budgeted per database, `queries` on SQLite and
+`queries_<vendor>` on the others where they differ, like the autocomplete
+served from memory on SQLite and by queries on Postgres. A run with
+UPDATE_QUERY_BUDGETS=1 records the counts of its database.
+
+The latency baselines are wall clock times of the machine that recorded
+them, so the median latency is only checked against them, within a
+tolerance, with CHECK_QUERY_BUDGET_LATENCY=1 on comparable hardware.
+
+Run with UPDATE_QUERY_BUDGETS=1 to rewrite the budget file after an
+intended change.
+"""
+import io
+import json
+import os
+import statistics
+import tempfile
+import time
+import unittest
+import uuid
+
+from PIL import Image
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import Tag, Ingredient, Recipe
+from core.perfdata import PERF_PASSWORD
+from recipe import autocomplete, pantry, urls as recipe_urls
+from recipe.perfdata import seed_perf_data
+from recipe.views import RecipeViewSet
+
+BUDGET_FILE = os.path.join(os.path.dirname(__file__), 'query_budgets.json')
+UPDATE_BUDGETS = os.environ.get('UPDATE_QUERY_BUDGETS') == '1'
+CHECK_LATENCY = os.environ.get('CHECK_QUERY_BUDGET_LATENCY') == '1'
+# measured latency may be this many times the baseline, plus the slack
+TIME_TOLERANCE = float(os.environ.get('QUERY_BUDGET_TIME_TOLERANCE', 5))
+TIME_SLACK_MS = 20
+TIMING_RUNS = 5
+# in-process caches, cleared before every request so counts are repeatable
+PROCESS_CACHES = (autocomplete.cache, pantry.cache)
+
+SMALL_SCALE = {'tags': 3, 'ingredients': 5, 'recipes': 3}
+LARGE_SCALE = {'tags': 30, 'ingredients': 50, 'recipes': 30}
+
+# (action, method, url name suffix) of the standard viewset actions
+STANDARD_ACTIONS = (
+    ('list', 'GET', 'list'),
+    ('create', 'POST', 'list'),
+    ('retrieve', 'GET', 'detail'),
+    ('update', 'PUT', 'detail'),
+    ('partial_update', 'PATCH', 'detail'),
+)
+
+# endpoints outside the recipe router
+EXTRA_ENDPOINTS = (
+    ('recipe:stats', 'GET'),
+    ('user:create', 'POST'),
+    ('user:token', 'POST'),
+    ('user:me', 'GET'),
+    ('user:me', 'PATCH'),
+    ('batch', 'POST'),
+)
+
+
+def sample_image():
+    """Return a tiny JPEG upload"""
+    image = io.BytesIO()
+    Image.new('RGB', (10, 10)).save(image, format='JPEG')
+    image.name = 'budget.jpg'
+    image.seek(0)
+    return image
+
+
+def recipe_payload(user, prefix='budget'):
+    """Link the tags and ingredients no seeded recipe uses"""
+    return {
+        'title': 'budget recipe',
+        'time_minutes': 10,
+        'price': '5.00',
+        'tags': list(Tag.objects.filter(
+            user=user, name__startswith=prefix).values_list(
+                'id', flat=True)),
+        'ingredients': list(Ingredient.objects.filter(
+            user=user, name__startswith=prefix).values_list(
+                'id', flat=True)),
+    }
+
+
+def merge_payload(model):
+    """Return a payload merging a new object of two recipes"""
+    def payload(user):
+        merged = model.objects.create(user=user, name='budget merged')
+        merged.recipe_set.add(*Recipe.objects.filter(
+            user=user).order_by('id')[:2])
+        return {'ids': [merged.id]}
+
+    return payload
+
+
+def recipe_ids(user):
+    return ','.join(str(pk) for pk in Recipe.objects.filter(
+        user=user).values_list('id', flat=True))
+
+
+# query parameters of the GET endpoints which need some
+QUERY_PARAMS = {
+    'recipe:recipe-shopping-list GET': lambda user: {
+        'recipes': recipe_ids(user)},
+}
+# more budgeted query parameters of GET endpoints, by variant name
+QUERY_VARIANTS = {
+    f'recipe:{basename}-autocomplete GET': {
+        'prefix': {'q': 'budg'},
+        'typo': {'q': 'budgte'},
+    }
+    for basename in ('tag', 'ingredient')
+}
+
+# request body and format of every endpoint which isn't a GET
+PAYLOADS = {
+    'recipe:tag-list POST': (lambda user: {'name': 'budget'}, 'json'),
+    'recipe:ingredient-list POST': (lambda user: {'name': 'budget'}, 'json'),
+    'recipe:tag-rename POST': (lambda user: {'name': 'renamed'}, 'json'),
+    'recipe:ingredient-rename POST': (lambda user: {'name': 'renamed'},
+                                      'json'),
+    'recipe:tag-merge POST': (merge_payload(Tag), 'json'),
+    'recipe:ingredient-merge POST': (merge_payload(Ingredient), 'json'),
+    'recipe:recipe-list POST': (recipe_payload, 'json'),
+    'recipe:recipe-detail PUT': (recipe_payload, 'json'),
+    'recipe:recipe-detail PATCH': (lambda user: {'title': 'patched'},
+                                   'json'),
+    'recipe:recipe-bulk-delete POST': (lambda user: {
+        'ids': [Recipe.objects.create(user=user, title='budget',
+                                      time_minutes=10, price='5.00').id],
+    }, 'json'),
+    'recipe:recipe-upload-image POST': (
+        lambda user: {'image': sample_image()}, 'multipart'),
+    'user:create POST': (lambda user: {
+        'email': f'{uuid.uuid4().hex}@budget.example.com',
+        'password': PERF_PASSWORD,
+        'name': 'Budget user',
+    }, 'json'),
+    'user:token POST': (lambda user: {
+        'email': user.email,
+        'password': PERF_PASSWORD,
+    }, 'json'),
+    'user:me PATCH': (lambda user: {'name': 'patched'}, 'json'),
+    'batch POST': (lambda user: {'requests': [
+        {'method': 'GET', 'path': reverse('user:me')},
+        {'method': 'GET', 'path': reverse('recipe:tag-list')},
+        {'method': 'GET', 'path': reverse('recipe:recipe-list')},
+    ]}, 'json'),
+}
+
+
+def api_endpoints():
+    """Return (url name, method, viewset, detail) of every endpoint"""
+    endpoints = []
+    namespace = recipe_urls.app_name
+    for prefix, viewset, basename in recipe_urls.router.registry:
+        for action, method, suffix in STANDARD_ACTIONS:
+            if hasattr(viewset, action):
+                endpoints.append((f'{namespace}:{basename}-{suffix}',
+                                  method, viewset, suffix == 'detail'))
+        for extra_action in viewset.get_extra_actions():
+            for method in extra_action.mapping:
+                endpoints.append((
+                    f'{namespace}:{basename}-{extra_action.url_name}',
+                    method.upper(),
+                    viewset,
+                    extra_action.detail
+                ))
+    for name, method in EXTRA_ENDPOINTS:
+        endpoints.append((name, method, None, False))
+
+    return endpoints
+
+
+def budget_cases():
+    """
+    Return (budget key, url name, method, viewset, detail, query params)
+    of every budgeted request
+    """
+    cases = []
+    for name, method, viewset, detail in api_endpoints():
+        key = f'{name} {method}'
+        cases.append((key, name, method, viewset, detail, None))
+        for variant, params in QUERY_VARIANTS.get(key, {}).items():
+            cases.append((f'{key} {variant}', name, method, viewset, detail,
+                          params))
+
+    return cases
+
+
+def load_budgets():
+    try:
+        with open(BUDGET_FILE) as budget_file:
+            return json.load(budget_file)
+    except FileNotFoundError:
+        return {}
+
+
+def queries_field():
+    """Return the budget field of the query counts of this database"""
+    if connection.vendor == 'sqlite':
+        return 'queries'
+    return f'queries_{connection.vendor}'
+
+
+def save_budgets(field, measured):
+    """Rewrite one field of every endpoint in the budget file"""
+    budgets = load_budgets()
+    for key, value in measured.items():
+        budgets.setdefault(key, {})[field] = value
+    with open(BUDGET_FILE, 'w') as budget_file:
+        json.dump(budgets, budget_file, indent=2, sort_keys=True)
+        budget_file.write('\n')
+
+
+class EndpointBudgetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.small_user = seed_perf_data(users=1, prefix='small',
+                                        **SMALL_SCALE)[0]
+        cls.large_user = seed_perf_data(users=1, prefix='large',
+                                        **LARGE_SCALE)[0]
+        for user in (cls.small_user, cls.large_user):
+            Token.objects.create(user=user)
+            for name in ('budget a', 'budget b'):
+                Tag.objects.create(user=user, name=name)
+                Ingredient.objects.create(user=user, name=name)
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.media_override = override_settings(
+            MEDIA_ROOT=self.media_root.name)
+        self.media_override.enable()
+
+    def tearDown(self):
+        self.media_override.disable()
+        self.media_root.cleanup()
+
+    def prepare(self, user, name, method, viewset, detail, params=None,
+                payload=None):
+        """Return a function sending one request for the user"""
+        kwargs = {}
+        if detail:
+            model = viewset.queryset.model
+            obj = model.objects.filter(user=user).order_by('id').first()
+            kwargs['pk'] = obj.pk
+
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION=f'Token {user.auth_token.key}')
+        url = reverse(name, kwargs=kwargs)
+        key = f'{name} {method}'
+        if method == 'GET':
+            if params is None:
+                params = QUERY_PARAMS.get(key, lambda user: {})(user)
+            return lambda: client.get(url, params)
+
+        self.assertIn(key, PAYLOADS, f'add a payload for {key}')
+        default_payload, data_format = PAYLOADS[key]
+        payload = payload or default_payload
+        with self.captureOnCommitCallbacks(execute=True):
+            data = payload(user)
+        return lambda: getattr(client, method.lower())(
+            url, data, format=data_format)
+
+    def clear_caches(self):
+        for cache in PROCESS_CACHES:
+            cache.clear()
+
+    def send(self, send):
+        """
+        Send a request, running what it deferred to the commit like the
+        request's own transaction would
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            return send()
+
+    def count_queries(self, user, name, method, viewset, detail,
+                      params=None, payload=None):
+        send = self.prepare(user, name, method, viewset, detail, params,
+                            payload)
+        self.clear_caches()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.send(send)
+        self.assertLess(response.status_code, 400,
+                        f'{name} {method}: {response.status_code}')
+
+        return len(queries)
+
+    def test_query_counts(self):
+        """Test query counts don't grow with the data and are in budget"""
+        budgets = load_budgets()
+        measured = {}
+        for key, name, method, viewset, detail, params in budget_cases():
+            with self.subTest(endpoint=key):
+                small = self.count_queries(self.small_user, name, method,
+                                           viewset, detail, params)
+                large = self.count_queries(self.large_user, name, method,
+                                           viewset, detail, params)
+                measured[key] = large
+                self.assertEqual(
+                    small, large,
+                    f'{key} runs {small} queries for the small library '
+                    f'but {large} for the large one'
+                )
+                if not UPDATE_BUDGETS:
+                    self.assertIn(key, budgets, f'no budget for {key}')
+                    self.assertLessEqual(large, budgets[key].get(
+                        queries_field(), budgets[key]['queries']))
+
+        if UPDATE_BUDGETS:
+            save_budgets(queries_field(), measured)
+
+    def test_recipe_writes_with_more_links(self):
+        """Test recipe writes don't cost a query per tag or ingredient"""
+        # both payloads replace every link of the updated recipe
+        for index in range(5):
+            Tag.objects.create(user=self.large_user, name=f'links {index}')
+            Ingredient.objects.create(user=self.large_user,
+                                      name=f'links {index}')
+
+        def more_links(user):
+            # a new time, so the stats change again too
+            return {**recipe_payload(user, prefix='links'),
+                    'time_minutes': 20}
+
+        for name, method, detail in (('recipe:recipe-list', 'POST', False),
+                                     ('recipe:recipe-detail', 'PUT', True)):
+            key = f'{name} {method}'
+            with self.subTest(endpoint=key):
+                few = self.count_queries(self.large_user, name, method,
+                                         RecipeViewSet, detail)
+                many = self.count_queries(self.large_user, name, method,
+                                          RecipeViewSet, detail,
+                                          payload=more_links)
+
+                self.assertEqual(few, many)
+
+    @unittest.skipUnless(CHECK_LATENCY or UPDATE_BUDGETS,
+                         'set CHECK_QUERY_BUDGET_LATENCY=1 to check latency')
+    def test_latency(self):
+        """Test the median latency is within tolerance of the baseline"""
+        budgets = load_budgets()
+        measured = {}
+        for key, name, method, viewset, detail, params in budget_cases():
+            with self.subTest(endpoint=key):
+                timings = []
+                for _ in range(TIMING_RUNS):
+                    send = self.prepare(self.large_user, name, method,
+                                        viewset, detail, params)
+                    self.clear_caches()
+                    start = time.perf_counter()
+                    self.send(send)
+                    timings.append((time.perf_counter() - start) * 1000)
+                median = statistics.median(timings)
+                measured[key] = round(median, 2)
+                if not UPDATE_BUDGETS:
+                    self.assertIn(key, budgets, f'no baseline for {key}')
+                    limit = (budgets[key]['time_ms'] * TIME_TOLERANCE +
+                             TIME_SLACK_MS)
+                    self.assertLessEqual(median, limit)
+
+        if UPDATE_BUDGETS:
+            save_budgets('time_ms', measured)
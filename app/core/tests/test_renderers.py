@@ -0,0 +1,111 @@
+import datetime
+from decimal import Decimal
+from io import BytesIO, StringIO
+
+import msgpack
+import orjson
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from core.models import Recipe
+from core.parsers import MessagePackParser
+from core.renderers import ORJSONRenderer, MessagePackRenderer
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+class RendererTests(TestCase):
+
+    def setUp(self):
+        self.data = {
+            'price': Decimal('10.50'),
+            'created': datetime.datetime(
+                2020, 5, 12, 20, 41, tzinfo=datetime.timezone.utc),
+            'tags': [1, 2],
+        }
+
+    def test_orjson_matches_stock_json_renderer(self):
+        """Test the orjson renderer output decodes like the stock one"""
+        expected = JSONRenderer().render(self.data)
+        rendered = ORJSONRenderer().render(self.data)
+
+        self.assertEqual(orjson.loads(rendered), orjson.loads(expected))
+        self.assertEqual(orjson.loads(rendered)['created'],
+                         '2020-05-12T20:41:00Z')
+
+    def test_orjson_indent(self):
+        """Test requesting an indent in the media type"""
+        rendered = ORJSONRenderer().render(
+            self.data, 'application/json; indent=4')
+
+        self.assertIn(b'\n', rendered)
+
+    def test_msgpack_handles_decimal_and_datetime(self):
+        """Test MessagePack renders decimals and datetimes"""
+        rendered = MessagePackRenderer().render(self.data)
+        decoded = msgpack.unpackb(rendered, raw=False)
+
+        self.assertEqual(decoded['price'], 10.5)
+        self.assertEqual(decoded['created'], '2020-05-12T20:41:00Z')
+        self.assertEqual(decoded['tags'], [1, 2])
+
+    def test_msgpack_parser_invalid_payload(self):
+        """Test parsing an invalid MessagePack body raises ParseError"""
+        with self.assertRaises(ParseError):
+            MessagePackParser().parse(BytesIO(b'\xc1'))
+
+    def test_bench_renderers_command(self):
+        """Test the renderer benchmark reports every renderer"""
+        out = StringIO()
+        call_command('bench_renderers', sizes='5', repeat=1, stdout=out)
+
+        for name in ('json', 'orjson', 'msgpack'):
+            self.assertIn(name, out.getvalue())
+
+
+class MessagePackApiTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpassword'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_recipes_as_msgpack(self):
+        """Test the recipe list is negotiated to MessagePack"""
+        Recipe.objects.create(user=self.user, title='koshari',
+                              time_minutes=5, price=Decimal('5.00'))
+
+        response = self.client.get(RECIPES_URL,
+                                   HTTP_ACCEPT='application/msgpack')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        recipes = msgpack.unpackb(response.content, raw=False)
+        self.assertEqual(recipes[0]['title'], 'koshari')
+        self.assertEqual(recipes[0]['price'], '5.00')
+
+    def test_create_recipe_from_msgpack(self):
+        """Test creating a recipe with a MessagePack body"""
+        payload = {'title': 'molokhia', 'time_minutes': 20, 'price': '4.00',
+                   'tags': [], 'ingredients': []}
+
+        response = self.client.post(
+            RECIPES_URL,
+            msgpack.packb(payload),
+            content_type='application/msgpack'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=response.data['id'])
+        self.assertEqual(recipe.price, Decimal('4.00'))
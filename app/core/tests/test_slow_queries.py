@@ -0,0 +1,109 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import slow_queries
+
+RECIPES_URL = reverse('recipe:recipe-list')
+SLOW_QUERIES_URL = reverse('slow-queries')
+
+
+class NormalizeSqlTests(TestCase):
+
+    def test_literals_and_params_normalized(self):
+        """Test literals and parameters are replaced by placeholders"""
+        sql = slow_queries.normalize_sql(
+            "SELECT * FROM core_recipe WHERE  title = 'x' AND id = %s "
+            "AND price > 10.5"
+        )
+
+        self.assertEqual(
+            sql,
+            'SELECT * FROM core_recipe WHERE title = ? AND id = ? '
+            'AND price > ?'
+        )
+
+    def test_in_lists_share_fingerprint(self):
+        """Test IN lists of any length have the same fingerprint"""
+        short = slow_queries.normalize_sql('SELECT 1 WHERE id IN (%s)')
+        long = slow_queries.normalize_sql('SELECT 1 WHERE id IN (%s, %s, %s)')
+
+        self.assertEqual(slow_queries.fingerprint(short),
+                         slow_queries.fingerprint(long))
+
+    def test_buffer_is_bounded(self):
+        """Test the least recently seen shapes are evicted"""
+        log = slow_queries.SlowQueryLog(capacity=2)
+        log.record('SELECT a FROM t', 0.2, None)
+        log.record('SELECT b FROM t', 0.2, None)
+        log.record('SELECT a FROM t', 0.3, None)
+        log.record('SELECT c FROM t', 0.2, None)
+
+        entries = log.entries()
+        self.assertEqual([entry['sql'] for entry in entries],
+                         ['SELECT c FROM t', 'SELECT a FROM t'])
+        self.assertEqual(entries[1]['count'], 2)
+        self.assertEqual(entries[1]['max_time'], 0.3)
+
+
+@override_settings(SLOW_QUERY_THRESHOLD_MS=0,
+                   SLOW_QUERY_EXPLAIN_SAMPLE_RATE=1)
+class SlowQueryMiddlewareTests(TestCase):
+
+    def setUp(self):
+        slow_queries.slow_query_log.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpassword'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_slow_queries_captured_with_view_and_plan(self):
+        """Test slow queries are recorded with the view and a plan"""
+        with self.assertLogs('core.slow_queries', 'WARNING'):
+            self.client.get(RECIPES_URL)
+            self.client.get(RECIPES_URL)
+
+        entries = [
+            entry for entry in slow_queries.slow_query_log.entries()
+            if 'core_recipe' in entry['sql']
+        ]
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['count'], 2)
+        self.assertEqual(entries[0]['views'], ['recipe:recipe-list'])
+        self.assertTrue(entries[0]['plan'])
+
+    def test_queries_outside_requests_ignored(self):
+        """Test the wrapper is only installed around requests"""
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+
+        self.assertEqual(slow_queries.slow_query_log.entries(), [])
+
+    def test_admin_lists_slow_queries(self):
+        """Test staff can see the captured queries in the admin"""
+        admin_user = get_user_model().objects.create_superuser(
+            email='admin@email.com',
+            password='password'
+        )
+        with self.assertLogs('core.slow_queries', 'WARNING'):
+            self.client.get(RECIPES_URL)
+        client = Client()
+        client.force_login(admin_user)
+
+        with self.assertLogs('core.slow_queries', 'WARNING'):
+            response = client.get(SLOW_QUERIES_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, 'core_recipe')
+
+    def test_admin_requires_staff(self):
+        """Test the slow query page redirects anonymous users to login"""
+        response = Client().get(SLOW_QUERIES_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
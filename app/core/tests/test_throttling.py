@@ -0,0 +1,159 @@
+import multiprocessing
+import os
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import throttling
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+TOKEN_URL = reverse('user:token')
+
+
+def take_tokens(path, count):
+    bucket_file = throttling.BucketFile(path, throttling.WAYS)
+    for _ in range(count):
+        bucket_file.take('shared', 10, 1, now=100)
+
+
+class BucketFileTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'buckets')
+        # a single set of slots
+        self.bucket_file = throttling.BucketFile(self.path, throttling.WAYS)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_take_and_refill(self):
+        """Test a bucket empties and refills at its rate up to capacity"""
+        take = self.bucket_file.take
+
+        self.assertEqual(take('client', 2, 0.5, now=100), (True, 1))
+        self.assertEqual(take('client', 2, 0.5, now=100), (True, 0))
+        self.assertEqual(take('client', 2, 0.5, now=101), (False, 0.5))
+        self.assertEqual(take('client', 2, 0.5, now=102), (True, 0))
+        self.assertEqual(take('client', 2, 0.5, now=1000), (True, 1))
+
+    def test_least_recently_used_evicted(self):
+        """Test a new key takes the slot of the idlest bucket of its set"""
+        for index in range(throttling.WAYS):
+            self.bucket_file.take(f'client {index}', 1, 0.001, now=index)
+
+        self.bucket_file.take('new client', 1, 0.001, now=10)
+
+        self.assertEqual(self.bucket_file.take('client 0', 1, 0.001,
+                                               now=10), (True, 0))
+        self.assertEqual(self.bucket_file.take('client 3', 1, 0.001,
+                                               now=10)[0], False)
+
+    def test_shared_between_processes(self):
+        """Test the tokens taken by another process are gone"""
+        process = multiprocessing.get_context('fork').Process(
+            target=take_tokens, args=(self.path, 7))
+        process.start()
+        process.join()
+
+        self.assertEqual(self.bucket_file.take('shared', 10, 1, now=100),
+                         (True, 2))
+
+
+class RateLimitApiTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = override_settings(RATE_LIMIT_FILE=os.path.join(
+            self.directory.name, 'buckets'))
+        self.settings.enable()
+        self.user = get_user_model().objects.create_user('test@email.com',
+                                                         'testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        self.settings.disable()
+        self.directory.cleanup()
+
+    @override_settings(RATE_LIMITS={'recipe:recipe-list': '2/m'})
+    def test_route_limited_per_user(self):
+        """Test a user is throttled per route, with RateLimit headers"""
+        other_client = APIClient()
+        other_client.force_authenticate(get_user_model().objects.create_user(
+            'other@email.com', 'testpassword'))
+
+        responses = [self.client.get(RECIPES_URL) for _ in range(3)]
+
+        self.assertEqual([response.status_code for response in responses],
+                         [200, 200, 429])
+        self.assertEqual(
+            [(response['RateLimit-Limit'], response['RateLimit-Remaining'])
+             for response in responses],
+            [('2', '1'), ('2', '0'), ('2', '0')])
+        self.assertEqual(responses[1]['RateLimit-Reset'], '60')
+        self.assertEqual(responses[2]['Retry-After'], '30')
+        self.assertEqual(other_client.get(RECIPES_URL).status_code,
+                         status.HTTP_200_OK)
+        tags_response = self.client.get(TAGS_URL)
+        self.assertEqual(tags_response.status_code, status.HTTP_200_OK)
+        self.assertFalse(tags_response.has_header('RateLimit-Limit'))
+
+    @override_settings(RATE_LIMITS={'default': '1/h'})
+    def test_default_rate(self):
+        """Test routes without a rate of their own get the default one"""
+        self.client.get(TAGS_URL)
+
+        response = self.client.get(TAGS_URL)
+
+        self.assertEqual(response.status_code,
+                         status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(RATE_LIMITS={'recipe:recipe-list': '1/m'})
+    def test_user_rates(self):
+        """Test the rates of a user override the route's"""
+        with self.settings_for_user({'recipe:recipe-list': None}):
+            responses = [self.client.get(RECIPES_URL) for _ in range(3)]
+
+        self.assertEqual([response.status_code for response in responses],
+                         [200, 200, 200])
+        self.assertFalse(responses[0].has_header('RateLimit-Limit'))
+
+    def settings_for_user(self, rates):
+        return override_settings(RATE_LIMIT_USERS={self.user.id: rates})
+
+    @override_settings(RATE_LIMITS={'user:token': '1/m'})
+    def test_anonymous_limited_by_address(self):
+        """Test anonymous clients are throttled by their address"""
+        payload = {'email': 'test@email.com', 'password': 'testpassword'}
+
+        first = APIClient().post(TOKEN_URL, payload)
+        second = APIClient().post(TOKEN_URL, payload)
+        elsewhere = APIClient().post(TOKEN_URL, payload,
+                                     REMOTE_ADDR='10.0.0.2')
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.status_code,
+                         status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(elsewhere.status_code, status.HTTP_200_OK)
+
+    @override_settings(RATE_LIMITS={'user:token': '1/m'})
+    def test_forwarded_for_ignored(self):
+        """Test clients can't get a bucket of their own by spoofing a proxy"""
+        payload = {'email': 'test@email.com', 'password': 'testpassword'}
+
+        responses = [
+            APIClient().post(TOKEN_URL, payload,
+                             HTTP_X_FORWARDED_FOR=f'10.0.1.{index}')
+            for index in range(3)
+        ]
+
+        self.assertEqual([response.status_code for response in responses],
+                         [200, 429, 429])
@@ -0,0 +1,180 @@
+"""
+Token bucket rate limits shared by every worker process of a host.
+
+The buckets live in a memory mapped file, RATE_LIMIT_FILE, which every
+worker maps, so a client can't multiply its rate by the number of
+workers and a check never leaves the host. Put the file on a tmpfs like
+/dev/shm to keep it in memory.
+
+A bucket is found by hashing the client and the route. The file is a
+table of sets of WAYS slots of (key hash, tokens, last update), a check
+locks the byte range of its set with fcntl (and a striped thread lock
+within the process), refills and takes a token and unlocks: O(1) and only
+contended by the clients hashed to the same set. A new key takes the
+least recently used slot of its set, an idle bucket has refilled anyway.
+
+Rates come from RATE_LIMITS by url name, 'default' for the other routes,
+and RATE_LIMIT_USERS overrides them per user id. Authenticated clients
+are identified by their user, the others by their address: the peer's,
+or the one the REST_FRAMEWORK['NUM_PROXIES'] trusted proxies forwarded.
+Responses carry the RateLimit-Limit, RateLimit-Remaining and
+RateLimit-Reset headers of the bucket they were checked against.
+"""
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+
+# key hash, tokens, last update
+SLOT = struct.Struct('<Qdd')
+WAYS = 4
+THREAD_LOCKS = 64
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+DEFAULT_FILE = os.path.join(tempfile.gettempdir(), 'recipe-app-rate-limits')
+
+
+def parse_rate(rate):
+    """Return the (requests, seconds) of a '<requests>/<period>' rate"""
+    if rate is None:
+        return None
+    requests, period = rate.split('/')
+    return int(requests), PERIODS[period[0]]
+
+
+def key_hash(key):
+    """Return the non zero 64 bit hash of a bucket key, 0 is a free slot"""
+    return int.from_bytes(
+        hashlib.blake2b(key.encode(), digest_size=8).digest(),
+        'little') or 1
+
+
+class BucketFile:
+    """Token buckets in a file mapped by every process"""
+
+    def __init__(self, path, slots):
+        self.sets = max(slots // WAYS, 1)
+        self.set_size = WAYS * SLOT.size
+        size = self.sets * self.set_size
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+        self.locks = [threading.Lock() for _ in range(THREAD_LOCKS)]
+
+    def take(self, key, capacity, per_second, now=None):
+        """
+        Refill the bucket of a key, take a token if there's one, return
+        whether there was and the tokens left
+        """
+        key = key_hash(key)
+        index = key % self.sets
+        start = index * self.set_size
+        # fcntl locks don't exclude the threads of the owning process
+        with self.locks[index % THREAD_LOCKS]:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, self.set_size, start)
+            try:
+                now = time.time() if now is None else now
+                slots = [SLOT.unpack_from(self.map, start + way * SLOT.size)
+                         for way in range(WAYS)]
+                way = next((way for way, slot in enumerate(slots)
+                            if slot[0] == key), None)
+                if way is None:
+                    way = min(range(WAYS), key=lambda way: slots[way][2])
+                    tokens = capacity
+                else:
+                    _, tokens, updated = slots[way]
+                    # the clock may go back, never take refills back
+                    tokens = min(capacity, tokens +
+                                 max(now - updated, 0) * per_second)
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+                SLOT.pack_into(self.map, start + way * SLOT.size, key,
+                               tokens, now)
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, self.set_size, start)
+
+        return allowed, tokens
+
+
+_files = {}
+_files_lock = threading.Lock()
+
+
+def bucket_file():
+    """Return the bucket file of the current settings, mapped once"""
+    path = getattr(settings, 'RATE_LIMIT_FILE', DEFAULT_FILE)
+    slots = getattr(settings, 'RATE_LIMIT_SLOTS', 65536)
+    with _files_lock:
+        if (path, slots) not in _files:
+            _files[path, slots] = BucketFile(path, slots)
+        return _files[path, slots]
+
+
+def rate_for(route, user):
+    """Return the (requests, seconds) a user may send to a route, or None"""
+    rates = dict(getattr(settings, 'RATE_LIMITS', {}))
+    if user.is_authenticated:
+        rates.update(getattr(settings, 'RATE_LIMIT_USERS', {}).get(
+            user.pk, {}))
+
+    return parse_rate(rates[route] if route in rates
+                      else rates.get('default'))
+
+
+class SharedRateThrottle(BaseThrottle):
+    """Throttle the requests of every client per route, host wide"""
+
+    def allow_request(self, request, view):
+        match = request.resolver_match
+        route = match.view_name if match else ''
+        rate = rate_for(route, request.user)
+        if rate is None:
+            return True
+
+        if request.user.is_authenticated:
+            client = f'user:{request.user.pk}'
+        else:
+            client = f'address:{self.get_ident(request)}'
+        capacity, seconds = rate
+        per_second = capacity / seconds
+        allowed, tokens = bucket_file().take(f'{client} {route}', capacity,
+                                             per_second)
+
+        self.retry_after = None if allowed else (1 - tokens) / per_second
+        # sent by RateLimitHeadersMiddleware
+        request._request.rate_limit = (
+            capacity, int(tokens),
+            math.ceil((capacity - tokens) / per_second))
+
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+class RateLimitHeadersMiddleware:
+    """Send the state of the bucket a request was checked against"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        rate_limit = getattr(request, 'rate_limit', None)
+        if rate_limit is not None:
+            limit, remaining, reset = rate_limit
+            response['RateLimit-Limit'] = str(limit)
+            response['RateLimit-Remaining'] = str(remaining)
+            response['RateLimit-Reset'] = str(reset)
+
+        return response
@@ -0,0 +1,13 @@
+from django.urls import path
+
+from core import views
+
+app_name = 'core'
+
+urlpatterns = [
+    path('profiles/', views.ProfileListView.as_view(), name='profile-list'),
+    path('profiles/<str:profile_id>/<str:profile_format>/',
+         views.ProfileDownloadView.as_view(), name='profile-download'),
+    path('jobs/', views.JobListView.as_view(), name='job-list'),
+    path('jobs/<int:pk>/', views.JobDetailView.as_view(), name='job-detail'),
+]
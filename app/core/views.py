@@ -0,0 +1,129 @@
+import os
+
+from django.conf import settings
+from django.http import (FileResponse, Http404, HttpResponse,
+                         HttpResponseForbidden)
+from django.shortcuts import render
+from rest_framework.authentication import (SessionAuthentication,
+                                           TokenAuthentication)
+from rest_framework import generics
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from rest_framework.views import APIView
+
+from core import batch, profiling
+from core.batch import BatchAuthentication
+from core.models import Job
+from core.serializers import BatchSerializer, JobSerializer
+from core.instrumentation import registry
+from core.slow_queries import slow_query_log
+
+
+def metrics(request):
+    """Expose the request metrics in the Prometheus text format"""
+    allowed_ips = getattr(settings, 'METRICS_ALLOWED_IPS', ())
+    if (request.META.get('REMOTE_ADDR') not in allowed_ips and
+            not request.user.is_staff):
+        return HttpResponseForbidden()
+
+    return HttpResponse(
+        registry.render_prometheus(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+def slow_queries(request):
+    """List the slow queries captured by this process"""
+    entries = slow_query_log.entries()
+    for entry in entries:
+        entry['max_ms'] = entry['max_time'] * 1000
+        entry['avg_ms'] = entry['total_time'] / entry['count'] * 1000
+
+    return render(request, 'admin/slow_queries.html', {
+        'title': 'Slow queries',
+        'entries': entries,
+        'threshold': getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', 100),
+    })
+
+
+class ProfileListView(APIView):
+    """List the profiles saved by the profiling middleware"""
+    authentication_classes = (TokenAuthentication, SessionAuthentication,
+                              BatchAuthentication)
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        profiles = profiling.list_profiles()
+        for profile in profiles:
+            profile['downloads'] = {
+                profile_format: reverse(
+                    'core:profile-download',
+                    args=[profile['id'], profile_format],
+                    request=request
+                )
+                for profile_format in profiling.PROFILE_FORMATS
+                if profiling.profile_path(profile['id'], profile_format)
+            }
+
+        return Response(profiles)
+
+
+class ProfileDownloadView(APIView):
+    """Download a saved profile as pstats or collapsed stacks"""
+    authentication_classes = (TokenAuthentication, SessionAuthentication,
+                              BatchAuthentication)
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, profile_id, profile_format):
+        path = profiling.profile_path(profile_id, profile_format)
+        if path is None:
+            raise Http404
+
+        return FileResponse(
+            open(path, 'rb'),
+            as_attachment=True,
+            filename=os.path.basename(path),
+            content_type='application/octet-stream'
+        )
+
+
+class JobViewMixin:
+    """Jobs of the user, staff see every job"""
+    authentication_classes = (TokenAuthentication, SessionAuthentication,
+                              BatchAuthentication)
+    permission_classes = (IsAuthenticated,)
+    serializer_class = JobSerializer
+
+    def get_queryset(self):
+        jobs = Job.objects.order_by('-id')
+        if not self.request.user.is_staff:
+            jobs = jobs.filter(user=self.request.user)
+
+        return jobs
+
+
+class JobListView(JobViewMixin, generics.ListAPIView):
+    """List the latest background jobs"""
+    max_jobs = 50
+
+    def get_queryset(self):
+        return super().get_queryset()[:self.max_jobs]
+
+
+class JobDetailView(JobViewMixin, generics.RetrieveAPIView):
+    """Return the status of a background job"""
+
+
+class BatchView(APIView):
+    """Run many API requests, authenticated once, and return every result"""
+    authentication_classes = (TokenAuthentication, SessionAuthentication)
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        return Response(batch.run(request,
+                                  serializer.validated_data['requests'],
+                                  serializer.validated_data['parallel']))
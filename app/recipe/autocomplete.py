@@ -0,0 +1,293 @@
+"""
+Prefix autocomplete of tag and ingredient names ranked by how many
+recipes use each entry.
+
+On Postgres the lookup is a query served by the indexes on lower(name).
+Elsewhere every user's names are kept in memory as a sorted array, a
+prefix is a bisect into that array and the top entries are picked with a
+partial sort.
+
+Entries matching the whole name come first, then entries with a later
+word starting with the query, so `oil` also finds `olive oil`. When
+those don't fill the limit, queries of FUZZY_MIN_LENGTH characters or
+more also match names with a typo: on Postgres with the trigram word
+similarity operator `<%`, served by the trigram index, in memory by the
+edit distance to the start of a word of the candidates sharing the most
+trigrams with the query. `chiken` finds `chicken breast`.
+
+The prefix query is ranked by recipe count. Postgres either walks the
+(user, recipe count, name) index in order and stops at the limit, quick
+for short prefixes matching many names, or fetches the matches of a
+long prefix through the text_pattern_ops index and sorts them. A short
+prefix matching few names of a large library walks much of the first
+index, the planner picks the cheaper plan from the statistics.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Func, Value
+from django.db.models.functions import Lower
+
+
+# sorts after every character, closes a prefix range
+_LAST = chr(0x10FFFF)
+FUZZY_MIN_LENGTH = 3
+# names sharing the most trigrams with the query whose edit distance is
+# computed
+FUZZY_CANDIDATES = 200
+
+
+def normalize(text):
+    return ' '.join(text.lower().split())
+
+
+def trigrams(text):
+    return {text[start:start + 3] for start in range(len(text) - 2)}
+
+
+def max_typos(query):
+    """Return the number of edits a fuzzy match of a query may need"""
+    return 1 if len(query) < 6 else 2
+
+
+def prefix_distance(query, word):
+    """Return the edit distance from a query to the closest prefix of word"""
+    previous = list(range(len(word) + 1))
+    for row, char in enumerate(query, 1):
+        current = [row]
+        for column, other in enumerate(word, 1):
+            current.append(min(previous[column] + 1, current[-1] + 1,
+                               previous[column - 1] + (char != other)))
+        previous = current
+
+    return min(previous)
+
+
+class WordSimilar(Func):
+    """`query <% name`, true when name has an extent similar to query"""
+    arg_joiner = ' <%% '
+    template = '%(expressions)s'
+    output_field = BooleanField()
+
+
+class WordSimilarity(Func):
+    function = 'word_similarity'
+    output_field = FloatField()
+
+
+class AutocompleteIndex:
+    """Names of the tags or ingredients of one user sorted by name"""
+
+    def __init__(self, rows):
+        self.built = time.monotonic()
+        rows = sorted((normalize(name), pk, name, count)
+                      for pk, name, count in rows)
+        self.keys = [row[0] for row in rows]
+        self.ids = np.array([row[1] for row in rows], dtype=np.int64)
+        self.names = [row[2] for row in rows]
+        self.counts = np.array([row[3] for row in rows], dtype=np.int64)
+
+        # every word but the first, which the keys already cover
+        words = sorted(
+            (word, entry) for entry, key in enumerate(self.keys)
+            for word in key.split(' ')[1:]
+        )
+        self.words = [word for word, _ in words]
+        self.word_entries = np.array([entry for _, entry in words],
+                                     dtype=np.int64)
+        self._trigram_entries = None
+
+    @classmethod
+    def build(cls, model, user_id):
+        return cls(model.objects.filter(user_id=user_id).values_list(
+            'id', 'name', 'recipe_count'))
+
+    def __len__(self):
+        return len(self.names)
+
+    def _top(self, entries, limit):
+        """
+        Return the `limit` most used of entries in name order, most used
+        first and by name among equally used ones
+        """
+        if len(entries) > limit:
+            counts = self.counts[entries]
+            cut = len(counts) - limit
+            threshold = np.partition(counts, cut)[cut]
+            above = entries[counts > threshold]
+            entries = np.concatenate([
+                above,
+                entries[counts == threshold][:limit - len(above)]
+            ])
+        entries = entries[np.lexsort((entries, -self.counts[entries]))]
+
+        return [(int(self.ids[entry]), self.names[entry],
+                 int(self.counts[entry])) for entry in entries]
+
+    def search(self, query, limit=10):
+        """Return (id, name, recipe count) of the best matches"""
+        if limit <= 0:
+            return []
+        query = normalize(query)
+        first = bisect_left(self.keys, query)
+        last = bisect_left(self.keys, query + _LAST, first)
+        matches = self._top(np.arange(first, last), limit)
+        if len(matches) == limit or not query:
+            return matches
+
+        start = bisect_left(self.words, query)
+        end = bisect_left(self.words, query + _LAST, start)
+        # unique sorts the entries, which keeps them in name order
+        word_entries = np.unique(self.word_entries[start:end])
+        word_entries = word_entries[(word_entries < first) |
+                                    (word_entries >= last)]
+
+        matches += self._top(word_entries, limit - len(matches))
+        if len(matches) == limit or len(query) < FUZZY_MIN_LENGTH:
+            return matches
+
+        matched = np.concatenate([np.arange(first, last), word_entries])
+        return matches + self.fuzzy(query, matched, limit - len(matches))
+
+    def trigram_entries(self):
+        """Return the entries of every trigram of the names, built once"""
+        if self._trigram_entries is None:
+            entries = {}
+            for entry, key in enumerate(self.keys):
+                for trigram in trigrams(key):
+                    entries.setdefault(trigram, []).append(entry)
+            self._trigram_entries = {
+                trigram: np.array(found, dtype=np.int64)
+                for trigram, found in entries.items()}
+
+        return self._trigram_entries
+
+    def fuzzy(self, query, matched, limit):
+        """
+        Return the `limit` entries not in `matched` with a word starting
+        within max_typos edits of the query, closest and most used first
+        """
+        postings = [self.trigram_entries().get(trigram)
+                    for trigram in trigrams(query)]
+        postings = [found for found in postings if found is not None]
+        if not postings:
+            return []
+
+        shared = np.bincount(np.concatenate(postings),
+                             minlength=len(self.keys))
+        shared[matched] = 0
+        candidates = np.nonzero(shared)[0]
+        if len(candidates) > FUZZY_CANDIDATES:
+            candidates = candidates[np.argpartition(
+                -shared[candidates], FUZZY_CANDIDATES)[:FUZZY_CANDIDATES]]
+
+        typos = max_typos(query)
+        scored = []
+        for entry in candidates:
+            key = self.keys[entry]
+            # the whole name covers its first word
+            distance = min(prefix_distance(query, word)
+                           for word in [key] + key.split(' ')[1:])
+            if distance <= typos:
+                scored.append((distance, -self.counts[entry],
+                               self.keys[entry], entry))
+
+        return [(int(self.ids[entry]), self.names[entry],
+                 int(self.counts[entry]))
+                for *_, entry in sorted(scored)[:limit]]
+
+
+class AutocompleteCache:
+    """
+    LRU cache of the autocomplete indexes of (model, user) pairs bounded
+    by their total number of entries. Changes made in this process drop
+    the index through signals, changes made by other processes show up
+    once the index is AUTOCOMPLETE_CACHE_TTL seconds old.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+
+    @property
+    def max_entries(self):
+        return getattr(settings, 'AUTOCOMPLETE_CACHE_MAX_ENTRIES', 1000000)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'AUTOCOMPLETE_CACHE_TTL', 60)
+
+    def get(self, model, user_id):
+        """Return a fresh enough index, building it if needed"""
+        key = (model._meta.label, user_id)
+        with self._lock:
+            index = self._indexes.get(key)
+            if (index is not None and
+                    time.monotonic() - index.built < self.ttl):
+                self._indexes.move_to_end(key)
+                return index
+
+        index = AutocompleteIndex.build(model, user_id)
+        with self._lock:
+            self._indexes[key] = index
+            self._indexes.move_to_end(key)
+            total = sum(len(cached) for cached in self._indexes.values())
+            while total > self.max_entries and len(self._indexes) > 1:
+                _, evicted = self._indexes.popitem(last=False)
+                total -= len(evicted)
+
+        return index
+
+    def invalidate(self, model, user_id):
+        with self._lock:
+            self._indexes.pop((model._meta.label, user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+cache = AutocompleteCache()
+
+
+def database_search(model, user_id, query, limit=10):
+    """Return (id, name, recipe count) of the best matches using SQL"""
+    query = normalize(query)
+    queryset = model.objects.filter(user_id=user_id).annotate(
+        lower_name=Lower('name')
+    ).order_by('-recipe_count', 'lower_name', 'id').values_list(
+        'id', 'name', 'recipe_count')
+
+    matches = list(queryset.filter(lower_name__startswith=query)[:limit])
+    if len(matches) < limit and query:
+        matches += list(queryset.filter(
+            lower_name__contains=f' {query}'
+        ).exclude(
+            id__in=[row[0] for row in matches]
+        )[:limit - len(matches)])
+    # pg_trgm only, served by the trigram index on lower(name)
+    if (len(matches) < limit and len(query) >= FUZZY_MIN_LENGTH and
+            connection.vendor == 'postgresql'):
+        matches += list(queryset.filter(
+            WordSimilar(Value(query), Lower('name'))
+        ).exclude(
+            id__in=[row[0] for row in matches]
+        ).order_by(
+            WordSimilarity(Value(query), Lower('name')).desc(),
+            '-recipe_count', 'lower_name', 'id'
+        )[:limit - len(matches)])
+
+    return matches
+
+
+def search(model, user_id, query, limit=10):
+    """Return the best matches of the user's tags or ingredients"""
+    if connection.vendor == 'postgresql':
+        return database_search(model, user_id, query, limit)
+
+    return cache.get(model, user_id).search(query, limit)
@@ -0,0 +1,102 @@
+"""
+Denormalized number of recipes using every tag and ingredient.
+
+The recipe_count columns are updated with F() expressions from the
+m2m_changed and recipe delete signals, so concurrent changes never lose
+an update. Recipes pending deletion aren't counted, they are uncounted
+when marked and their purge leaves the counts alone. Changes the signals
+don't see, like bulk_create of through rows or raw SQL, are fixed by
+`manage.py reconcile_recipe_counts`.
+"""
+from collections import defaultdict
+
+from django.db.models import Count, F, Q
+
+from core.models import Tag, Ingredient, Recipe
+
+
+# relation name on Recipe and id column on the through table of each model
+RELATIONS = {
+    Tag: ('tags', 'tag_id'),
+    Ingredient: ('ingredients', 'ingredient_id'),
+}
+
+
+def through_model(model):
+    return getattr(Recipe, RELATIONS[model][0]).through
+
+
+def linked_ids(model, recipe_id, ids=None):
+    """Return the ids of the objects of a model linked to a recipe"""
+    links = through_model(model).objects.filter(recipe_id=recipe_id)
+    if ids is not None:
+        links = links.filter(**{f'{RELATIONS[model][1]}__in': ids})
+
+    return list(links.values_list(RELATIONS[model][1], flat=True))
+
+
+def linked_count(model, object_id, recipe_ids=None):
+    """Return the number of recipes linked to an object"""
+    links = through_model(model).objects.filter(
+        recipe__pending_deletion=False, **{RELATIONS[model][1]: object_id})
+    if recipe_ids is not None:
+        links = links.filter(recipe_id__in=recipe_ids)
+
+    return links.count()
+
+
+def change(model, ids, delta):
+    """Add `delta` to the recipe count of the objects with the given ids"""
+    if ids and delta:
+        model.objects.filter(id__in=ids).update(
+            recipe_count=F('recipe_count') + delta)
+
+
+def recipe_deleted(recipe):
+    """Decrement the counts of everything linked to a recipe being deleted"""
+    for model in RELATIONS:
+        model.objects.filter(recipe=recipe).update(
+            recipe_count=F('recipe_count') - 1)
+
+
+def recipes_hidden(recipe_ids):
+    """Decrement the counts of everything linked to recipes being hidden"""
+    for model, (_, column) in RELATIONS.items():
+        ids_by_links = defaultdict(list)
+        for object_id, links in through_model(model).objects.filter(
+                recipe_id__in=recipe_ids
+        ).values(column).annotate(links=Count('id')).values_list(
+                column, 'links'):
+            ids_by_links[links].append(object_id)
+        # one update per distinct number of links
+        for links, ids in ids_by_links.items():
+            change(model, ids, -links)
+
+
+def reconcile(model, batch_size=1000, **filters):
+    """
+    Recount the recipes of the objects of a model matching the filters in
+    id batches, return the number of fixed rows. A row is only fixed if
+    it still holds the value just read, a concurrent F() update wins and
+    is left alone.
+    """
+    objects = model.objects.filter(**filters)
+    fixed = 0
+    last_id = 0
+    while True:
+        batch = list(objects.filter(id__gt=last_id).order_by(
+            'id'
+        ).annotate(
+            actual=Count('recipe',
+                         filter=Q(recipe__pending_deletion=False))
+        ).values_list('id', 'recipe_count', 'actual')[:batch_size])
+        if not batch:
+            break
+        for object_id, stored, actual in batch:
+            if stored != actual:
+                fixed += model.objects.filter(
+                    id=object_id, recipe_count=stored
+                ).update(recipe_count=actual)
+        last_id = batch[-1][0]
+
+    return fixed
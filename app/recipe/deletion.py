@@ -0,0 +1,190 @@
+"""
+Deletion of users and recipes in bounded batches.
+
+Deleting a user in one statement cascades to every recipe, tag,
+ingredient and link row in a single transaction, holding locks for as
+long as a large library takes to delete. Instead the rows are marked
+pending deletion, which hides them from the API at once, and a background
+job (see recipe.tasks) purges them in small batches of one transaction
+each. Image files are removed once the batch deleting their recipes has
+committed, and the rows deleted per second are capped by
+DELETION_MAX_ROWS_PER_SECOND so a purge doesn't starve other writes.
+
+Marked recipes leave the recipe counts, library stats, similarity index
+and caches in the marking transaction, the purge doesn't count them out
+again. A purged user takes all of it along, the per row delete receivers
+skip the rows of a user being purged (see `purging`) and their caches are
+dropped once at the end.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from core.events import broker
+from core.models import Tag, Ingredient, Recipe, LibraryStats
+from recipe import autocomplete, counters, pantry, similarity, stats
+
+
+logger = logging.getLogger(__name__)
+_purging = threading.local()
+
+
+@contextmanager
+def purging(user_id):
+    """Mark a user as being purged by the current thread"""
+    user_ids = _purging.__dict__.setdefault('user_ids', set())
+    user_ids.add(user_id)
+    try:
+        yield
+    finally:
+        user_ids.discard(user_id)
+
+
+def is_purging(user_id):
+    """Return whether the rows of a user are being purged by this thread"""
+    return user_id in getattr(_purging, 'user_ids', ())
+
+
+def mark_recipes(user, recipe_ids):
+    """Hide recipes of a user until they are purged, return how many"""
+    with transaction.atomic():
+        # the locks keep a concurrent mark from uncounting them twice
+        rows = list(Recipe.objects.select_for_update().filter(
+            user=user, id__in=recipe_ids, pending_deletion=False
+        ).values_list('id', 'time_minutes', 'price'))
+        recipe_ids = [recipe_id for recipe_id, _, _ in rows]
+        if not recipe_ids:
+            return 0
+
+        Recipe.objects.filter(id__in=recipe_ids).update(
+            pending_deletion=True)
+        counters.recipes_hidden(recipe_ids)
+        stats.recipes_changed(user.id, removed=[
+            (minutes, price) for _, minutes, price in rows])
+        similarity.remove_recipes(recipe_ids)
+        pantry.cache.invalidate(user.id)
+        for recipe_id in recipe_ids:
+            broker.publish_on_commit(user.id, 'recipe', 'deleted', recipe_id)
+    autocomplete.cache.invalidate(Tag, user.id)
+    autocomplete.cache.invalidate(Ingredient, user.id)
+
+    return len(recipe_ids)
+
+
+def mark_user(user):
+    """Deactivate a user until their library is purged"""
+    get_user_model().objects.filter(id=user.id).update(
+        is_active=False, pending_deletion=True)
+
+
+class Throttle:
+    """Sleep as needed to keep under a number of rows per second"""
+
+    def __init__(self, rows_per_second):
+        self.rows_per_second = rows_per_second
+        self.start = time.monotonic()
+        self.rows = 0
+
+    def __call__(self, rows):
+        self.rows += rows
+        if not self.rows_per_second:
+            return
+        ahead = (self.rows / self.rows_per_second -
+                 (time.monotonic() - self.start))
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def remove_files(names):
+    for name in names:
+        try:
+            default_storage.delete(name)
+        except OSError:
+            logger.warning('Could not remove %s', name, exc_info=True)
+
+
+def delete_batch(objects, batch_size):
+    """
+    Delete the first objects of a queryset in one transaction, return the
+    number of objects and of rows, cascades included, deleted
+    """
+    with transaction.atomic():
+        ids = list(objects.order_by('id').values_list(
+            'id', flat=True)[:batch_size])
+        if not ids:
+            return 0, 0
+
+        batch = objects.model.objects.filter(id__in=ids)
+        images = []
+        if objects.model is Recipe:
+            images = [name for name in batch.values_list('image', flat=True)
+                      if name]
+        rows, _ = batch.delete()
+        # a rolled back batch keeps its recipes, and needs their images
+        transaction.on_commit(lambda: remove_files(images))
+
+    return len(ids), rows
+
+
+def purge(querysets, batch_size=None, max_rows_per_second=None,
+          progress=None):
+    """
+    Delete every object of the querysets in batches, calling `progress`
+    with the number of objects deleted and to delete after each batch,
+    return the number of deleted objects
+    """
+    if batch_size is None:
+        batch_size = getattr(settings, 'DELETION_BATCH_SIZE', 500)
+    if max_rows_per_second is None:
+        max_rows_per_second = getattr(settings,
+                                      'DELETION_MAX_ROWS_PER_SECOND', 5000)
+    total = sum(objects.count() for objects in querysets)
+    deleted = 0
+    throttle = Throttle(max_rows_per_second)
+    if progress:
+        progress(deleted=deleted, total=total)
+
+    for objects in querysets:
+        while True:
+            count, rows = delete_batch(objects, batch_size)
+            if not count:
+                break
+            deleted += count
+            if progress:
+                progress(deleted=deleted, total=max(total, deleted))
+            throttle(rows)
+
+    return deleted
+
+
+def purge_recipes(user_id, **options):
+    """Delete the recipes of a user pending deletion"""
+    return purge([Recipe.objects.filter(user_id=user_id,
+                                        pending_deletion=True)], **options)
+
+
+def purge_user(user_id, **options):
+    """Delete a user pending deletion and everything they own"""
+    user = get_user_model().objects.filter(id=user_id,
+                                           pending_deletion=True).first()
+    if user is None:
+        return 0
+
+    with purging(user_id):
+        LibraryStats.objects.filter(user_id=user_id).delete()
+        # recipes first, so every batch also deletes a bounded number of
+        # links
+        deleted = purge([model.objects.filter(user_id=user_id)
+                         for model in (Recipe, Tag, Ingredient)], **options)
+        user.delete()
+    pantry.cache.invalidate(user_id)
+    autocomplete.cache.invalidate(Tag, user_id)
+    autocomplete.cache.invalidate(Ingredient, user_id)
+
+    return deleted
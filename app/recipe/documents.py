@@ -0,0 +1,196 @@
+"""
+Recipe JSON rendered ahead of time.
+
+Recipes are read far more often than they are written, so the detail and
+list item JSON of every recipe is stored in its RecipeDocument row. The
+detail and plain list responses are assembled from the stored text in
+one query, without loading the tags and ingredients or running a
+serializer.
+
+Writes changing what a document shows (recipe saves, tag and ingredient
+links, tag and ingredient renames and deletes) call `stale`, which
+deletes the documents in the writing transaction, so a stored document
+is never older than the committed rows, and renders them again once the
+transaction commits, once per recipe whatever the number of writes.
+Renders of more than RECIPE_DOCUMENTS_SYNC_LIMIT recipes, like renaming a
+tag of thousands of recipes, are left to a background job. A missing
+document is rendered when it's read and stored.
+
+`manage.py check_recipe_documents` compares the stored documents with the
+live serializers.
+"""
+import threading
+import weakref
+
+from django.conf import settings
+from django.db import transaction
+
+from core.models import Recipe, RecipeDocument
+from core.renderers import ORJSONRenderer
+from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+
+
+BATCH_SIZE = 500
+
+_renderer = ORJSONRenderer()
+# (recipe ids, callback reference) of the transaction of every alias
+_pending = threading.local()
+
+
+def render(recipe):
+    """Return the (detail, list item) JSON of a prefetched recipe"""
+    return (_renderer.render(RecipeDetailSerializer(recipe).data).decode(),
+            _renderer.render(RecipeSerializer(recipe).data).decode())
+
+
+def load(recipe_ids):
+    """Return the recipes of the given ids with their tags and ingredients"""
+    return Recipe.objects.filter(id__in=recipe_ids).prefetch_related(
+        'tags', 'ingredients')
+
+
+def refresh(recipe_ids):
+    """Render and store the documents of the given recipes"""
+    recipe_ids = sorted(set(recipe_ids))
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        batch = recipe_ids[start:start + BATCH_SIZE]
+        documents = []
+        for recipe in load(batch):
+            detail, list_item = render(recipe)
+            documents.append(RecipeDocument(recipe_id=recipe.id,
+                                            detail=detail,
+                                            list_item=list_item))
+        # replaces the documents a concurrent read may have stored
+        with transaction.atomic():
+            RecipeDocument.objects.filter(recipe_id__in=batch).delete()
+            RecipeDocument.objects.bulk_create(documents)
+
+
+def render_missing(recipes):
+    """
+    Render and store the documents of recipes read without one, return
+    them by recipe id
+    """
+    documents = {}
+    for recipe in recipes:
+        detail, list_item = render(recipe)
+        documents[recipe.id] = RecipeDocument(recipe_id=recipe.id,
+                                              detail=detail,
+                                              list_item=list_item)
+    # another read may have stored them meanwhile
+    RecipeDocument.objects.bulk_create(documents.values(),
+                                       ignore_conflicts=True)
+
+    return documents
+
+
+def flush(recipe_ids):
+    """Render the stale documents of a committed transaction"""
+    limit = getattr(settings, 'RECIPE_DOCUMENTS_SYNC_LIMIT', 200)
+    if len(recipe_ids) <= limit:
+        refresh(recipe_ids)
+        return
+
+    from recipe import tasks
+    tasks.refresh_documents.enqueue(
+        payload={'recipe_ids': sorted(recipe_ids)})
+
+
+def stale(recipe_ids, exists=True):
+    """
+    Delete the documents of recipes being changed and render them once
+    the transaction commits, `exists` is False for new recipes
+    """
+    recipe_ids = set(recipe_ids)
+    if not recipe_ids:
+        return
+    if exists:
+        RecipeDocument.objects.filter(recipe_id__in=recipe_ids).delete()
+
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        flush(recipe_ids)
+        return
+
+    # one callback renders every recipe of the transaction. A rollback
+    # drops the callback, only the transaction references it, so a dead
+    # reference means the next write registers a new one
+    alias = connection.alias
+    pending = getattr(_pending, alias, None)
+    if pending is None or pending[1]() is None:
+        ids = set()
+
+        def render_pending():
+            setattr(_pending, alias, None)
+            flush(ids)
+
+        pending = (ids, weakref.ref(render_pending))
+        setattr(_pending, alias, pending)
+        transaction.on_commit(render_pending, using=alias)
+    pending[0].update(recipe_ids)
+
+
+def list_document(rows):
+    """
+    Return the JSON list of the recipes of (id, list item) rows, rendering
+    the missing items
+    """
+    rows = list(rows)
+    missing = [recipe_id for recipe_id, item in rows if item is None]
+    rendered = render_missing(load(missing)) if missing else {}
+    items = []
+    for recipe_id, item in rows:
+        if item is None:
+            if recipe_id not in rendered:
+                # deleted since the rows were read
+                continue
+            item = rendered[recipe_id].list_item
+        items.append(item)
+
+    return f'[{",".join(items)}]'.encode()
+
+
+def detail_document(recipe_id, document):
+    """
+    Return the detail JSON of a recipe, rendering it when missing, None if
+    the recipe is gone
+    """
+    if document is None:
+        rendered = render_missing(load([recipe_id]))
+        if recipe_id not in rendered:
+            return None
+        document = rendered[recipe_id].detail
+
+    return document.encode()
+
+
+def check(batch_size=1000, fix=False):
+    """
+    Compare the stored documents with the live serializers, return how
+    many recipes were checked, had no document and had a stale one. With
+    `fix` the missing and stale documents are rendered again
+    """
+    checked = missing = mismatched = 0
+    last_id = 0
+    while True:
+        recipes = list(Recipe.objects.filter(id__gt=last_id).order_by(
+            'id').select_related('document').prefetch_related(
+            'tags', 'ingredients')[:batch_size])
+        if not recipes:
+            return checked, missing, mismatched
+        last_id = recipes[-1].id
+
+        broken = []
+        for recipe in recipes:
+            checked += 1
+            try:
+                stored = recipe.document
+            except RecipeDocument.DoesNotExist:
+                missing += 1
+                broken.append(recipe.id)
+                continue
+            if (stored.detail, stored.list_item) != render(recipe):
+                mismatched += 1
+                broken.append(recipe.id)
+        if fix and broken:
+            refresh(broken)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipe import documents
+
+
+class Command(BaseCommand):
+    help = 'Compare the stored recipe JSON with the live serializers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--fix', action='store_true',
+                            help='render the missing and stale JSON again')
+
+    def handle(self, *args, **options):
+        checked, missing, stale = documents.check(options['batch_size'],
+                                                  fix=options['fix'])
+        summary = (f'Checked {checked} recipes, {missing} missing and '
+                   f'{stale} stale documents')
+        if stale and not options['fix']:
+            raise CommandError(summary)
+
+        self.stdout.write(self.style.SUCCESS(
+            summary + (', fixed' if options['fix'] else '')))
@@ -0,0 +1,35 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from core.models import Recipe
+from recipe import deletion
+
+
+class Command(BaseCommand):
+    help = 'Purge the users and recipes left pending deletion'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--max-rows-per-second', type=int)
+
+    def handle(self, *args, **options):
+        purge_options = {
+            'batch_size': options['batch_size'],
+            'max_rows_per_second': options['max_rows_per_second'],
+            'progress': self.progress,
+        }
+        user_ids = list(get_user_model().objects.filter(
+            pending_deletion=True).values_list('id', flat=True))
+        for user_id in user_ids:
+            deletion.purge_user(user_id, **purge_options)
+        recipe_user_ids = list(Recipe.objects.filter(
+            pending_deletion=True
+        ).order_by().values_list('user_id', flat=True).distinct())
+        recipes = sum(deletion.purge_recipes(user_id, **purge_options)
+                      for user_id in recipe_user_ids)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Purged {len(user_ids)} users and {recipes} recipes'))
+
+    def progress(self, deleted, total):
+        self.stdout.write(f'Deleted {deleted} of {total}')
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Recipe, RecipeSignature, RecipeBand
+from recipe import similarity
+
+
+def remove_range(first_id, last_id=None):
+    """Take the recipes of an id range out of the index"""
+    for model in (RecipeSignature, RecipeBand):
+        rows = model.objects.filter(recipe_id__gte=first_id)
+        if last_id is not None:
+            rows = rows.filter(recipe_id__lte=last_id)
+        rows.delete()
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the MinHash/LSH index used to find similar recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        # the index is replaced one id range at a time, so it keeps
+        # answering during the rebuild and an interrupted one leaves it
+        # whole
+        recipes = Recipe.objects.filter(pending_deletion=False).order_by(
+            'id').values_list('id', 'user_id')
+        total = 0
+        last_id = 0
+        while True:
+            batch = list(recipes.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                # also drops deleted and pending recipes of the range
+                remove_range(last_id + 1, batch[-1][0])
+                similarity.index_recipes(batch)
+            total += len(batch)
+            last_id = batch[-1][0]
+        remove_range(last_id + 1)
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} recipes'))
@@ -0,0 +1,27 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from recipe import stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the library stats of every user exactly'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append',
+                            dest='user_ids',
+                            help='only recompute this user id, repeatable')
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+        if not user_ids:
+            user_ids = get_user_model().objects.order_by('id').values_list(
+                'id', flat=True).iterator()
+
+        total = 0
+        for user_id in user_ids:
+            stats.recompute(user_id)
+            total += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Recomputed the stats of {total} users'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from recipe import counters
+
+
+class Command(BaseCommand):
+    help = 'Fix drift in the recipe counts of tags and ingredients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for model in counters.RELATIONS:
+            fixed = counters.reconcile(model, options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Fixed {fixed} {model._meta.verbose_name_plural}'))
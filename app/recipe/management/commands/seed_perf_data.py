@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from core.perfdata import clear_perf_data
+from recipe.perfdata import seed_perf_data
+
+
+class Command(BaseCommand):
+    help = 'Bulk create synthetic users, tags, ingredients and recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--tags', type=int, default=20,
+                            help='tags per user')
+        parser.add_argument('--ingredients', type=int, default=50,
+                            help='ingredients per user')
+        parser.add_argument('--recipes', type=int, default=100,
+                            help='recipes per user')
+        parser.add_argument('--tags-per-recipe', type=int, default=3)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=6)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='perf',
+                            help='prefix of the perf user emails')
+        parser.add_argument('--clear', action='store_true',
+                            help='delete existing perf users first')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            clear_perf_data(options['prefix'])
+
+        users = seed_perf_data(
+            users=options['users'],
+            tags=options['tags'],
+            ingredients=options['ingredients'],
+            recipes=options['recipes'],
+            tags_per_recipe=options['tags_per_recipe'],
+            ingredients_per_recipe=options['ingredients_per_recipe'],
+            seed=options['seed'],
+            prefix=options['prefix'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(users)} users with {options["recipes"]} '
+            f'recipes each'
+        ))
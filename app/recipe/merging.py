@@ -0,0 +1,86 @@
+"""
+Set-wise merges of tags and ingredients.
+
+Merging near-duplicates moves the recipe links of the merged objects to
+the kept one with a single UPDATE of the through table, skipping the
+links a recipe already has, deletes the links left over and then the
+merged objects, all in one transaction. The work is proportional to the
+links being moved, not to the size of the library.
+
+The UPDATE sends no m2m_changed signal, so the recipe counts, similarity
+index, autocomplete cache, stored recipe JSON and event stream are
+updated here, once for every affected recipe at the same time instead of
+once per recipe. The deletes of the merged objects mark the pantry index
+stale.
+"""
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+
+from core.events import broker
+from recipe import autocomplete, counters, documents, similarity
+
+
+class MergeError(Exception):
+    """Raised when the objects to merge can't be merged"""
+
+
+def merge(target, source_ids):
+    """
+    Merge the tags or ingredients of the given ids into `target`, which
+    must share their type and owner. Return the ids of the recipes whose
+    links changed
+    """
+    model = type(target)
+    column = counters.RELATIONS[model][1]
+    through = counters.through_model(model)
+    source_ids = set(source_ids) - {target.id}
+
+    if not source_ids:
+        raise MergeError(
+            f'A {model._meta.verbose_name} can\'t be merged into itself.')
+
+    with transaction.atomic():
+        # the locks keep concurrent links to the merged objects out
+        found = set(model.objects.select_for_update().filter(
+            user_id=target.user_id, id__in=source_ids | {target.id}
+        ).values_list('id', flat=True))
+        missing = (source_ids | {target.id}) - found
+        if missing:
+            raise MergeError(
+                f'No {model._meta.verbose_name_plural} with the ids '
+                f'{", ".join(str(pk) for pk in sorted(missing))}.')
+
+        links = through.objects.filter(**{f'{column}__in': source_ids})
+        recipe_ids = set(links.values_list('recipe_id', flat=True))
+        # a recipe linked to several merged objects keeps the first link
+        moving = links.filter(
+            ~Exists(through.objects.filter(recipe_id=OuterRef('recipe_id'),
+                                           **{column: target.id})),
+            ~Exists(through.objects.filter(
+                recipe_id=OuterRef('recipe_id'),
+                id__lt=OuterRef('id'),
+                **{f'{column}__in': source_ids}
+            )),
+        )
+        # recipes pending deletion aren't counted
+        counted = moving.filter(recipe__pending_deletion=False).count()
+        moving.update(**{column: target.id})
+        links.delete()
+        model.objects.filter(id=target.id).update(
+            recipe_count=F('recipe_count') + counted)
+        # unlinked by now, their delete signals update the stats and
+        # caches of the owner and stream the deletes
+        model.objects.filter(id__in=source_ids).delete()
+
+        similarity.update_recipes(recipe_ids)
+        documents.stale(recipe_ids)
+        for recipe_id in recipe_ids:
+            broker.publish_on_commit(target.user_id, 'recipe', 'updated',
+                                     recipe_id)
+        broker.publish_on_commit(target.user_id, model._meta.model_name,
+                                 'updated', target.id)
+    autocomplete.cache.invalidate(model, target.user_id)
+
+    target.refresh_from_db(fields=['recipe_count'])
+
+    return recipe_ids
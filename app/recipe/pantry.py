@@ -0,0 +1,231 @@
+"""
+Per user bitset index of the ingredients of every recipe, used to find the
+recipes a user can make with the ingredients they have.
+
+Each recipe is a row of bits, one per ingredient of its owner. Matching a
+pantry is an AND with the pantry bits and a popcount per row. Indexes are
+kept per process in a LRU cache bounded by PANTRY_INDEX_MAX_BYTES. Every
+change of a user's recipe ingredients bumps the pantry_version of their
+LibraryStats row in the writing transaction, an index built at an older
+version is stale, whichever process made the change. The loaded index of
+the writing process is only patched once the change commits, a rolled back
+change never reaches it.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from core.models import Ingredient, Recipe, LibraryStats
+from recipe import stats
+
+
+# number of set bits of every byte value
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)],
+                     dtype=np.uint8)
+# rough per entry overhead of the id to row/column dicts
+_DICT_ENTRY_BYTES = 100
+
+
+def popcount(bits):
+    """Return the number of set bits of every row of a uint64 matrix"""
+    return _POPCOUNT[bits.view(np.uint8)].reshape(
+        bits.shape[0], bits.shape[1] * 8).sum(axis=1, dtype=np.int64)
+
+
+def current_version(user_id):
+    """Return the pantry version of a user, creating their stats if needed"""
+    version = LibraryStats.objects.filter(user_id=user_id).values_list(
+        'pantry_version', flat=True).first()
+    if version is None:
+        # without a row the changes couldn't be counted
+        version = stats.recompute(user_id).pantry_version
+
+    return version
+
+
+def bump_version(user_id):
+    """Mark the pantry indexes of a user stale in every process"""
+    LibraryStats.objects.filter(user_id=user_id).update(
+        pantry_version=F('pantry_version') + 1)
+
+
+class PantryIndex:
+    """Bitsets of the ingredients of a user's recipes"""
+
+    def __init__(self, ingredient_ids, links, stamp):
+        self.stamp = stamp
+        # recipes may link ingredients of other users, they get columns
+        # of their own
+        ingredient_ids = set(ingredient_ids).union(
+            ingredient_id for _, ingredient_id in links)
+        self.columns = {ingredient_id: column for column, ingredient_id
+                        in enumerate(sorted(ingredient_ids))}
+        self.words = max((len(self.columns) + 63) // 64, 1)
+
+        recipe_ids = sorted({recipe_id for recipe_id, _ in links})
+        self.rows = {recipe_id: row for row, recipe_id
+                     in enumerate(recipe_ids)}
+        self.recipe_ids = np.array(recipe_ids, dtype=np.int64)
+        self.bits = np.zeros((len(recipe_ids), self.words), dtype=np.uint64)
+        if links:
+            rows = np.array([self.rows[recipe_id] for recipe_id, _ in links])
+            columns = np.array([self.columns[ingredient_id]
+                                for _, ingredient_id in links])
+            np.bitwise_or.at(
+                self.bits,
+                (rows, columns // 64),
+                np.left_shift(np.uint64(1), (columns % 64).astype(np.uint64))
+            )
+        self.counts = popcount(self.bits)
+
+    @classmethod
+    def build(cls, user_id, stamp):
+        """
+        Build the index of a user at the pantry version `stamp`, read
+        before the links so a change racing the build only costs a rebuild
+        """
+        ingredient_ids = Ingredient.objects.filter(
+            user_id=user_id).values_list('id', flat=True)
+        links = list(Recipe.ingredients.through.objects.filter(
+            recipe__user_id=user_id, recipe__pending_deletion=False
+        ).values_list('recipe_id', 'ingredient_id'))
+
+        return cls(list(ingredient_ids), links, stamp)
+
+    @property
+    def nbytes(self):
+        return (self.bits.nbytes + self.recipe_ids.nbytes +
+                self.counts.nbytes +
+                _DICT_ENTRY_BYTES * (len(self.rows) + len(self.columns)))
+
+    def set_recipe(self, recipe_id, ingredient_ids):
+        """
+        Replace the ingredients of a recipe, return False if an ingredient
+        isn't in the index and it has to be rebuilt
+        """
+        row_bits = np.zeros(self.words, dtype=np.uint64)
+        for ingredient_id in ingredient_ids:
+            column = self.columns.get(ingredient_id)
+            if column is None:
+                return False
+            row_bits[column // 64] |= np.uint64(1) << np.uint64(column % 64)
+
+        row = self.rows.get(recipe_id)
+        if row is None:
+            row = self.rows[recipe_id] = len(self.recipe_ids)
+            self.recipe_ids = np.append(self.recipe_ids, recipe_id)
+            self.bits = np.vstack([self.bits, row_bits])
+            self.counts = np.append(self.counts, 0)
+        self.bits[row] = row_bits
+        self.counts[row] = popcount(row_bits[None, :])[0]
+
+        return True
+
+    def match(self, ingredient_ids, max_missing=0, limit=20):
+        """
+        Return (recipe id, matched, missing) of the recipes missing at most
+        `max_missing` ingredients, fewest missing first
+        """
+        pantry = np.zeros(self.words, dtype=np.uint64)
+        for ingredient_id in ingredient_ids:
+            column = self.columns.get(ingredient_id)
+            if column is not None:
+                pantry[column // 64] |= (np.uint64(1) <<
+                                         np.uint64(column % 64))
+
+        matched = popcount(self.bits & pantry)
+        missing = self.counts - matched
+        # recipes without any ingredient are never suggested
+        candidates = np.nonzero((self.counts > 0) &
+                                (missing <= max_missing))[0]
+        order = np.lexsort((self.recipe_ids[candidates],
+                            -matched[candidates],
+                            missing[candidates]))[:limit]
+
+        return [
+            (int(self.recipe_ids[row]), int(matched[row]), int(missing[row]))
+            for row in candidates[order]
+        ]
+
+
+class PantryIndexCache:
+    """LRU cache of pantry indexes bounded by their total size in bytes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+
+    @property
+    def max_bytes(self):
+        return getattr(settings, 'PANTRY_INDEX_MAX_BYTES', 64 * 1024 * 1024)
+
+    def nbytes(self):
+        with self._lock:
+            return sum(index.nbytes for index in self._indexes.values())
+
+    def get(self, user_id):
+        """Return the up to date index of a user, building it if needed"""
+        stamp = current_version(user_id)
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None and index.stamp == stamp:
+                self._indexes.move_to_end(user_id)
+                return index
+
+        index = PantryIndex.build(user_id, stamp)
+        with self._lock:
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            self._evict()
+
+        return index
+
+    def _evict(self):
+        total = sum(index.nbytes for index in self._indexes.values())
+        while total > self.max_bytes and self._indexes:
+            _, index = self._indexes.popitem(last=False)
+            total -= index.nbytes
+
+    def recipe_changed(self, user_id, recipe_id):
+        """
+        Bump the pantry version of a user and update the row of a recipe
+        in their loaded index once the change commits
+        """
+        bump_version(user_id)
+        transaction.on_commit(
+            lambda: self._update_recipe(user_id, recipe_id))
+
+    def _update_recipe(self, user_id, recipe_id):
+        with self._lock:
+            index = self._indexes.get(user_id)
+        if index is None:
+            return
+
+        ingredient_ids = list(Recipe.ingredients.through.objects.filter(
+            recipe_id=recipe_id).values_list('ingredient_id', flat=True))
+        stamp = current_version(user_id)
+        with self._lock:
+            # any other bump is a change the row update doesn't cover
+            if (self._indexes.get(user_id) is index and
+                    stamp == index.stamp + 1 and
+                    index.set_recipe(recipe_id, ingredient_ids)):
+                index.stamp = stamp
+            else:
+                self._indexes.pop(user_id, None)
+
+    def invalidate(self, user_id):
+        """Bump the pantry version of a user and drop their loaded index"""
+        bump_version(user_id)
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+cache = PantryIndexCache()
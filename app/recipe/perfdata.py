@@ -0,0 +1,89 @@
+"""
+Synthetic recipe libraries of perf users, for benchmarks and query
+budgets.
+"""
+import random
+from decimal import Decimal
+
+from django.db import transaction
+
+from core.models import Tag, Ingredient, Recipe
+from core.perfdata import create_perf_users, ids_by_user
+from recipe import counters, documents, similarity, stats
+
+
+@transaction.atomic
+def seed_perf_data(users=10, tags=20, ingredients=50, recipes=100,
+                   tags_per_recipe=3, ingredients_per_recipe=6, seed=0,
+                   prefix='perf', batch_size=1000):
+    """
+    Bulk create users owning the given number of tags, ingredients and
+    recipes each, linking every recipe to a random sample of its owner's
+    tags and ingredients. The same seed always produces the same data.
+    Return the created users.
+    """
+    rand = random.Random(seed)
+    user_objs = create_perf_users(users, prefix, batch_size)
+    user_ids = [user.id for user in user_objs]
+
+    Tag.objects.bulk_create(
+        [Tag(user_id=user_id, name=f'tag {index}')
+         for user_id in user_ids for index in range(tags)],
+        batch_size=batch_size
+    )
+    Ingredient.objects.bulk_create(
+        [Ingredient(user_id=user_id, name=f'ingredient {index}')
+         for user_id in user_ids for index in range(ingredients)],
+        batch_size=batch_size
+    )
+    Recipe.objects.bulk_create(
+        [
+            Recipe(
+                user_id=user_id,
+                title=f'recipe {index}',
+                time_minutes=rand.randint(5, 180),
+                price=Decimal(rand.randint(100, 99999)) / 100,
+                link=f'https://example.com/recipes/{index}',
+            )
+            for user_id in user_ids for index in range(recipes)
+        ],
+        batch_size=batch_size
+    )
+
+    tag_ids = ids_by_user(Tag, user_ids)
+    ingredient_ids = ids_by_user(Ingredient, user_ids)
+    recipe_ids = ids_by_user(Recipe, user_ids)
+
+    recipe_tags = []
+    recipe_ingredients = []
+    for user_id in user_ids:
+        for recipe_id in recipe_ids[user_id]:
+            recipe_tags.extend(
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+                for tag_id in rand.sample(
+                    tag_ids[user_id],
+                    min(tags_per_recipe, len(tag_ids[user_id])))
+            )
+            recipe_ingredients.extend(
+                Recipe.ingredients.through(recipe_id=recipe_id,
+                                           ingredient_id=ingredient_id)
+                for ingredient_id in rand.sample(
+                    ingredient_ids[user_id],
+                    min(ingredients_per_recipe,
+                        len(ingredient_ids[user_id])))
+            )
+    Recipe.tags.through.objects.bulk_create(recipe_tags,
+                                            batch_size=batch_size)
+    Recipe.ingredients.through.objects.bulk_create(recipe_ingredients,
+                                                   batch_size=batch_size)
+
+    # bulk_create doesn't send m2m_changed, count and index explicitly
+    for model in (Tag, Ingredient):
+        counters.reconcile(model, batch_size, user_id__in=user_ids)
+    for user_id in user_ids:
+        stats.recompute(user_id)
+        similarity.index_recipes(
+            [(recipe_id, user_id) for recipe_id in recipe_ids[user_id]])
+        documents.refresh(recipe_ids[user_id])
+
+    return user_objs
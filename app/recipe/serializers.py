@@ -1,9 +1,12 @@
+from django.core.exceptions import ValidationError
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 
+from core.instrumentation import TimedSerializerMixin
 from core.models import Tag, Ingredient, Recipe
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for tag objects"""
 
     class Meta:
@@ -12,7 +15,7 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for ingredient objects"""
 
     class Meta:
@@ -21,13 +24,70 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class AutocompleteSerializer(TimedSerializerMixin, serializers.Serializer):
+    """Serializer for tag and ingredient autocomplete matches"""
+    id = serializers.IntegerField(read_only=True)
+    name = serializers.CharField(read_only=True)
+    recipe_count = serializers.IntegerField(read_only=True)
+
+
+class MergeSerializer(serializers.Serializer):
+    """Serializer for the ids of tags or ingredients to merge into another"""
+    ids = serializers.ListField(child=serializers.IntegerField(),
+                                allow_empty=False, max_length=1000)
+
+
+class ShoppingListItemSerializer(AutocompleteSerializer):
+    """Serializer for an ingredient and how many listed recipes use it"""
+
+
+class ManyPrimaryKeysField(serializers.ManyRelatedField):
+    """Look up the objects of a list of primary keys in one query"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        child = self.child_relation
+        pk_field = child.get_queryset().model._meta.pk
+        pks = []
+        for item in data:
+            try:
+                if isinstance(item, bool):
+                    raise TypeError
+                pks.append(pk_field.to_python(item))
+            except (TypeError, ValueError, ValidationError):
+                child.fail('incorrect_type', data_type=type(item).__name__)
+        objects = child.get_queryset().in_bulk(pks)
+        for pk in pks:
+            if pk not in objects:
+                child.fail('does_not_exist', pk_value=pk)
+
+        return [objects[pk] for pk in pks]
+
+
+class PrimaryKeysRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key relation whose lists are looked up in one query"""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+
+        return ManyPrimaryKeysField(**list_kwargs)
+
+
+class RecipeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for Recipe object"""
-    ingredients = serializers.PrimaryKeyRelatedField(
+    ingredients = PrimaryKeysRelatedField(
         many=True,
         queryset=Ingredient.objects.all()
     )
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = PrimaryKeysRelatedField(
         many=True,
         queryset=Tag.objects.all()
     )
@@ -39,16 +99,55 @@ class RecipeSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class RecipeIncludeSerializer(RecipeSerializer):
+    """Serialize a recipe nesting the relations in the `include` context"""
+    nested_serializers = {
+        'tags': TagSerializer,
+        'ingredients': IngredientSerializer,
+    }
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for name in self.context.get('include', ()):
+            fields[name] = self.nested_serializers[name](
+                many=True, read_only=True)
+
+        return fields
+
+
 class RecipeDetailSerializer(RecipeSerializer):
     """Serialize a recipe detail"""
     ingredients = IngredientSerializer(many=True, read_only=True)
     tags = TagSerializer(many=True, read_only=True)
 
 
-class RecipeImageSerializer(serializers.ModelSerializer):
+class SimilarRecipeSerializer(RecipeSerializer):
+    """Serialize a recipe with its similarity to another recipe"""
+    similarity = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('similarity',)
+
+
+class PantryRecipeSerializer(RecipeSerializer):
+    """Serialize a recipe with how much of it a pantry covers"""
+    matched = serializers.IntegerField(read_only=True)
+    missing = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('matched', 'missing')
+
+
+class RecipeImageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for uploading images for recipes"""
 
     class Meta:
         model = Recipe
         fields = ('id', 'image')
         read_only_fields = ('id',)
+
+
+class RecipeBulkDeleteSerializer(serializers.Serializer):
+    """Serializer for the ids of recipes to delete"""
+    ids = serializers.ListField(child=serializers.IntegerField(),
+                                allow_empty=False, max_length=10000)
@@ -0,0 +1,289 @@
+import functools
+
+from django.db.models.signals import m2m_changed, post_init, post_save, \
+    pre_delete, post_delete
+from django.dispatch import receiver
+
+from core.events import broker
+from core.models import Tag, Ingredient, Recipe
+from recipe import autocomplete, counters, deletion, documents, pantry, \
+    similarity, stats
+
+
+def unless_purging(receiver_function):
+    """
+    Skip a receiver for the rows of a user being purged, their counts,
+    stats and caches go with the user
+    """
+    @functools.wraps(receiver_function)
+    def wrapper(sender, instance, **kwargs):
+        if not deletion.is_purging(instance.user_id):
+            receiver_function(sender, instance, **kwargs)
+
+    return wrapper
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def update_similarity_index(sender, instance, action, reverse, pk_set,
+                            **kwargs):
+    """Reindex the recipes whose tags or ingredients changed"""
+    # reverse clears are handled by reverse_clear
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        similarity.index_recipes([(instance.pk, instance.user_id)])
+    elif action != 'post_clear':
+        similarity.update_recipes(pk_set)
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def update_pantry_index(sender, instance, action, reverse, **kwargs):
+    """Keep the loaded pantry index of the recipe owner up to date"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if reverse:
+        pantry.cache.invalidate(instance.user_id)
+    else:
+        pantry.cache.recipe_changed(instance.user_id, instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Ingredient)
+@unless_purging
+def invalidate_pantry_index(sender, instance, **kwargs):
+    """Drop the pantry index of the owner of a deleted row"""
+    pantry.cache.invalidate(instance.user_id)
+
+
+def recipes_unlinked(recipe_ids):
+    """Reindex and render again the recipes which lost a tag or ingredient"""
+    if recipe_ids:
+        similarity.update_recipes(recipe_ids)
+        documents.stale(recipe_ids)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def reverse_clear(sender, instance, action, reverse, **kwargs):
+    """Update the recipes a tag or ingredient is cleared from"""
+    if not reverse:
+        return
+    if action == 'pre_clear':
+        # the cleared recipes are unknown once the rows are gone
+        instance._cleared_recipe_ids = list(
+            instance.recipe_set.values_list('id', flat=True))
+    elif action == 'post_clear':
+        recipe_ids = instance.__dict__.pop('_cleared_recipe_ids')
+        recipes_unlinked(recipe_ids)
+        for recipe_id in recipe_ids:
+            broker.publish_on_commit(instance.user_id, 'recipe', 'updated',
+                                     recipe_id)
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+@unless_purging
+def tag_or_ingredient_deleted(sender, instance, signal, **kwargs):
+    """Update the recipes which used a deleted tag or ingredient"""
+    if signal is pre_delete:
+        # the recipes are unknown once the links are gone
+        instance._deleted_recipe_ids = list(
+            instance.recipe_set.values_list('id', flat=True))
+    else:
+        recipes_unlinked(instance.__dict__.pop('_deleted_recipe_ids'))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+@unless_purging
+def invalidate_autocomplete(sender, instance, **kwargs):
+    """Drop the autocomplete index of the owner of a changed name"""
+    autocomplete.cache.invalidate(sender, instance.user_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def invalidate_autocomplete_counts(sender, instance, action, model,
+                                   **kwargs):
+    """Drop the autocomplete index whose recipe counts changed"""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        related = model if model in (Tag, Ingredient) else type(instance)
+        autocomplete.cache.invalidate(related, instance.user_id)
+
+
+@receiver(post_delete, sender=Recipe)
+@unless_purging
+def invalidate_recipe_autocomplete(sender, instance, **kwargs):
+    """Drop the autocomplete indexes counting a deleted recipe"""
+    autocomplete.cache.invalidate(Tag, instance.user_id)
+    autocomplete.cache.invalidate(Ingredient, instance.user_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def update_recipe_counts(sender, instance, action, reverse, model, pk_set,
+                         **kwargs):
+    """Keep the recipe counts of tags and ingredients exact"""
+    if reverse:
+        counted = type(instance)
+        if action == 'pre_remove':
+            instance._uncounted = counters.linked_count(counted, instance.pk,
+                                                        pk_set)
+        elif action == 'pre_clear':
+            instance._uncounted = counters.linked_count(counted, instance.pk)
+        elif action == 'post_add':
+            counters.change(counted, [instance.pk], len(pk_set))
+        elif action in ('post_remove', 'post_clear'):
+            counters.change(counted, [instance.pk], -instance._uncounted)
+        return
+
+    # remove sends every given id, only the linked ones are uncounted
+    if action == 'pre_remove':
+        instance._uncounted_ids = counters.linked_ids(model, instance.pk,
+                                                      pk_set)
+    elif action == 'pre_clear':
+        instance._uncounted_ids = counters.linked_ids(model, instance.pk)
+    elif action == 'post_add':
+        counters.change(model, pk_set, 1)
+    elif action in ('post_remove', 'post_clear'):
+        counters.change(model, instance._uncounted_ids, -1)
+
+
+@receiver(pre_delete, sender=Recipe)
+@unless_purging
+def uncount_deleted_recipe(sender, instance, **kwargs):
+    """Decrement the counts of the tags and ingredients of a recipe"""
+    # recipes pending deletion were uncounted when marked
+    if not instance.pending_deletion:
+        counters.recipe_deleted(instance)
+
+
+def stats_values(recipe):
+    """Return the (time_minutes, price) of a recipe, None if deferred"""
+    values = (recipe.__dict__.get('time_minutes'),
+              recipe.__dict__.get('price'))
+    return None if None in values else values
+
+
+@receiver(post_init, sender=Recipe)
+def remember_stats_values(sender, instance, **kwargs):
+    """Remember the values the stored stats count the recipe with"""
+    instance._stats_values = stats_values(instance) if instance.pk else None
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_stats(sender, instance, created, **kwargs):
+    """Move a saved recipe's values into its owner's stats"""
+    values = stats_values(instance)
+    removed = None if created else instance._stats_values
+    if values is None or values == removed:
+        return
+    stats.recipe_changed(instance.user_id, removed=removed, added=values)
+    instance._stats_values = values
+
+
+@receiver(post_delete, sender=Recipe)
+@unless_purging
+def remove_recipe_stats(sender, instance, **kwargs):
+    """Take a deleted recipe out of its owner's stats"""
+    if instance.pending_deletion:
+        return
+    values = instance._stats_values or stats_values(instance)
+    if values is not None:
+        stats.recipe_changed(instance.user_id, removed=values)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def count_created(sender, instance, created, **kwargs):
+    """Count a new tag or ingredient in its owner's stats"""
+    if created:
+        stats.count_changed(sender, instance.user_id, 1)
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+@unless_purging
+def uncount_deleted(sender, instance, **kwargs):
+    """Take a deleted tag or ingredient out of its owner's stats"""
+    stats.count_changed(sender, instance.user_id, -1)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def publish_saved(sender, instance, created, **kwargs):
+    """Stream a created or updated row to its owner"""
+    broker.publish_on_commit(instance.user_id, sender._meta.model_name,
+                             'created' if created else 'updated',
+                             instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+@unless_purging
+def publish_deleted(sender, instance, **kwargs):
+    """Stream a deleted row to its owner"""
+    # recipes pending deletion were streamed as deleted when marked
+    if not getattr(instance, 'pending_deletion', False):
+        broker.publish_on_commit(instance.user_id, sender._meta.model_name,
+                                 'deleted', instance.pk)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def publish_links_changed(sender, instance, action, reverse, pk_set,
+                          **kwargs):
+    """Stream the recipes whose tags or ingredients changed as updated"""
+    # reverse clears are streamed by reverse_clear
+    if action in ('post_add', 'post_remove'):
+        recipe_ids = pk_set if reverse else [instance.pk]
+    elif action == 'post_clear' and not reverse:
+        recipe_ids = [instance.pk]
+    else:
+        return
+    for recipe_id in recipe_ids:
+        broker.publish_on_commit(instance.user_id, 'recipe', 'updated',
+                                 recipe_id)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_document_saved(sender, instance, created, **kwargs):
+    """Render the stored JSON of a saved recipe again"""
+    documents.stale([instance.pk], exists=not created)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_document_links_changed(sender, instance, action, reverse, pk_set,
+                                  **kwargs):
+    """Render the stored JSON of the recipes whose links changed again"""
+    # reverse clears are rendered by reverse_clear
+    if action in ('post_add', 'post_remove'):
+        documents.stale(pk_set if reverse else [instance.pk])
+    elif action == 'post_clear' and not reverse:
+        documents.stale([instance.pk])
+
+
+@receiver(post_init, sender=Tag)
+@receiver(post_init, sender=Ingredient)
+def remember_name(sender, instance, **kwargs):
+    """Remember the name the stored recipe JSON shows"""
+    instance._document_name = instance.__dict__.get('name')
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def recipe_documents_renamed(sender, instance, created, **kwargs):
+    """Render the stored JSON of the recipes of a renamed row again"""
+    if not created and instance.name != instance._document_name:
+        documents.stale(instance.recipe_set.values_list('id', flat=True))
+    instance._document_name = instance.name
@@ -0,0 +1,172 @@
+"""
+MinHash signatures and an LSH band index over the tag and ingredient ids
+of recipes, used to find similar recipes without comparing every pair.
+"""
+import hashlib
+from collections import defaultdict
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Q, Value
+
+from core.models import Recipe, RecipeSignature, RecipeBand
+
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+# Mersenne prime, the hash family is (a * x + b) % PRIME
+PRIME = np.uint64((1 << 31) - 1)
+
+# a fixed seed keeps signatures comparable across processes and restarts
+_random = np.random.RandomState(1)
+_A = _random.randint(1, int(PRIME), NUM_PERM).astype(np.uint64)
+_B = _random.randint(0, int(PRIME), NUM_PERM).astype(np.uint64)
+
+
+def tokens(tag_ids, ingredient_ids):
+    """Map tag and ingredient ids into a single id space"""
+    return np.array(
+        [tag_id * 2 for tag_id in tag_ids] +
+        [ingredient_id * 2 + 1 for ingredient_id in ingredient_ids],
+        dtype=np.uint64
+    )
+
+
+def minhash(tag_ids, ingredient_ids):
+    """Return the MinHash signature of a recipe, None if it's empty"""
+    values = tokens(tag_ids, ingredient_ids)
+    if not values.size:
+        return None
+    hashes = (_A[:, None] * values[None, :] + _B[:, None]) % PRIME
+
+    return hashes.min(axis=1).astype(np.uint32)
+
+
+def band_buckets(signature):
+    """Return the LSH bucket of every band of a signature"""
+    return [
+        int.from_bytes(
+            hashlib.blake2b(row.tobytes(), digest_size=8).digest(),
+            'little',
+            signed=True
+        )
+        for row in signature.reshape(BANDS, ROWS)
+    ]
+
+
+def index_rows(recipe_id, user_id, signature):
+    """Return the unsaved signature and band rows of a recipe"""
+    return (
+        RecipeSignature(recipe_id=recipe_id, signature=signature.tobytes()),
+        [
+            RecipeBand(recipe_id=recipe_id, user_id=user_id, band=band,
+                       bucket=bucket)
+            for band, bucket in enumerate(band_buckets(signature))
+        ]
+    )
+
+
+def related_ids(recipe_ids):
+    """Return the tag and ingredient ids of every recipe"""
+    tag_links = Recipe.tags.through.objects.filter(
+        recipe_id__in=recipe_ids
+    ).annotate(kind=Value(0)).values_list('recipe_id', 'tag_id', 'kind')
+    ingredient_links = Recipe.ingredients.through.objects.filter(
+        recipe_id__in=recipe_ids
+    ).annotate(kind=Value(1)).values_list('recipe_id', 'ingredient_id',
+                                          'kind')
+
+    tag_ids = defaultdict(list)
+    ingredient_ids = defaultdict(list)
+    for recipe_id, related_id, kind in tag_links.union(ingredient_links,
+                                                       all=True):
+        if kind:
+            ingredient_ids[recipe_id].append(related_id)
+        else:
+            tag_ids[recipe_id].append(related_id)
+
+    return tag_ids, ingredient_ids
+
+
+def index_recipes(recipes):
+    """
+    Replace the signatures and bands of (id, user_id) recipe pairs,
+    recipes without tags and ingredients aren't indexed
+    """
+    recipe_ids = [recipe_id for recipe_id, _ in recipes]
+    tag_ids, ingredient_ids = related_ids(recipe_ids)
+
+    signatures, bands = [], []
+    for recipe_id, user_id in recipes:
+        signature = minhash(tag_ids[recipe_id], ingredient_ids[recipe_id])
+        if signature is not None:
+            signature_row, band_rows = index_rows(recipe_id, user_id,
+                                                  signature)
+            signatures.append(signature_row)
+            bands.extend(band_rows)
+
+    # m2m changes already run in a transaction, don't add a savepoint
+    with transaction.atomic(savepoint=False):
+        RecipeSignature.objects.filter(recipe_id__in=recipe_ids).delete()
+        RecipeBand.objects.filter(recipe_id__in=recipe_ids).delete()
+        if signatures:
+            RecipeSignature.objects.bulk_create(signatures)
+            RecipeBand.objects.bulk_create(bands)
+
+
+def update_recipes(recipe_ids):
+    """Reindex recipes by id, recipes pending deletion stay out"""
+    index_recipes(list(
+        Recipe.objects.filter(
+            id__in=recipe_ids, pending_deletion=False
+        ).values_list('id', 'user_id')
+    ))
+
+
+def remove_recipes(recipe_ids):
+    """Take recipes out of the index"""
+    RecipeSignature.objects.filter(recipe_id__in=recipe_ids).delete()
+    RecipeBand.objects.filter(recipe_id__in=recipe_ids).delete()
+
+
+def similar_recipes(recipe, limit=10, recipes=None):
+    """
+    Return up to `limit` (recipe id, estimated Jaccard similarity) pairs
+    of the recipes of the same user most similar to `recipe`, among the
+    `recipes` queryset if given
+    """
+    try:
+        signature = np.frombuffer(recipe.signature.signature,
+                                  dtype=np.uint32)
+    except RecipeSignature.DoesNotExist:
+        return []
+
+    same_bucket = Q()
+    for band, bucket in enumerate(band_buckets(signature)):
+        same_bucket |= Q(band=band, bucket=bucket)
+    candidates = RecipeBand.objects.filter(
+        same_bucket, user_id=recipe.user_id
+    ).exclude(recipe_id=recipe.id).values('recipe_id')
+    if recipes is not None:
+        # filtered before ranking, so hidden recipes don't take the places
+        # of visible ones
+        candidates = candidates.filter(
+            recipe_id__in=recipes.order_by().values('id'))
+
+    rows = list(RecipeSignature.objects.filter(
+        recipe_id__in=candidates
+    ).order_by('recipe_id').values_list('recipe_id', 'signature'))
+    if not rows:
+        return []
+
+    ids = np.array([recipe_id for recipe_id, _ in rows])
+    matrix = np.frombuffer(
+        b''.join(bytes(row_signature) for _, row_signature in rows),
+        dtype=np.uint32
+    ).reshape(len(rows), NUM_PERM)
+    scores = (matrix == signature).mean(axis=1)
+    # stable sort keeps equally similar recipes in id order
+    order = np.argsort(-scores, kind='stable')[:limit]
+
+    return [(int(ids[index]), float(scores[index])) for index in order]
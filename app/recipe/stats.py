@@ -0,0 +1,164 @@
+"""
+Per user library statistics kept in a summary row.
+
+Recipe, tag and ingredient writes adjust the LibraryStats row of their
+owner, so the stats endpoint never aggregates over the recipes. Time and
+price distributions are fixed bucket histograms, adding or removing a
+recipe is one bucket increment and histograms of any set of recipes can
+be merged by adding them.
+
+Rows are created by `recompute`, which counts everything exactly. Writes
+of users without a row are skipped, the stats endpoint computes the row
+on first use and `manage.py recompute_library_stats` fixes any drift.
+"""
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+from django.db.models import F
+
+from core.models import Tag, Ingredient, Recipe, LibraryStats
+
+
+# one bucket per minute, the last one holds every longer recipe
+TIME_BUCKETS = 601
+PRICE_BUCKET_WIDTH = Decimal('5.00')
+# the last bucket holds every more expensive recipe
+PRICE_BUCKETS = 21
+PERCENTILES = (50, 90, 99)
+TOP_COUNT = 5
+
+
+def time_bucket(minutes):
+    return min(max(int(minutes), 0), TIME_BUCKETS - 1)
+
+
+def price_bucket(price):
+    return min(max(int(Decimal(str(price)) // PRICE_BUCKET_WIDTH), 0),
+               PRICE_BUCKETS - 1)
+
+
+def load_histogram(blob, size):
+    """Return a stored histogram, empty rows have no bytes"""
+    if not blob:
+        return np.zeros(size, dtype=np.int64)
+    return np.frombuffer(bytes(blob), dtype=np.int64).copy()
+
+
+def histogram_percentile(histogram, percentile):
+    """Return the bucket holding a percentile, None if it's empty"""
+    total = histogram.sum()
+    if not total:
+        return None
+    rank = max(int(np.ceil(total * percentile / 100)), 1)
+    return int(np.searchsorted(np.cumsum(histogram), rank))
+
+
+def recipe_changed(user_id, removed=None, added=None):
+    """
+    Move a recipe's (time_minutes, price) out of and into the stats of its
+    owner, either side is None for creates and deletes
+    """
+    recipes_changed(user_id,
+                    removed=[] if removed is None else [removed],
+                    added=[] if added is None else [added])
+
+
+def recipes_changed(user_id, removed=(), added=()):
+    """
+    Move the (time_minutes, price) of many recipes out of and into the
+    stats of their owner in one write
+    """
+    # the row lock serializes the histogram read-modify-write
+    with transaction.atomic(savepoint=False):
+        stats = LibraryStats.objects.select_for_update().filter(
+            user_id=user_id).first()
+        if stats is None:
+            return
+
+        times = load_histogram(stats.time_histogram, TIME_BUCKETS)
+        prices = load_histogram(stats.price_histogram, PRICE_BUCKETS)
+        for recipes, sign in ((removed, -1), (added, 1)):
+            for minutes, price in recipes:
+                stats.recipe_count += sign
+                stats.time_minutes_sum += sign * int(minutes)
+                stats.price_sum += sign * Decimal(str(price))
+                times[time_bucket(minutes)] += sign
+                prices[price_bucket(price)] += sign
+        stats.time_histogram = times.tobytes()
+        stats.price_histogram = prices.tobytes()
+        stats.save(update_fields=['recipe_count', 'time_minutes_sum',
+                                  'price_sum', 'time_histogram',
+                                  'price_histogram'])
+
+
+def count_changed(model, user_id, delta):
+    """Add `delta` to the tag or ingredient count of a user"""
+    field = 'tag_count' if model is Tag else 'ingredient_count'
+    LibraryStats.objects.filter(user_id=user_id).update(
+        **{field: F(field) + delta})
+
+
+def recompute(user_id):
+    """Count the stats of a user exactly, return the saved row"""
+    values = list(Recipe.objects.filter(
+        user_id=user_id, pending_deletion=False
+    ).values_list('time_minutes', 'price'))
+    times = np.bincount([time_bucket(minutes) for minutes, _ in values],
+                        minlength=TIME_BUCKETS).astype(np.int64)
+    prices = np.bincount([price_bucket(price) for _, price in values],
+                         minlength=PRICE_BUCKETS).astype(np.int64)
+
+    defaults = {
+        'recipe_count': len(values),
+        'tag_count': Tag.objects.filter(user_id=user_id).count(),
+        'ingredient_count': Ingredient.objects.filter(
+            user_id=user_id).count(),
+        'time_minutes_sum': sum(minutes for minutes, _ in values),
+        'price_sum': sum((price for _, price in values), Decimal('0.00')),
+        'time_histogram': times.tobytes(),
+        'price_histogram': prices.tobytes(),
+    }
+    stats, _ = LibraryStats.objects.update_or_create(user_id=user_id,
+                                                     defaults=defaults)
+
+    return stats
+
+
+def top(model, user_id):
+    """Return the most used tags or ingredients of a user"""
+    return list(model.objects.filter(
+        user_id=user_id, recipe_count__gt=0
+    ).order_by('-recipe_count', '-id').values(
+        'id', 'name', 'recipe_count')[:TOP_COUNT])
+
+
+def summary(user_id):
+    """Return the stats of a user, computing them on first use"""
+    stats = LibraryStats.objects.filter(user_id=user_id).first()
+    if stats is None:
+        stats = recompute(user_id)
+
+    times = load_histogram(stats.time_histogram, TIME_BUCKETS)
+    prices = load_histogram(stats.price_histogram, PRICE_BUCKETS)
+    count = stats.recipe_count
+    time_minutes = {'average': stats.time_minutes_sum / count
+                    if count else None}
+    for percentile in PERCENTILES:
+        time_minutes[f'p{percentile}'] = histogram_percentile(times,
+                                                              percentile)
+
+    return {
+        'recipe_count': count,
+        'tag_count': stats.tag_count,
+        'ingredient_count': stats.ingredient_count,
+        'time_minutes': time_minutes,
+        'price': {
+            'average': str((stats.price_sum / count).quantize(
+                Decimal('0.01'))) if count else None,
+            'bucket_width': str(PRICE_BUCKET_WIDTH),
+            'histogram': prices.tolist(),
+        },
+        'top_tags': top(Tag, user_id),
+        'top_ingredients': top(Ingredient, user_id),
+    }
@@ -0,0 +1,23 @@
+from core import jobs
+from recipe import deletion, documents
+
+
+@jobs.task(priority=-1, max_attempts=5, timeout=3600)
+def purge_recipes(user_id):
+    """Delete the recipes of a user pending deletion"""
+    return {'deleted': deletion.purge_recipes(
+        user_id, progress=jobs.report_progress)}
+
+
+@jobs.task(priority=-1, max_attempts=5, timeout=3600)
+def purge_user(user_id):
+    """Delete a user pending deletion and their library"""
+    return {'deleted': deletion.purge_user(
+        user_id, progress=jobs.report_progress)}
+
+
+@jobs.task(priority=-1)
+def refresh_documents(recipe_ids):
+    """Render the stored JSON of recipes changed in bulk"""
+    documents.refresh(recipe_ids)
+    return {'refreshed': len(recipe_ids)}
@@ -0,0 +1,178 @@
+import unittest
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Tag, Ingredient, Recipe
+from recipe import autocomplete
+
+
+TAGS_AUTOCOMPLETE_URL = reverse('recipe:tag-autocomplete')
+INGREDIENTS_AUTOCOMPLETE_URL = reverse('recipe:ingredient-autocomplete')
+
+
+def sample_recipe(user, tags=(), ingredients=()):
+    recipe = Recipe.objects.create(user=user, title='sample recipe',
+                                   time_minutes=5, price=5.00)
+    recipe.tags.add(*tags)
+    recipe.ingredients.add(*ingredients)
+    return recipe
+
+
+def names(response):
+    return [match['name'] for match in response.data]
+
+
+class AutocompleteIndexTests(TestCase):
+    """Test the in-memory autocomplete index"""
+
+    def setUp(self):
+        rows = [(1, 'Olive oil', 2), (2, 'Onion', 5), (3, 'oregano', 0),
+                (4, 'Red onion', 1), (5, 'Sesame oil', 9), (6, 'Oats', 0)]
+        self.index = autocomplete.AutocompleteIndex(rows)
+
+    def test_prefix_ranked_by_usage(self):
+        """Test prefix matches come most used first, then by name"""
+        self.assertEqual(
+            [pk for pk, _, _ in self.index.search('o', limit=4)],
+            [2, 1, 6, 3]
+        )
+
+    def test_word_matches_follow_prefix_matches(self):
+        """Test names with a later word matching come after the prefix"""
+        self.assertEqual(
+            [name for _, name, _ in self.index.search('oni')],
+            ['Onion', 'Red onion']
+        )
+        self.assertEqual(
+            [name for _, name, _ in self.index.search(' OIL ')],
+            ['Sesame oil', 'Olive oil']
+        )
+
+    def test_top_k_ties_by_name(self):
+        """Test equally used names at the cut are picked by name"""
+        index = autocomplete.AutocompleteIndex(
+            [(pk, f'tag {pk:02}', 1) for pk in range(20, 0, -1)])
+
+        self.assertEqual([pk for pk, _, _ in index.search('tag', limit=3)],
+                         [1, 2, 3])
+
+    def test_fuzzy_matches_follow(self):
+        """Test names a typo away come after the prefix and word matches"""
+        index = autocomplete.AutocompleteIndex(
+            [(1, 'Chicken breast', 3), (2, 'Chickpeas', 1), (3, 'Tomato', 2),
+             (4, 'Cherry tomatoes', 0), (5, 'Chili', 4)])
+
+        self.assertEqual([name for _, name, _ in index.search('chiken')],
+                         ['Chicken breast'])
+        self.assertEqual([name for _, name, _ in index.search('tomatoe')],
+                         ['Cherry tomatoes', 'Tomato'])
+        self.assertEqual([name for _, name, _ in index.search('chi')],
+                         ['Chili', 'Chicken breast', 'Chickpeas'])
+        self.assertEqual(index.search('xyz'), [])
+
+    def test_prefix_distance(self):
+        """Test typos are counted against the closest start of a word"""
+        self.assertEqual(autocomplete.prefix_distance('chiken', 'chicken'), 1)
+        self.assertEqual(autocomplete.prefix_distance('tomatoe', 'tomato'), 1)
+        self.assertEqual(autocomplete.prefix_distance('oil', 'onion'), 2)
+
+    @unittest.skipUnless(connection.vendor == 'postgresql',
+                         'trigram matching needs Postgres')
+    def test_database_fuzzy_search(self):
+        """Test the SQL search falls back to trigram word similarity"""
+        user = get_user_model().objects.create_user('test@email.com',
+                                                    'testpassword')
+        chicken = Ingredient.objects.create(user=user, name='Chicken breast')
+        tomato = Ingredient.objects.create(user=user, name='Tomato')
+        Ingredient.objects.create(user=user, name='Rice')
+
+        self.assertEqual(
+            [pk for pk, _, _ in autocomplete.database_search(
+                Ingredient, user.id, 'chiken')], [chicken.id])
+        self.assertEqual(
+            [pk for pk, _, _ in autocomplete.database_search(
+                Ingredient, user.id, 'tomatoe')], [tomato.id])
+
+    def test_database_search_matches_index(self):
+        """Test the SQL search ranks like the in-memory index"""
+        user = get_user_model().objects.create_user('test@email.com',
+                                                    'testpassword')
+        onion = Ingredient.objects.create(user=user, name='Onion')
+        red_onion = Ingredient.objects.create(user=user, name='Red onion')
+        Ingredient.objects.create(user=user, name='Oats')
+        sample_recipe(user, ingredients=[red_onion])
+
+        expected = autocomplete.AutocompleteIndex.build(
+            Ingredient, user.id).search('oni')
+        matches = autocomplete.database_search(Ingredient, user.id, 'oni')
+
+        self.assertEqual(matches, expected)
+        self.assertEqual([pk for pk, _, _ in matches],
+                         [onion.id, red_onion.id])
+
+
+class AutocompleteApiTests(TestCase):
+    """Test the tag and ingredient autocomplete endpoints"""
+
+    def setUp(self):
+        autocomplete.cache.clear()
+        self.user = get_user_model().objects.create_user('test@email.com',
+                                                         'testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_login_required(self):
+        """Test that login is required for autocomplete"""
+        response = APIClient().get(TAGS_AUTOCOMPLETE_URL, {'q': 'v'})
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_autocomplete_tags(self):
+        """Test matching tags are returned with their recipe counts"""
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        vegetarian = Tag.objects.create(user=self.user, name='Vegetarian')
+        Tag.objects.create(user=self.user, name='Dessert')
+        other_user = get_user_model().objects.create_user('other@email.com',
+                                                          'testpassword')
+        Tag.objects.create(user=other_user, name='Vegetables')
+        sample_recipe(self.user, tags=[vegetarian])
+
+        response = self.client.get(TAGS_AUTOCOMPLETE_URL, {'q': 'veg'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [
+            {'id': vegetarian.id, 'name': 'Vegetarian', 'recipe_count': 1},
+            {'id': vegan.id, 'name': 'Vegan', 'recipe_count': 0},
+        ])
+
+    def test_autocomplete_limit(self):
+        """Test only `limit` matches are returned"""
+        for name in ('salt', 'saffron', 'sage'):
+            Ingredient.objects.create(user=self.user, name=name)
+
+        response = self.client.get(INGREDIENTS_AUTOCOMPLETE_URL,
+                                   {'q': 'sa', 'limit': 2})
+
+        self.assertEqual(names(response), ['saffron', 'sage'])
+
+    def test_index_follows_changes(self):
+        """Test created, renamed and newly used names show up"""
+        salt = Ingredient.objects.create(user=self.user, name='salt')
+        self.client.get(INGREDIENTS_AUTOCOMPLETE_URL, {'q': 's'})
+
+        sage = Ingredient.objects.create(user=self.user, name='sage')
+        sample_recipe(self.user, ingredients=[sage])
+        salt.name = 'sea salt'
+        salt.save()
+        response = self.client.get(INGREDIENTS_AUTOCOMPLETE_URL, {'q': 's'})
+
+        self.assertEqual(response.data, [
+            {'id': sage.id, 'name': 'sage', 'recipe_count': 1},
+            {'id': salt.id, 'name': 'sea salt', 'recipe_count': 0},
+        ])
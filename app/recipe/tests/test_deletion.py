@@ -0,0 +1,286 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import jobs
+from core.models import Tag, Ingredient, Recipe, Job, RecipeSignature
+from recipe import deletion, stats
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+BULK_DELETE_URL = reverse('recipe:recipe-bulk-delete')
+ME_URL = reverse('user:me')
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def sample_recipe(user, **params):
+    defaults = {'title': 'sample recipe', 'time_minutes': 5, 'price': 5.00}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class RecipeDeletionTests(TestCase):
+    """Test recipes are hidden at once and purged in the background"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@email.com',
+                                                         'testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_login_required(self):
+        """Test that login is required to delete recipes"""
+        response = APIClient().post(BULK_DELETE_URL, {'ids': [1]})
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_bulk_delete_hides_recipes(self):
+        """Test deleted recipes disappear before they are purged"""
+        deleted = sample_recipe(self.user)
+        kept = sample_recipe(self.user)
+        other_user = get_user_model().objects.create_user('other@email.com',
+                                                          'testpassword')
+        other = sample_recipe(other_user)
+
+        response = self.client.post(
+            BULK_DELETE_URL, {'ids': [deleted.id, other.id]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], Job.QUEUED)
+        self.assertEqual(response['Location'],
+                         reverse('core:job-detail',
+                                 args=[response.data['id']]))
+        response = self.client.get(RECIPES_URL)
+        self.assertEqual([recipe['id'] for recipe in response.data],
+                         [kept.id])
+        response = self.client.get(detail_url(deleted.id))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(Recipe.objects.get(id=other.id).pending_deletion)
+
+    def test_invalid_ids(self):
+        """Test a missing or malformed id list is rejected"""
+        for payload in ({}, {'ids': []}, {'ids': ['a']}):
+            response = self.client.post(BULK_DELETE_URL, payload,
+                                        format='json')
+
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+            self.assertIn('ids', response.data)
+
+    def test_hidden_from_shopping_list_and_pantry(self):
+        """Test recipes pending deletion aren't matched anymore"""
+        salt = Ingredient.objects.create(user=self.user, name='salt')
+        recipe = sample_recipe(self.user)
+        recipe.ingredients.add(salt)
+        self.client.get(reverse('recipe:recipe-pantry'),
+                        {'have': str(salt.id)})
+
+        deletion.mark_recipes(self.user, [recipe.id])
+
+        response = self.client.get(reverse('recipe:recipe-shopping-list'),
+                                   {'recipes': str(recipe.id)})
+        self.assertEqual(response.data, [])
+        response = self.client.get(reverse('recipe:recipe-pantry'),
+                                   {'have': str(salt.id)})
+        self.assertEqual(response.data, [])
+
+    def test_uncounted_when_marked(self):
+        """Test hidden recipes leave the counts, stats and index at once"""
+        vegan = Tag.objects.create(user=self.user, name='vegan')
+        spicy = Tag.objects.create(user=self.user, name='spicy')
+        deleted = sample_recipe(self.user, time_minutes=30, price=20.00)
+        deleted.tags.add(vegan, spicy)
+        kept = sample_recipe(self.user)
+        kept.tags.add(vegan)
+        stats.recompute(self.user.id)
+
+        self.client.post(BULK_DELETE_URL, {'ids': [deleted.id]},
+                         format='json')
+
+        response = self.client.get(reverse('recipe:tag-list'),
+                                   {'assigned_only': 1})
+        self.assertEqual([tag['name'] for tag in response.data], ['vegan'])
+        summary = self.client.get(reverse('recipe:stats')).data
+        self.assertEqual(summary['recipe_count'], 1)
+        self.assertEqual(summary['time_minutes']['average'], 5)
+        self.assertEqual(summary['price']['average'], '5.00')
+        self.assertEqual(summary['top_tags'], [
+            {'id': vegan.id, 'name': 'vegan', 'recipe_count': 1}])
+        self.assertFalse(RecipeSignature.objects.filter(
+            recipe=deleted).exists())
+
+        jobs.work(burst=True)
+
+        vegan.refresh_from_db()
+        spicy.refresh_from_db()
+        self.assertEqual((vegan.recipe_count, spicy.recipe_count), (1, 0))
+        self.assertEqual(self.client.get(
+            reverse('recipe:stats')).data['recipe_count'], 1)
+
+    @override_settings(DELETION_BATCH_SIZE=2)
+    def test_purge_in_batches(self):
+        """Test the job deletes the recipes batch by batch"""
+        vegan = Tag.objects.create(user=self.user, name='vegan')
+        recipes = [sample_recipe(self.user) for _ in range(5)]
+        for recipe in recipes:
+            recipe.tags.add(vegan)
+        kept = sample_recipe(self.user)
+        kept.tags.add(vegan)
+        self.client.post(BULK_DELETE_URL,
+                         {'ids': [recipe.id for recipe in recipes]},
+                         format='json')
+        progress = []
+
+        with patch.object(jobs, 'report_progress',
+                          side_effect=lambda **kwargs: progress.append(
+                              kwargs)):
+            jobs.work(burst=True)
+
+        self.assertEqual(list(Recipe.objects.all()), [kept])
+        vegan.refresh_from_db()
+        self.assertEqual(vegan.recipe_count, 1)
+        self.assertEqual([report['deleted'] for report in progress],
+                         [0, 2, 4, 5])
+        job = Job.objects.get(user=self.user)
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(json.loads(job.result), {'deleted': 5})
+
+    def test_images_removed_after_commit(self):
+        """Test the image files of purged recipes are removed"""
+        with tempfile.TemporaryDirectory() as media_root, \
+                self.settings(MEDIA_ROOT=media_root):
+            recipe = sample_recipe(self.user)
+            recipe.image.save('photo.jpg', ContentFile(b'jpeg'))
+            path = recipe.image.path
+            deletion.mark_recipes(self.user, [recipe.id])
+
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                deletion.purge_recipes(self.user.id)
+                self.assertTrue(os.path.exists(path))
+
+            self.assertEqual(len(callbacks), 1)
+            self.assertFalse(os.path.exists(path))
+
+    @patch('recipe.deletion.time.sleep')
+    def test_rate_limit(self, sleep):
+        """Test the purge waits to stay under the rows per second cap"""
+        for _ in range(3):
+            sample_recipe(self.user, pending_deletion=True)
+
+        deletion.purge_recipes(self.user.id, batch_size=1,
+                               max_rows_per_second=1)
+
+        self.assertEqual(sleep.call_count, 3)
+        self.assertGreater(sum(call[0][0] for call in sleep.call_args_list),
+                           2)
+
+
+class UserDeletionTests(TestCase):
+    """Test deleting a user's account"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@email.com',
+                                                         'testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_delete_deactivates_at_once(self):
+        """Test a deleted user can't use the API anymore"""
+        sample_recipe(self.user)
+
+        response = self.client.delete(ME_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertTrue(self.user.pending_deletion)
+        response = self.client.get(RECIPES_URL)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_purge_user(self):
+        """Test the job deletes the user and their whole library"""
+        other_user = get_user_model().objects.create_user('other@email.com',
+                                                          'testpassword')
+        other_recipe = sample_recipe(other_user)
+        vegan = Tag.objects.create(user=self.user, name='vegan')
+        salt = Ingredient.objects.create(user=self.user, name='salt')
+        for _ in range(3):
+            recipe = sample_recipe(self.user)
+            recipe.tags.add(vegan)
+            recipe.ingredients.add(salt)
+        self.client.delete(ME_URL)
+
+        with self.settings(DELETION_BATCH_SIZE=2):
+            jobs.work(burst=True)
+
+        self.assertFalse(get_user_model().objects.filter(
+            id=self.user.id).exists())
+        self.assertEqual(list(Recipe.objects.all()), [other_recipe])
+        self.assertFalse(Tag.objects.exists())
+        self.assertFalse(Ingredient.objects.exists())
+        self.assertFalse(Recipe.tags.through.objects.exists())
+        job = Job.objects.get(task='recipe.tasks.purge_user')
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(json.loads(job.progress),
+                         {'deleted': 5, 'total': 5})
+
+    def purge_queries(self, user, size):
+        """Return the queries purging a user with `size` of everything"""
+        tags = [Tag.objects.create(user=user, name=f'tag {index}')
+                for index in range(size)]
+        ingredients = [
+            Ingredient.objects.create(user=user, name=f'ingredient {index}')
+            for index in range(size)
+        ]
+        for _ in range(size):
+            recipe = sample_recipe(user)
+            recipe.tags.add(*tags)
+            recipe.ingredients.add(*ingredients)
+        deletion.mark_user(user)
+
+        with CaptureQueriesContext(connection) as queries:
+            deletion.purge_user(user.id, batch_size=100)
+
+        return len(queries)
+
+    def test_purge_queries_per_batch(self):
+        """Test purging doesn't cost queries per deleted row"""
+        other_user = get_user_model().objects.create_user('other@email.com',
+                                                          'testpassword')
+
+        self.assertEqual(self.purge_queries(self.user, 2),
+                         self.purge_queries(other_user, 6))
+
+    def test_purge_command(self):
+        """Test the command purges whatever the jobs left behind"""
+        sample_recipe(self.user)
+        deletion.mark_user(self.user)
+        other_user = get_user_model().objects.create_user('other@email.com',
+                                                          'testpassword')
+        recipe = sample_recipe(other_user)
+        deletion.mark_recipes(other_user, [recipe.id])
+        out = StringIO()
+
+        call_command('purge_deleted', stdout=out)
+
+        self.assertFalse(Recipe.objects.exists())
+        self.assertEqual(list(get_user_model().objects.all()), [other_user])
+        self.assertIn('Purged 1 users and 1 recipes', out.getvalue())
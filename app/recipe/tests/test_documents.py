@@ -0,0 +1,198 @@
+from io import StringIO
+from unittest.mock import patch
+
+import msgpack
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Job, Tag, Ingredient, Recipe, RecipeDocument
+from recipe import documents, tasks
+from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def sample_recipe(user, title='sample recipe', **params):
+    return Recipe.objects.create(user=user, title=title, time_minutes=5,
+                                 price='5.00', **params)
+
+
+class RecipeDocumentTests(TestCase):
+    """Test the recipe JSON rendered ahead of time"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@email.com',
+                                                         'testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.tag = Tag.objects.create(user=self.user, name='vegan')
+        self.ingredient = Ingredient.objects.create(user=self.user,
+                                                    name='tofu')
+
+    def create_recipe(self, title='sample recipe'):
+        """Create a linked recipe and commit its document"""
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = sample_recipe(self.user, title=title)
+            recipe.tags.add(self.tag)
+            recipe.ingredients.add(self.ingredient)
+
+        return recipe
+
+    def test_detail_served_from_document(self):
+        """Test the detail is the stored document, read in one query"""
+        recipe = self.create_recipe()
+
+        with self.assertNumQueries(1):
+            response = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content.decode(),
+                         RecipeDocument.objects.get(recipe=recipe).detail)
+        self.assertEqual(response.data, RecipeDetailSerializer(recipe).data)
+
+    def test_list_served_from_documents(self):
+        """Test the list concatenates the stored list items in order"""
+        recipes = [self.create_recipe(title) for title in ('b', 'c', 'a')]
+
+        with self.assertNumQueries(1):
+            response = self.client.get(RECIPES_URL,
+                                       {'ordering': 'title', 'limit': 2})
+
+        self.assertEqual(response.data, RecipeSerializer(
+            [recipes[2], recipes[0]], many=True).data)
+
+    def test_missing_document_rendered_on_read(self):
+        """Test a recipe without a document is rendered and stored"""
+        recipe = sample_recipe(self.user)
+        recipe.tags.add(self.tag)
+
+        list_response = self.client.get(RECIPES_URL)
+        detail_response = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(list_response.data,
+                         [RecipeSerializer(recipe).data])
+        self.assertEqual(detail_response.data,
+                         RecipeDetailSerializer(recipe).data)
+        self.assertTrue(RecipeDocument.objects.filter(recipe=recipe).exists())
+
+    def test_other_formats(self):
+        """Test the document is decoded for the other renderers"""
+        recipe = self.create_recipe()
+
+        response = self.client.get(detail_url(recipe.id),
+                                   HTTP_ACCEPT='application/msgpack')
+        indented = self.client.get(detail_url(recipe.id),
+                                   HTTP_ACCEPT='application/json; indent=2')
+
+        self.assertEqual(msgpack.unpackb(response.content, raw=False)['id'],
+                         recipe.id)
+        self.assertIn(b'\n  "id"', indented.content)
+
+    def test_detail_not_found(self):
+        """Test other users' and pending recipes aren't served"""
+        other_user = get_user_model().objects.create_user('other@email.com',
+                                                          'testpassword')
+        other_recipe = sample_recipe(other_user)
+        pending_recipe = sample_recipe(self.user, pending_deletion=True)
+
+        for recipe in (other_recipe, pending_recipe):
+            response = self.client.get(detail_url(recipe.id))
+
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_changes_render_documents_again(self):
+        """Test saves, link changes and renames update the documents"""
+        recipe = self.create_recipe()
+        other_tag = Tag.objects.create(user=self.user, name='quick')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.title = 'renamed'
+            recipe.save()
+            # stale documents are gone before the commit
+            self.assertFalse(RecipeDocument.objects.exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            other_tag.recipe_set.add(recipe)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ingredient.name = 'tempeh'
+            self.ingredient.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.delete()
+
+        detail = RecipeDetailSerializer(Recipe.objects.get(id=recipe.id)).data
+        self.assertEqual(detail['title'], 'renamed')
+        self.assertEqual([tag['name'] for tag in detail['tags']], ['quick'])
+        self.assertEqual(detail['ingredients'][0]['name'], 'tempeh')
+        self.assertEqual(self.client.get(detail_url(recipe.id)).data, detail)
+        self.assertEqual(call_command('check_recipe_documents',
+                                      stdout=StringIO()), None)
+
+    def test_rendered_once_per_transaction(self):
+        """Test every write of a transaction shares one render"""
+        with patch('recipe.documents.refresh') as refresh, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(RECIPES_URL, {
+                'title': 'Omelette', 'time_minutes': 5, 'price': '3.00',
+                'tags': [self.tag.id], 'ingredients': [self.ingredient.id],
+            })
+
+        refresh.assert_called_once_with({response.data['id']})
+
+    def test_rendered_after_rolled_back_savepoint(self):
+        """Test a write after a rolled back savepoint is still rendered"""
+        recipe = self.create_recipe()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    documents.stale([recipe.id])
+                    raise ValueError
+            except ValueError:
+                pass
+            recipe.title = 'renamed'
+            recipe.save()
+
+        self.assertIn('renamed', RecipeDocument.objects.get(
+            recipe=recipe).detail)
+
+    @override_settings(RECIPE_DOCUMENTS_SYNC_LIMIT=1)
+    def test_large_changes_rendered_in_background(self):
+        """Test renders over the limit are left to a job"""
+        recipes = [self.create_recipe(), self.create_recipe()]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.name = 'plant based'
+            self.tag.save()
+
+        self.assertFalse(RecipeDocument.objects.exists())
+        job = Job.objects.get(task='recipe.tasks.refresh_documents')
+        tasks.refresh_documents(recipe_ids=[recipe.id for recipe in recipes])
+        self.assertEqual(RecipeDocument.objects.count(), 2)
+        self.assertIn(str(recipes[0].id), job.payload)
+
+    def test_check_command(self):
+        """Test the checker reports and fixes stale documents"""
+        recipe = self.create_recipe()
+        sample_recipe(self.user)
+        RecipeDocument.objects.filter(recipe=recipe).update(detail='{}')
+
+        with self.assertRaisesMessage(
+                CommandError, 'Checked 2 recipes, 1 missing and 1 stale'):
+            call_command('check_recipe_documents', stdout=StringIO())
+        out = StringIO()
+        call_command('check_recipe_documents', '--fix', stdout=out)
+
+        self.assertIn('fixed', out.getvalue())
+        self.assertEqual(documents.check(), (2, 0, 0))
@@ -0,0 +1,162 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Tag, Ingredient, Recipe, LibraryStats, \
+    RecipeDocument, RecipeSignature
+from recipe import similarity, stats
+from recipe.serializers import RecipeDetailSerializer
+
+
+def merge_url(basename, pk):
+    return reverse(f'recipe:{basename}-merge', args=[pk])
+
+
+def rename_url(basename, pk):
+    return reverse(f'recipe:{basename}-rename', args=[pk])
+
+
+def sample_recipe(user, title='sample recipe'):
+    return Recipe.objects.create(user=user, title=title, time_minutes=5,
+                                 price='5.00')
+
+
+class MergeApiTests(TestCase):
+    """Test merging and renaming tags and ingredients"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@email.com',
+                                                         'testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.tomato = Ingredient.objects.create(user=self.user,
+                                                name='tomato')
+        self.tomatoes = Ingredient.objects.create(user=self.user,
+                                                  name='tomatoes')
+        self.tomatos = Ingredient.objects.create(user=self.user,
+                                                 name='tomatos')
+        self.salad = sample_recipe(self.user, 'salad')
+        self.sauce = sample_recipe(self.user, 'sauce')
+        self.soup = sample_recipe(self.user, 'soup')
+        self.salad.ingredients.add(self.tomato, self.tomatoes)
+        self.sauce.ingredients.add(self.tomatoes, self.tomatos)
+        self.soup.ingredients.add(self.tomatos)
+
+    def merge(self, target, *sources, basename='ingredient'):
+        return self.client.post(merge_url(basename, target.id),
+                                {'ids': [source.id for source in sources]},
+                                format='json')
+
+    def test_merge_ingredients(self):
+        """Test the recipes of the merged ingredients use the kept one"""
+        stats.recompute(self.user.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.merge(self.tomato, self.tomatoes, self.tomatos)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'id': self.tomato.id,
+                                         'name': 'tomato'})
+        self.assertEqual(list(Ingredient.objects.values_list('name',
+                                                             'recipe_count')),
+                         [('tomato', 3)])
+        links = Recipe.ingredients.through.objects.values_list(
+            'recipe_id', 'ingredient_id')
+        self.assertCountEqual(links, [(self.salad.id, self.tomato.id),
+                                      (self.sauce.id, self.tomato.id),
+                                      (self.soup.id, self.tomato.id)])
+        self.assertEqual(LibraryStats.objects.get().ingredient_count, 1)
+
+    def test_merge_updates_derived_data(self):
+        """Test the recipe JSON and similarity index follow a merge"""
+        self.merge(self.tomato, self.tomatoes)
+
+        self.assertFalse(RecipeDocument.objects.filter(
+            recipe__in=[self.salad, self.sauce]).exists())
+        response = self.client.get(
+            reverse('recipe:recipe-detail', args=[self.sauce.id]))
+        self.assertEqual(response.data, RecipeDetailSerializer(
+            Recipe.objects.get(id=self.sauce.id)).data)
+        self.assertEqual(
+            [ingredient['name'] for ingredient in
+             response.data['ingredients']],
+            ['tomato', 'tomatos'])
+        tag_ids, ingredient_ids = similarity.related_ids([self.sauce.id])
+        signature = RecipeSignature.objects.get(recipe=self.sauce)
+        self.assertEqual(
+            bytes(signature.signature),
+            similarity.minhash(tag_ids[self.sauce.id],
+                               ingredient_ids[self.sauce.id]).tobytes())
+
+    def test_merge_cost_independent_of_library(self):
+        """Test a merge runs the same queries whatever the library size"""
+        for index in range(20):
+            sample_recipe(self.user, f'other {index}').ingredients.add(
+                self.tomato)
+        tomato = Ingredient.objects.create(user=self.user, name='Tomato')
+        sample_recipe(self.user).ingredients.add(tomato)
+        tomate = Ingredient.objects.create(user=self.user, name='tomate')
+        sample_recipe(self.user).ingredients.add(tomate)
+
+        with self.assertNumQueries(23):
+            self.merge(self.tomato, tomato)
+        for index in range(20):
+            sample_recipe(self.user, f'more {index}').ingredients.add(
+                self.tomato)
+        with self.assertNumQueries(23):
+            self.merge(self.tomato, tomate)
+
+    def test_merge_tags(self):
+        """Test tags are merged like ingredients"""
+        vegan = Tag.objects.create(user=self.user, name='vegan')
+        plant_based = Tag.objects.create(user=self.user, name='plant based')
+        self.salad.tags.add(vegan, plant_based)
+        self.soup.tags.add(plant_based)
+
+        self.merge(vegan, plant_based, basename='tag')
+
+        self.assertEqual(list(Tag.objects.values_list('name', 'recipe_count')),
+                         [('vegan', 2)])
+        self.assertEqual(Recipe.tags.through.objects.count(), 2)
+
+    def test_merge_invalid(self):
+        """Test merging unknown, other users' or the same objects fails"""
+        other_user = get_user_model().objects.create_user('other@email.com',
+                                                          'testpassword')
+        other_tomato = Ingredient.objects.create(user=other_user,
+                                                 name='tomato')
+
+        for sources in ([other_tomato], [self.tomato], []):
+            response = self.merge(self.tomato, *sources)
+
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+            self.assertIn('ids', response.data)
+        self.assertEqual(Ingredient.objects.count(), 4)
+        response = self.merge(other_tomato, self.tomatoes)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_rename(self):
+        """Test a rename shows in the recipes using the ingredient"""
+        self.client.get(reverse('recipe:recipe-detail', args=[self.soup.id]))
+
+        response = self.client.post(rename_url('ingredient', self.tomatos.id),
+                                    {'name': 'cherry tomatoes'})
+
+        self.assertEqual(response.data, {'id': self.tomatos.id,
+                                         'name': 'cherry tomatoes'})
+        detail = self.client.get(
+            reverse('recipe:recipe-detail', args=[self.soup.id])).data
+        self.assertEqual(detail['ingredients'][0]['name'], 'cherry tomatoes')
+        self.tomatos.refresh_from_db()
+        self.assertEqual(self.tomatos.recipe_count, 2)
+
+    def test_rename_invalid(self):
+        """Test a rename needs a name"""
+        response = self.client.post(rename_url('tag', Tag.objects.create(
+            user=self.user, name='vegan').id), {'name': ''})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,187 @@
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.urls import reverse
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Ingredient
+from recipe import pantry
+
+PANTRY_URL = reverse('recipe:recipe-pantry')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def sample_recipe(user, title, ingredients=()):
+    """Create a recipe with the given ingredients"""
+    recipe = Recipe.objects.create(user=user, title=title, time_minutes=5,
+                                   price=10.00)
+    recipe.ingredients.add(*ingredients)
+    return recipe
+
+
+def ids(objects):
+    """Return the comma separated ids of model instances"""
+    return ','.join(str(obj.id) for obj in objects)
+
+
+class PantryIndexTests(TestCase):
+
+    def test_match_ranks_by_missing_count(self):
+        """Test the recipes missing the fewest ingredients come first"""
+        links = [(1, 10), (1, 11), (2, 10), (3, 10), (3, 11), (3, 12)]
+        index = pantry.PantryIndex([10, 11, 12], links, stamp=None)
+
+        matches = index.match([10, 11], max_missing=1)
+
+        self.assertEqual(matches, [(1, 2, 0), (2, 1, 0), (3, 2, 1)])
+
+    def test_many_ingredients_span_words(self):
+        """Test ingredients past the first 64 bit word are matched"""
+        ingredient_ids = list(range(1, 201))
+        links = [(1, 150), (1, 199), (2, 3)]
+        index = pantry.PantryIndex(ingredient_ids, links, stamp=None)
+
+        self.assertEqual(index.match([150, 199]), [(1, 2, 0)])
+
+    def test_set_recipe_unknown_ingredient(self):
+        """Test an unknown ingredient asks for a rebuild"""
+        index = pantry.PantryIndex([10], [(1, 10)], stamp=None)
+
+        self.assertFalse(index.set_recipe(1, [99]))
+        self.assertTrue(index.set_recipe(2, [10]))
+        self.assertEqual(index.match([10]), [(1, 1, 0), (2, 1, 0)])
+
+
+class PantryApiTests(TestCase):
+
+    def setUp(self):
+        pantry.cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpassword'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.rice, self.lentils, self.onion = [
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ('rice', 'lentils', 'onion')
+        ]
+
+    def test_full_and_near_matches(self):
+        """Test recipes are returned with their missing counts"""
+        koshari = sample_recipe(self.user, 'koshari',
+                                [self.rice, self.lentils, self.onion])
+        rice = sample_recipe(self.user, 'rice', [self.rice])
+
+        response = self.client.get(
+            PANTRY_URL,
+            {'have': ids([self.rice, self.lentils]), 'max_missing': 1}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data],
+                         [rice.id, koshari.id])
+        self.assertEqual(response.data[1]['missing'], 1)
+        self.assertEqual(response.data[1]['matched'], 2)
+
+    def test_index_follows_ingredient_changes(self):
+        """Test adding an ingredient to a recipe updates the loaded index"""
+        koshari = sample_recipe(self.user, 'koshari', [self.rice])
+        self.client.get(PANTRY_URL, {'have': ids([self.rice])})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            koshari.ingredients.add(self.lentils)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(PANTRY_URL,
+                                       {'have': ids([self.rice])})
+
+        self.assertFalse(any('core_recipe_ingredients' in query['sql']
+                             for query in queries.captured_queries))
+        self.assertEqual(response.data, [])
+
+    def test_rolled_back_change_not_indexed(self):
+        """Test a rolled back change never reaches the loaded index"""
+        koshari = sample_recipe(self.user, 'koshari', [self.rice])
+        self.client.get(PANTRY_URL, {'have': ids([self.rice])})
+
+        try:
+            with transaction.atomic():
+                koshari.ingredients.add(self.lentils)
+                raise ValueError
+        except ValueError:
+            pass
+        # another process changes something else meanwhile
+        pantry.bump_version(self.user.id)
+        response = self.client.get(PANTRY_URL, {'have': ids([self.rice])})
+
+        self.assertEqual([item['id'] for item in response.data],
+                         [koshari.id])
+
+    def test_index_follows_other_processes(self):
+        """Test a loaded index is rebuilt once the pantry version moves"""
+        koshari = sample_recipe(self.user, 'koshari', [self.rice])
+        self.client.get(PANTRY_URL, {'have': ids([self.rice])})
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(PANTRY_URL, {'have': ids([self.rice])})
+        # another process adds a link, without signals here
+        Recipe.ingredients.through.objects.create(recipe=koshari,
+                                                  ingredient=self.lentils)
+        pantry.bump_version(self.user.id)
+        response = self.client.get(PANTRY_URL, {'have': ids([self.rice])})
+
+        self.assertFalse(any('core_recipe_ingredients' in query['sql']
+                             for query in queries.captured_queries))
+        self.assertEqual(response.data, [])
+
+    def test_recipes_limited_to_user(self):
+        """Test other users' recipes are never matched"""
+        user2 = get_user_model().objects.create_user(
+            'other@email.com',
+            'testpassword'
+        )
+        their_rice = Ingredient.objects.create(user=user2, name='rice')
+        sample_recipe(user2, 'rice', [their_rice])
+
+        response = self.client.get(PANTRY_URL, {'have': ids([their_rice])})
+
+        self.assertEqual(response.data, [])
+
+    def test_other_users_ingredient_linked(self):
+        """Test a recipe linking another user's ingredient is indexed"""
+        user2 = get_user_model().objects.create_user(
+            'other@email.com',
+            'testpassword'
+        )
+        their_salt = Ingredient.objects.create(user=user2, name='salt')
+        response = self.client.post(RECIPES_URL, {
+            'title': 'salted rice', 'time_minutes': 5, 'price': '2.00',
+            'ingredients': [self.rice.id, their_salt.id],
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.get(
+            PANTRY_URL, {'have': ids([self.rice]), 'max_missing': 1})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(item['title'], item['missing'])
+                          for item in response.data], [('salted rice', 1)])
+
+    def test_invalid_have(self):
+        """Test a malformed ingredient list is rejected"""
+        response = self.client.get(PANTRY_URL, {'have': 'rice'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(PANTRY_INDEX_MAX_BYTES=1)
+    def test_memory_cap(self):
+        """Test indexes over the memory cap aren't kept"""
+        sample_recipe(self.user, 'rice', [self.rice])
+
+        response = self.client.get(PANTRY_URL, {'have': ids([self.rice])})
+
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(pantry.cache.nbytes(), 0)
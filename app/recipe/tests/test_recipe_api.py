@@ -11,7 +11,8 @@ from rest_framework import status
 from rest_framework.test import APIClient
 
 from core.models import Recipe, Tag, Ingredient
-from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+from recipe.serializers import RecipeSerializer, RecipeDetailSerializer, \
+    TagSerializer
 
 # api/recipe/recipes
 RECIPES_URL = reverse('recipe:recipe-list')
@@ -169,6 +170,22 @@ class PrivateRecipeApiTests(TestCase):
         self.assertIn(ingredient1, ingredients)
         self.assertIn(ingredient2, ingredients)
 
+    def test_create_recipe_invalid_links(self):
+        """Test unknown and malformed tag ids are rejected"""
+        tag = sample_tag(user=self.user)
+        payload = {'title': 'avocado cheesecake', 'time_minutes': 35,
+                   'price': 55.00}
+
+        for tags in ([tag.id, tag.id + 1], [tag.id, 'vegan'], tag.id):
+            response = self.client.post(RECIPES_URL, {**payload,
+                                                      'tags': tags},
+                                        format='json')
+
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+            self.assertIn('tags', response.data)
+        self.assertFalse(Recipe.objects.exists())
+
     def test_partial_update_recipe(self):
         """Test updating a recipe with patch"""
         recipe = sample_recipe(user=self.user)
@@ -209,6 +226,118 @@ class PrivateRecipeApiTests(TestCase):
         tags = recipe.tags.all()
         self.assertEqual(len(tags), 0)
 
+    def test_filter_recipes_by_range(self):
+        """Test filtering recipes by time and price ranges"""
+        quick_cheap = sample_recipe(user=self.user, time_minutes=20,
+                                    price=5.00)
+        sample_recipe(user=self.user, time_minutes=20, price=15.00)
+        sample_recipe(user=self.user, time_minutes=45, price=5.00)
+
+        response = self.client.get(
+            RECIPES_URL, {'time_minutes__lte': 30, 'price__lt': '10.00'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([recipe['id'] for recipe in response.data],
+                         [quick_cheap.id])
+
+    def test_invalid_range_filter(self):
+        """Test a range filter which isn't a number is rejected"""
+        response = self.client.get(RECIPES_URL, {'price__gte': 'cheap'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('price__gte', response.data)
+
+    def test_order_recipes(self):
+        """Test ordering recipes by an allowed field, ties by id"""
+        recipe1 = sample_recipe(user=self.user, title='b', price=7.00)
+        recipe2 = sample_recipe(user=self.user, title='a', price=3.00)
+        recipe3 = sample_recipe(user=self.user, title='c', price=7.00)
+
+        response = self.client.get(RECIPES_URL, {'ordering': '-price'})
+
+        self.assertEqual([recipe['id'] for recipe in response.data],
+                         [recipe3.id, recipe1.id, recipe2.id])
+
+        response = self.client.get(RECIPES_URL, {'ordering': 'title'})
+
+        self.assertEqual([recipe['id'] for recipe in response.data],
+                         [recipe2.id, recipe1.id, recipe3.id])
+
+    def test_order_by_unknown_field(self):
+        """Test ordering by a field outside the allowlist is rejected"""
+        response = self.client.get(RECIPES_URL, {'ordering': 'user'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ordering', response.data)
+
+    def test_limit_recipes(self):
+        """Test only the first `limit` recipes are returned"""
+        for minutes in (30, 10, 20):
+            sample_recipe(user=self.user, time_minutes=minutes)
+
+        response = self.client.get(
+            RECIPES_URL, {'ordering': 'time_minutes', 'limit': 2})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([recipe['time_minutes'] for recipe in response.data],
+                         [10, 20])
+
+    def test_include_nested_relations(self):
+        """Test included relations are nested with their names"""
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(sample_tag(user=self.user, name='Vegan'))
+        recipe.ingredients.add(sample_ingredient(user=self.user))
+
+        response = self.client.get(RECIPES_URL, {'include': 'tags'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        detail = RecipeDetailSerializer(recipe).data
+        self.assertEqual(response.data[0]['tags'], detail['tags'])
+        self.assertEqual(response.data[0]['ingredients'],
+                         RecipeSerializer(recipe).data['ingredients'])
+
+    def test_include_queries_dont_grow(self):
+        """Test including relations runs one query per relation"""
+        tag = sample_tag(user=self.user)
+        for _ in range(3):
+            sample_recipe(user=self.user).tags.add(tag)
+        self.client.get(RECIPES_URL)
+
+        # the recipes and one query per prefetched relation
+        with self.assertNumQueries(3):
+            response = self.client.get(RECIPES_URL,
+                                       {'include': 'tags,ingredients'})
+
+        self.assertEqual(len(response.data), 3)
+
+    def test_include_unknown_relation(self):
+        """Test including an unknown relation is rejected"""
+        response = self.client.get(RECIPES_URL, {'include': 'tags,user'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('include', response.data)
+
+    def test_sideload_relations(self):
+        """Test side loading lists every included relation once"""
+        tag1 = sample_tag(user=self.user, name='Vegan')
+        tag2 = sample_tag(user=self.user, name='Dessert')
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user)
+        recipe1.tags.add(tag1, tag2)
+        recipe2.tags.add(tag1)
+
+        response = self.client.get(
+            RECIPES_URL, {'include': 'tags', 'sideload': 1})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data['recipes'],
+            RecipeSerializer([recipe1, recipe2], many=True).data
+        )
+        self.assertEqual(response.data['tags'],
+                         TagSerializer([tag1, tag2], many=True).data)
+        self.assertNotIn('ingredients', response.data)
+
 
 class RecipeImageUploadTest(TestCase):
 
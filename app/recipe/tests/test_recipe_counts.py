@@ -0,0 +1,121 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core.models import Tag, Ingredient, Recipe
+
+
+TAGS_URL = reverse('recipe:tag-list')
+
+
+def sample_recipe(user, title='sample recipe'):
+    return Recipe.objects.create(user=user, title=title, time_minutes=5,
+                                 price=5.00)
+
+
+def counts(model):
+    return dict(model.objects.values_list('name', 'recipe_count'))
+
+
+class RecipeCountTests(TestCase):
+    """Test the denormalized recipe counts of tags and ingredients"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@email.com',
+                                                         'testpassword')
+        self.vegan = Tag.objects.create(user=self.user, name='vegan')
+        self.quick = Tag.objects.create(user=self.user, name='quick')
+        self.recipe1 = sample_recipe(self.user)
+        self.recipe2 = sample_recipe(self.user)
+
+    def test_add_and_remove_from_recipe(self):
+        """Test linking and unlinking from the recipe side"""
+        self.recipe1.tags.add(self.vegan, self.quick)
+        self.recipe2.tags.add(self.vegan)
+        # adding an existing link changes nothing
+        self.recipe2.tags.add(self.vegan)
+        self.assertEqual(counts(Tag), {'vegan': 2, 'quick': 1})
+
+        # removing a tag which isn't linked changes nothing
+        self.recipe2.tags.remove(self.vegan, self.quick)
+        self.assertEqual(counts(Tag), {'vegan': 1, 'quick': 1})
+
+        self.recipe1.tags.clear()
+        self.assertEqual(counts(Tag), {'vegan': 0, 'quick': 0})
+
+    def test_add_and_remove_from_tag(self):
+        """Test linking and unlinking from the tag side"""
+        self.vegan.recipe_set.add(self.recipe1, self.recipe2)
+        self.vegan.recipe_set.add(self.recipe1)
+        self.assertEqual(counts(Tag)['vegan'], 2)
+
+        self.vegan.recipe_set.remove(self.recipe2)
+        self.assertEqual(counts(Tag)['vegan'], 1)
+
+        self.vegan.recipe_set.clear()
+        self.assertEqual(counts(Tag)['vegan'], 0)
+
+    def test_recipe_deleted(self):
+        """Test deleting a recipe decrements what it used"""
+        salt = Ingredient.objects.create(user=self.user, name='salt')
+        self.recipe1.tags.add(self.vegan)
+        self.recipe1.ingredients.add(salt)
+        self.recipe2.ingredients.add(salt)
+
+        self.recipe1.delete()
+
+        self.assertEqual(counts(Tag)['vegan'], 0)
+        self.assertEqual(counts(Ingredient), {'salt': 1})
+
+    def test_update_recipe_through_api(self):
+        """Test a full update replacing the tags of a recipe"""
+        self.recipe1.tags.add(self.vegan)
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        client.put(reverse('recipe:recipe-detail', args=[self.recipe1.id]), {
+            'title': 'updated', 'time_minutes': 5, 'price': '5.00',
+            'tags': [self.quick.id], 'ingredients': [],
+        }, format='json')
+
+        self.assertEqual(counts(Tag), {'vegan': 0, 'quick': 1})
+
+    def test_reconcile_command(self):
+        """Test the reconcile command fixes drifted counts only"""
+        self.recipe1.tags.add(self.vegan)
+        self.recipe2.tags.add(self.vegan)
+        Tag.objects.filter(id=self.vegan.id).update(recipe_count=7)
+        # bulk_create doesn't send m2m_changed
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe=self.recipe1, tag=self.quick)])
+
+        out = StringIO()
+        call_command('reconcile_recipe_counts', batch_size=1, stdout=out)
+
+        self.assertEqual(counts(Tag), {'vegan': 2, 'quick': 1})
+        self.assertIn('Fixed 2 tags', out.getvalue())
+        self.assertIn('Fixed 0 ingredients', out.getvalue())
+
+    def test_order_by_popularity(self):
+        """Test listing tags by how many recipes use them"""
+        dessert = Tag.objects.create(user=self.user, name='dessert')
+        self.recipe1.tags.add(self.quick, dessert)
+        self.recipe2.tags.add(self.quick)
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.get(TAGS_URL, {'ordering': '-recipe_count'})
+
+        self.assertEqual([tag['name'] for tag in response.data],
+                         ['quick', 'dessert', 'vegan'])
+
+        response = client.get(TAGS_URL, {'ordering': 'recipe_count',
+                                         'assigned_only': 1})
+
+        self.assertEqual([tag['name'] for tag in response.data],
+                         ['dessert', 'quick'])
@@ -0,0 +1,93 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Ingredient, Recipe
+
+
+SHOPPING_LIST_URL = reverse('recipe:recipe-shopping-list')
+
+
+def sample_recipe(user, ingredients=()):
+    recipe = Recipe.objects.create(user=user, title='sample recipe',
+                                   time_minutes=5, price=5.00)
+    recipe.ingredients.add(*ingredients)
+    return recipe
+
+
+def ids(recipes):
+    return ','.join(str(recipe.id) for recipe in recipes)
+
+
+class ShoppingListApiTests(TestCase):
+    """Test the shopping list of several recipes"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@email.com',
+                                                         'testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.salt = Ingredient.objects.create(user=self.user, name='salt')
+        self.eggs = Ingredient.objects.create(user=self.user, name='eggs')
+        self.flour = Ingredient.objects.create(user=self.user, name='flour')
+
+    def test_login_required(self):
+        """Test that login is required for the shopping list"""
+        response = APIClient().get(SHOPPING_LIST_URL, {'recipes': '1'})
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_combined_ingredients(self):
+        """Test ingredients are listed once with their recipe counts"""
+        recipe1 = sample_recipe(self.user, [self.salt, self.eggs])
+        recipe2 = sample_recipe(self.user, [self.salt, self.flour])
+        recipe3 = sample_recipe(self.user, [self.salt, self.eggs])
+        sample_recipe(self.user, [self.flour])
+
+        response = self.client.get(
+            SHOPPING_LIST_URL, {'recipes': ids([recipe1, recipe2, recipe3])})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [
+            {'id': self.salt.id, 'name': 'salt', 'recipe_count': 3},
+            {'id': self.eggs.id, 'name': 'eggs', 'recipe_count': 2},
+            {'id': self.flour.id, 'name': 'flour', 'recipe_count': 1},
+        ])
+
+    def test_other_users_recipes_ignored(self):
+        """Test recipes of other users don't add to the list"""
+        other_user = get_user_model().objects.create_user('other@email.com',
+                                                          'testpassword')
+        other_salt = Ingredient.objects.create(user=other_user, name='salt')
+        recipe = sample_recipe(self.user, [self.eggs])
+        other_recipe = sample_recipe(other_user, [other_salt])
+
+        response = self.client.get(
+            SHOPPING_LIST_URL, {'recipes': ids([recipe, other_recipe])})
+
+        self.assertEqual(response.data, [
+            {'id': self.eggs.id, 'name': 'eggs', 'recipe_count': 1}])
+
+    def test_single_query(self):
+        """Test the list takes one query whatever the number of recipes"""
+        recipes = [sample_recipe(self.user, [self.salt, self.eggs])
+                   for _ in range(20)]
+
+        with self.assertNumQueries(1):
+            response = self.client.get(SHOPPING_LIST_URL,
+                                       {'recipes': ids(recipes)})
+
+        self.assertEqual(response.data[0]['recipe_count'], 20)
+
+    def test_invalid_recipes(self):
+        """Test missing, malformed and too many ids are rejected"""
+        for params in ({}, {'recipes': '1,a'},
+                       {'recipes': ','.join(['1'] * 501)}):
+            response = self.client.get(SHOPPING_LIST_URL, params)
+
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+            self.assertIn('recipes', response.data)
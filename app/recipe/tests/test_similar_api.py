@@ -0,0 +1,169 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.urls import reverse
+from django.test import TestCase
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag, Ingredient, RecipeSignature, RecipeBand
+from recipe import similarity
+
+
+def similar_url(recipe_id):
+    """Return the similar recipes url of a recipe"""
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
+def sample_recipe(user, title, tags=(), ingredients=()):
+    """Create a recipe with the given tags and ingredients"""
+    recipe = Recipe.objects.create(user=user, title=title, time_minutes=5,
+                                   price=10.00)
+    recipe.tags.add(*tags)
+    recipe.ingredients.add(*ingredients)
+    return recipe
+
+
+class MinHashTests(TestCase):
+
+    def test_identical_sets_have_identical_signatures(self):
+        """Test the signature only depends on the set of ids"""
+        self.assertTrue(
+            (similarity.minhash([1, 2], [3]) ==
+             similarity.minhash([2, 1], [3])).all())
+
+    def test_tags_and_ingredients_hashed_apart(self):
+        """Test a tag and an ingredient with the same id differ"""
+        self.assertFalse(
+            (similarity.minhash([1], []) == similarity.minhash([], [1])).all())
+
+    def test_empty_recipe_has_no_signature(self):
+        """Test recipes without tags or ingredients aren't indexed"""
+        self.assertIsNone(similarity.minhash([], []))
+
+
+class SimilarRecipesApiTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpassword'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.tags = [Tag.objects.create(user=self.user, name=f'tag {i}')
+                     for i in range(4)]
+        self.ingredients = [
+            Ingredient.objects.create(user=self.user, name=f'ingredient {i}')
+            for i in range(8)
+        ]
+
+    def test_index_updated_from_m2m_changes(self):
+        """Test adding and clearing tags keeps the index in sync"""
+        recipe = sample_recipe(self.user, 'koshari', tags=self.tags[:2])
+        self.assertTrue(
+            RecipeSignature.objects.filter(recipe=recipe).exists())
+        self.assertEqual(RecipeBand.objects.filter(recipe=recipe).count(),
+                         similarity.BANDS)
+
+        recipe.tags.clear()
+
+        self.assertFalse(
+            RecipeSignature.objects.filter(recipe=recipe).exists())
+        self.assertFalse(RecipeBand.objects.filter(recipe=recipe).exists())
+
+    def test_reverse_m2m_changes_reindex(self):
+        """Test adding recipes from the tag side reindexes them"""
+        recipe = sample_recipe(self.user, 'koshari')
+
+        self.tags[0].recipe_set.add(recipe)
+
+        self.assertTrue(
+            RecipeSignature.objects.filter(recipe=recipe).exists())
+
+    def test_similar_recipes_ranked(self):
+        """Test the most similar recipes come first"""
+        base = sample_recipe(self.user, 'base', tags=self.tags[:2],
+                             ingredients=self.ingredients[:6])
+        twin = sample_recipe(self.user, 'twin', tags=self.tags[:2],
+                             ingredients=self.ingredients[:6])
+        close = sample_recipe(self.user, 'close', tags=self.tags[:2],
+                              ingredients=self.ingredients[:5])
+        sample_recipe(self.user, 'unrelated', tags=self.tags[3:],
+                      ingredients=self.ingredients[7:])
+
+        response = self.client.get(similar_url(base.id))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [item['id'] for item in response.data]
+        self.assertEqual(ids[:2], [twin.id, close.id])
+        self.assertEqual(response.data[0]['similarity'], 1.0)
+        self.assertNotIn(base.id, ids)
+
+    def test_hidden_recipes_leave_their_places(self):
+        """Test recipes the user can't list don't count toward the limit"""
+        base = sample_recipe(self.user, 'base', tags=self.tags[:2],
+                             ingredients=self.ingredients[:6])
+        twin = sample_recipe(self.user, 'twin', tags=self.tags[:2],
+                             ingredients=self.ingredients[:6])
+        close = sample_recipe(self.user, 'close', tags=self.tags[:2],
+                              ingredients=self.ingredients[:5])
+        # still indexed, like a recipe whose deletion is in progress
+        Recipe.objects.filter(id=twin.id).update(pending_deletion=True)
+
+        response = self.client.get(similar_url(base.id), {'limit': 1})
+
+        self.assertEqual([item['id'] for item in response.data], [close.id])
+
+    def test_similar_limited_to_user(self):
+        """Test recipes of other users are never suggested"""
+        user2 = get_user_model().objects.create_user(
+            'other@email.com',
+            'testpassword'
+        )
+        base = sample_recipe(self.user, 'base', tags=self.tags[:2])
+        other_tag = Tag.objects.create(user=user2, name='tag 0')
+        sample_recipe(user2, 'theirs', tags=[other_tag])
+
+        response = self.client.get(similar_url(base.id))
+
+        self.assertEqual(response.data, [])
+
+    def test_invalid_limit(self):
+        """Test a non integer limit is rejected"""
+        base = sample_recipe(self.user, 'base', tags=self.tags[:2])
+
+        response = self.client.get(similar_url(base.id), {'limit': 'x'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rebuild_command(self):
+        """Test the index can be rebuilt from scratch"""
+        recipe = sample_recipe(self.user, 'koshari', tags=self.tags[:2])
+        RecipeSignature.objects.all().delete()
+
+        call_command('rebuild_similarity_index', stdout=StringIO())
+
+        self.assertTrue(
+            RecipeSignature.objects.filter(recipe=recipe).exists())
+
+    def test_rebuild_skips_pending_recipes(self):
+        """Test a rebuild takes the pending recipes out of the index"""
+        # still indexed, before and after the recipe the rebuild keeps
+        first = sample_recipe(self.user, 'first', tags=self.tags[:2])
+        kept = sample_recipe(self.user, 'koshari', tags=self.tags[:2])
+        last = sample_recipe(self.user, 'last', tags=self.tags[:2])
+        Recipe.objects.filter(id__in=[first.id, last.id]).update(
+            pending_deletion=True)
+
+        call_command('rebuild_similarity_index', '--batch-size', '1',
+                     stdout=StringIO())
+
+        self.assertEqual(
+            list(RecipeSignature.objects.values_list('recipe_id', flat=True)),
+            [kept.id])
+        self.assertEqual(
+            set(RecipeBand.objects.values_list('recipe_id', flat=True)),
+            {kept.id})
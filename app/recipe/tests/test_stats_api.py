@@ -0,0 +1,156 @@
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Tag, Ingredient, Recipe, LibraryStats
+from recipe import stats
+
+
+STATS_URL = reverse('recipe:stats')
+
+
+def sample_recipe(user, time_minutes=10, price='5.00'):
+    return Recipe.objects.create(user=user, title='sample recipe',
+                                 time_minutes=time_minutes, price=price)
+
+
+def stored(user):
+    """Return the stored stats of a user without the histograms"""
+    return LibraryStats.objects.values(
+        'recipe_count', 'tag_count', 'ingredient_count', 'time_minutes_sum',
+        'price_sum'
+    ).get(user=user)
+
+
+class StatsTests(TestCase):
+    """Test the incrementally maintained library stats"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@email.com',
+                                                         'testpassword')
+
+    def test_percentiles_from_histogram(self):
+        """Test percentiles are read from the cumulative bucket counts"""
+        histogram = stats.load_histogram(b'', 10)
+        histogram[[2, 3, 9]] = [5, 4, 1]
+
+        self.assertEqual(stats.histogram_percentile(histogram, 50), 2)
+        self.assertEqual(stats.histogram_percentile(histogram, 90), 3)
+        self.assertEqual(stats.histogram_percentile(histogram, 99), 9)
+        self.assertIsNone(stats.histogram_percentile(histogram * 0, 50))
+
+    def test_buckets_clamp(self):
+        """Test values past the last bucket land in it"""
+        self.assertEqual(stats.time_bucket(10000), stats.TIME_BUCKETS - 1)
+        self.assertEqual(stats.price_bucket('4.99'), 0)
+        self.assertEqual(stats.price_bucket(Decimal('5.00')), 1)
+        self.assertEqual(stats.price_bucket('999.99'),
+                         stats.PRICE_BUCKETS - 1)
+
+    def test_writes_update_stats(self):
+        """Test writes keep the stored stats equal to a recompute"""
+        stats.recompute(self.user.id)
+        recipe = sample_recipe(self.user, time_minutes=20, price='12.50')
+        sample_recipe(self.user, time_minutes=40, price='7.00')
+        Tag.objects.create(user=self.user, name='vegan')
+        salt = Ingredient.objects.create(user=self.user, name='salt')
+
+        recipe = Recipe.objects.get(id=recipe.id)
+        recipe.time_minutes = 30
+        recipe.save()
+        salt.delete()
+        incremental = stored(self.user)
+
+        self.assertEqual(incremental, {
+            'recipe_count': 2, 'tag_count': 1, 'ingredient_count': 0,
+            'time_minutes_sum': 70, 'price_sum': Decimal('19.50'),
+        })
+        histograms = LibraryStats.objects.values_list(
+            'time_histogram', 'price_histogram').get(user=self.user)
+        stats.recompute(self.user.id)
+        self.assertEqual(stored(self.user), incremental)
+        self.assertEqual(
+            [bytes(blob) for blob in histograms],
+            [bytes(blob) for blob in LibraryStats.objects.values_list(
+                'time_histogram', 'price_histogram').get(user=self.user)]
+        )
+
+        recipe.delete()
+        self.assertEqual(stored(self.user)['recipe_count'], 1)
+        self.assertEqual(stored(self.user)['time_minutes_sum'], 40)
+
+    def test_writes_without_stats_row(self):
+        """Test writes of users without stats don't create a row"""
+        sample_recipe(self.user)
+        Tag.objects.create(user=self.user, name='vegan')
+
+        self.assertFalse(LibraryStats.objects.filter(user=self.user).exists())
+
+    def test_recompute_command(self):
+        """Test the command recomputes drifted stats"""
+        stats.recompute(self.user.id)
+        sample_recipe(self.user, time_minutes=15)
+        LibraryStats.objects.filter(user=self.user).update(recipe_count=9)
+
+        out = StringIO()
+        call_command('recompute_library_stats', user_ids=[self.user.id],
+                     stdout=out)
+
+        self.assertEqual(stored(self.user)['recipe_count'], 1)
+        self.assertIn('Recomputed the stats of 1 users', out.getvalue())
+
+
+class StatsApiTests(TestCase):
+    """Test the library stats endpoint"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@email.com',
+                                                         'testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_login_required(self):
+        """Test that login is required for the stats"""
+        response = APIClient().get(STATS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_empty_library(self):
+        """Test the stats of a user without recipes"""
+        response = self.client.get(STATS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['recipe_count'], 0)
+        self.assertEqual(response.data['time_minutes'], {
+            'average': None, 'p50': None, 'p90': None, 'p99': None})
+        self.assertIsNone(response.data['price']['average'])
+        self.assertEqual(response.data['price']['histogram'],
+                         [0] * stats.PRICE_BUCKETS)
+
+    def test_library_stats(self):
+        """Test the summary of a user's library"""
+        vegan = Tag.objects.create(user=self.user, name='vegan')
+        Tag.objects.create(user=self.user, name='unused')
+        for minutes, price in ((10, '3.00'), (20, '6.00'), (60, '9.00')):
+            sample_recipe(self.user, minutes, price).tags.add(vegan)
+        self.client.get(STATS_URL)
+        sample_recipe(self.user, 30, '12.00')
+
+        response = self.client.get(STATS_URL)
+
+        self.assertEqual(response.data['recipe_count'], 4)
+        self.assertEqual(response.data['tag_count'], 2)
+        self.assertEqual(response.data['time_minutes'], {
+            'average': 30.0, 'p50': 20, 'p90': 60, 'p99': 60})
+        self.assertEqual(response.data['price']['average'], '7.50')
+        self.assertEqual(response.data['price']['histogram'][:3], [1, 2, 1])
+        self.assertEqual(response.data['top_tags'], [
+            {'id': vegan.id, 'name': 'vegan', 'recipe_count': 3}])
+        self.assertEqual(response.data['top_ingredients'], [])
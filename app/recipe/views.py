@@ -1,18 +1,66 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Count
+from django.http import Http404
+from django.urls import reverse
 from rest_framework.decorators import action
+from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import viewsets, mixins, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 
+from core.batch import BatchAuthentication
+from core.idempotency import IdempotentMixin
 from core.models import Tag, Ingredient, Recipe
-from recipe import serializers
+from core.renderers import DocumentResponse
+from core.serializers import JobSerializer
+from recipe import autocomplete, deletion, documents, merging, pantry, \
+    serializers, similarity, stats, tasks
+
+
+class QueryParamsMixin:
+    """Parse the query parameters of a viewset"""
+
+    def _int_param(self, name, default, maximum):
+        """Return an integer query parameter capped to `maximum`"""
+        try:
+            value = int(self.request.query_params.get(name, default))
+        except ValueError:
+            raise ValidationError({name: 'A valid integer is required.'})
+
+        return max(min(value, maximum), 0)
+
+    def _ordering(self):
+        """
+        Return the requested ordering, the id breaks ties in the same
+        direction so the (user, field, id) index gives the order
+        """
+        ordering = self.request.query_params.get('ordering')
+        if not ordering:
+            return list(self.default_ordering)
+
+        field = ordering.lstrip('-')
+        if field not in self.ordering_fields:
+            raise ValidationError({'ordering': (
+                f'Order by one of {", ".join(self.ordering_fields)}, '
+                f'prefixed with - for descending order.')})
+        prefix = '-' if ordering.startswith('-') else ''
+
+        return [ordering, f'{prefix}id']
 
 
-class BaseRecipeAttrViewSet(viewsets.GenericViewSet, mixins.ListModelMixin,
+class BaseRecipeAttrViewSet(IdempotentMixin, QueryParamsMixin,
+                            viewsets.GenericViewSet, mixins.ListModelMixin,
                             mixins.CreateModelMixin):
     """Base viewset for the user owned the recipe attributes"""
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (TokenAuthentication, BatchAuthentication)
     permission_classes = (IsAuthenticated,)
+    ordering_fields = ('name', 'recipe_count')
+    default_ordering = ('-name',)
 
     def get_queryset(self):
         """return objects for the current authenticated user only"""
@@ -20,15 +68,64 @@ class BaseRecipeAttrViewSet(viewsets.GenericViewSet, mixins.ListModelMixin,
             int(self.request.query_params.get('assigned_only', 0)))
         queryset = self.queryset
         if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
+            # the denormalized count avoids joining the recipe links
+            queryset = queryset.filter(recipe_count__gt=0)
 
         return queryset.filter(user=self.request.user
-                               ).order_by('-name').distinct()
+                               ).order_by(*self._ordering())
+
+    def get_serializer_class(self):
+        if self.action == 'autocomplete':
+            return serializers.AutocompleteSerializer
+        elif self.action == 'merge':
+            return serializers.MergeSerializer
+
+        return self.serializer_class
 
     def perform_create(self, serializer):
         """Create a new object with user is the sender of the request"""
         serializer.save(user=self.request.user)
 
+    @action(methods=['GET'], detail=False)
+    def autocomplete(self, request):
+        """Return the most used objects whose name starts with `q`"""
+        limit = self._int_param('limit', 10, 50)
+        matches = autocomplete.search(self.queryset.model, request.user.id,
+                                      request.query_params.get('q', ''),
+                                      limit=limit)
+
+        serializer = self.get_serializer(
+            [{'id': pk, 'name': name, 'recipe_count': count}
+             for pk, name, count in matches],
+            many=True
+        )
+        return Response(serializer.data)
+
+    @action(methods=['POST'], detail=True)
+    def rename(self, request, pk=None):
+        """Rename the object, the recipes using it follow"""
+        obj = self.get_object()
+        serializer = self.get_serializer(obj, data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # the recipe count is updated concurrently, only write the name
+        obj.name = serializer.validated_data['name']
+        obj.save(update_fields=['name'])
+
+        return Response(self.get_serializer(obj).data)
+
+    @action(methods=['POST'], detail=True)
+    def merge(self, request, pk=None):
+        """Move the recipes of the given objects to this one, delete them"""
+        target = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            merging.merge(target, serializer.validated_data['ids'])
+        except merging.MergeError as exc:
+            raise ValidationError({'ids': str(exc)})
+
+        return Response(self.serializer_class(target).data)
+
 
 class TagViewSet(BaseRecipeAttrViewSet):
     """manage tags in the database"""
@@ -42,12 +139,23 @@ class IngredientViewSet(BaseRecipeAttrViewSet):
     serializer_class = serializers.IngredientSerializer
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(IdempotentMixin, QueryParamsMixin,
+                    viewsets.ModelViewSet):
     """Manage recipes in the database"""
     serializer_class = serializers.RecipeSerializer
-    queryset = Recipe.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    # recipes pending deletion are gone as far as the API is concerned
+    queryset = Recipe.objects.filter(pending_deletion=False)
+    authentication_classes = (TokenAuthentication, BatchAuthentication)
     permission_classes = (IsAuthenticated,)
+    # field: parser of the range filterable fields
+    range_fields = {'time_minutes': int, 'price': Decimal}
+    range_lookups = ('lt', 'lte', 'gt', 'gte')
+    # every ordering field has a (user, field, id) index
+    ordering_fields = ('time_minutes', 'price', 'title')
+    default_ordering = ('id',)
+    includable = ('tags', 'ingredients')
+    max_limit = 1000
+    max_shopping_list_recipes = 500
 
     def _params_to_ints(self, qs):
         """Convert a list of IDs to a list of intgers"""
@@ -66,7 +174,101 @@ class RecipeViewSet(viewsets.ModelViewSet):
             ingredient_ids = self._params_to_ints(ingredients)
             queryset = queryset.filter(ingredients__id__in=ingredient_ids)
 
-        return queryset.filter(user=self.request.user)
+        queryset = queryset.filter(user=self.request.user,
+                                   **self._range_filters())
+
+        # the tag and ingredient ids of every recipe are serialized,
+        # fetch them in one query per relation
+        return queryset.order_by(*self._ordering()).prefetch_related(
+            'tags', 'ingredients')
+
+    def _range_filters(self):
+        """Return the `<field>__<lookup>` filters of the query parameters"""
+        filters = {}
+        for field, parse in self.range_fields.items():
+            for lookup in self.range_lookups:
+                name = f'{field}__{lookup}'
+                value = self.request.query_params.get(name)
+                if value is None:
+                    continue
+                try:
+                    filters[name] = parse(value)
+                except (ValueError, InvalidOperation):
+                    raise ValidationError(
+                        {name: 'A valid number is required.'})
+
+        return filters
+
+    def _include(self):
+        """Return the relations to serialize inline, in a stable order"""
+        include = self.request.query_params.get('include')
+        if not include:
+            return []
+        names = set(include.split(','))
+        unknown = names - set(self.includable)
+        if unknown:
+            raise ValidationError({'include': (
+                f'Include any of {", ".join(self.includable)}, '
+                f'not {", ".join(sorted(unknown))}.')})
+
+        return [name for name in self.includable if name in names]
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action == 'list':
+            context['include'] = self._include()
+
+        return context
+
+    def list(self, request, *args, **kwargs):
+        """
+        Return the recipes, only the first `limit` ones if given. With
+        `sideload` the included relations are listed once next to the
+        recipes instead of inside every recipe
+        """
+        queryset = self.get_queryset()
+        include = self._include()
+        sideload = self._int_param('sideload', 0, 1)
+        if not include and not sideload:
+            # the stored list items of the recipes, in one query
+            queryset = queryset.prefetch_related(None).values_list(
+                'id', 'document__list_item')
+        if 'limit' in request.query_params:
+            # ORDER BY ... LIMIT walks the index and stops after `limit`
+            # rows instead of sorting every match
+            queryset = queryset[:self._int_param('limit', 0,
+                                                 self.max_limit)]
+
+        if not include and not sideload:
+            return DocumentResponse(documents.list_document(queryset))
+        if not sideload:
+            serializer = self.get_serializer(queryset, many=True)
+            return Response(serializer.data)
+
+        recipes = list(queryset)
+        nested = serializers.RecipeIncludeSerializer.nested_serializers
+        data = {'recipes': serializers.RecipeSerializer(
+            recipes, many=True, context=super().get_serializer_context()
+        ).data}
+        for name in include:
+            # the relations are prefetched, this runs no query
+            related = {obj.id: obj for recipe in recipes
+                       for obj in getattr(recipe, name).all()}
+            data[name] = nested[name](
+                [related[pk] for pk in sorted(related)], many=True).data
+
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Return the stored detail JSON of the recipe"""
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(
+            None).values_list('id', 'document__detail')
+        recipe_id, document = get_object_or_404(queryset, pk=kwargs['pk'])
+        document = documents.detail_document(recipe_id, document)
+        if document is None:
+            raise Http404
+
+        return DocumentResponse(document)
 
     def get_serializer_class(self):
         """Return appropriate serializer class"""
@@ -74,12 +276,28 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return serializers.RecipeDetailSerializer
         elif self.action == 'upload_image':
             return serializers.RecipeImageSerializer
+        elif self.action == 'similar':
+            return serializers.SimilarRecipeSerializer
+        elif self.action == 'pantry':
+            return serializers.PantryRecipeSerializer
+        elif self.action == 'shopping_list':
+            return serializers.ShoppingListItemSerializer
+        elif self.action == 'bulk_delete':
+            return serializers.RecipeBulkDeleteSerializer
+        elif self.action == 'list':
+            return serializers.RecipeIncludeSerializer
 
         return self.serializer_class
 
     def perform_create(self, serializer):
         """Create a new recipe"""
-        serializer.save(user=self.request.user)
+        # the recipe and its links are rendered once, on commit
+        with transaction.atomic():
+            serializer.save(user=self.request.user)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            serializer.save()
 
     @action(methods=['POST'], detail=True, url_path='upload-image')
     def upload_image(self, request, pk=None):
@@ -99,3 +317,110 @@ class RecipeViewSet(viewsets.ModelViewSet):
             serializer.errors,
             status=status.HTTP_400_BAD_REQUEST
         )
+
+    @action(methods=['POST'], detail=False, url_path='bulk-delete')
+    def bulk_delete(self, request):
+        """
+        Hide the given recipes at once and delete them in the background,
+        return the job doing it
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        deletion.mark_recipes(request.user, serializer.validated_data['ids'])
+        job = tasks.purge_recipes.enqueue(
+            payload={'user_id': request.user.id}, user=request.user)
+
+        return Response(
+            JobSerializer(job).data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': reverse('core:job-detail', args=[job.id])}
+        )
+
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        """Return the recipes sharing the most tags and ingredients"""
+        recipe = self.get_object()
+        limit = self._int_param('limit', 10, 100)
+
+        queryset = self.get_queryset()
+        matches = similarity.similar_recipes(recipe, limit=limit,
+                                             recipes=queryset)
+        recipes = queryset.in_bulk([recipe_id for recipe_id, _ in matches])
+        similar = []
+        for recipe_id, score in matches:
+            # a recipe deleted meanwhile is skipped
+            if recipe_id in recipes:
+                recipes[recipe_id].similarity = score
+                similar.append(recipes[recipe_id])
+
+        serializer = self.get_serializer(similar, many=True)
+        return Response(serializer.data)
+
+    @action(methods=['GET'], detail=False, url_path='shopping-list')
+    def shopping_list(self, request):
+        """Return the ingredients of the given recipes, most used first"""
+        try:
+            recipe_ids = self._params_to_ints(
+                request.query_params.get('recipes', ''))
+        except ValueError:
+            raise ValidationError(
+                {'recipes': 'A comma separated list of ids is required.'})
+        if len(recipe_ids) > self.max_shopping_list_recipes:
+            raise ValidationError({'recipes': (
+                f'At most {self.max_shopping_list_recipes} recipes can be '
+                f'listed.')})
+
+        # one grouped query over the links, whatever the number of recipes
+        items = Recipe.ingredients.through.objects.filter(
+            recipe_id__in=recipe_ids, recipe__user=request.user,
+            recipe__pending_deletion=False
+        ).values(
+            'ingredient_id', 'ingredient__name'
+        ).annotate(
+            recipe_count=Count('recipe_id')
+        ).order_by('-recipe_count', 'ingredient__name', 'ingredient_id')
+
+        serializer = self.get_serializer(
+            [{'id': item['ingredient_id'], 'name': item['ingredient__name'],
+              'recipe_count': item['recipe_count']} for item in items],
+            many=True
+        )
+        return Response(serializer.data)
+
+    @action(methods=['GET'], detail=False)
+    def pantry(self, request):
+        """Return the recipes the given ingredients (mostly) cover"""
+        have = request.query_params.get('have')
+        try:
+            ingredient_ids = self._params_to_ints(have) if have else []
+        except ValueError:
+            raise ValidationError(
+                {'have': 'A comma separated list of ids is required.'})
+        max_missing = self._int_param('max_missing', 0, 1000)
+        limit = self._int_param('limit', 20, 100)
+
+        index = pantry.cache.get(request.user.id)
+        matches = index.match(ingredient_ids, max_missing=max_missing,
+                              limit=limit)
+        recipes = self.queryset.filter(user=request.user).prefetch_related(
+            'tags', 'ingredients').in_bulk(
+                [recipe_id for recipe_id, _, _ in matches])
+        results = []
+        for recipe_id, matched, missing in matches:
+            if recipe_id in recipes:
+                recipes[recipe_id].matched = matched
+                recipes[recipe_id].missing = missing
+                results.append(recipes[recipe_id])
+
+        serializer = self.get_serializer(results, many=True)
+        return Response(serializer.data)
+
+
+class LibraryStatsView(APIView):
+    """Summarize the recipes, tags and ingredients of the user"""
+    authentication_classes = (TokenAuthentication, BatchAuthentication)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        return Response(stats.summary(request.user.id))
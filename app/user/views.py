@@ -1,10 +1,15 @@
-from rest_framework import generics, authentication, permissions
+from rest_framework import generics, authentication, permissions, status
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
+
+from core.batch import BatchAuthentication
+from core.idempotency import IdempotentMixin
+from recipe import deletion, tasks
 from .serializers import UserSerializer, AuthTokenSerializer
 
 
-class CreateUserView(generics.CreateAPIView):
+class CreateUserView(IdempotentMixin, generics.CreateAPIView):
     """ create a new user in the system"""
     serializer_class = UserSerializer
 
@@ -13,14 +18,29 @@ class CreateTokenView(ObtainAuthToken):
     """ create a new auth token for user"""
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    # ObtainAuthToken turns throttling off, keep password guesses
+    # limited
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
 
 
-class ManageUserView(generics.RetrieveUpdateAPIView):
+class ManageUserView(IdempotentMixin,
+                     generics.RetrieveUpdateDestroyAPIView):
     """manage the authenticated user"""
     serializer_class = UserSerializer
-    authentication_classes = (authentication.TokenAuthentication, )
+    authentication_classes = (authentication.TokenAuthentication,
+                              BatchAuthentication)
     permission_classes = (permissions.IsAuthenticated, )
 
     def get_object(self):
         """ return authenticated user """
         return self.request.user
+
+    def destroy(self, request, *args, **kwargs):
+        """
+        Deactivate the authenticated user at once, their library is
+        deleted in the background
+        """
+        deletion.mark_user(request.user)
+        tasks.purge_user.enqueue(payload={'user_id': request.user.id})
+
+        return Response(status=status.HTTP_202_ACCEPTED)